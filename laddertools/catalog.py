@@ -0,0 +1,112 @@
+#
+# Copyright (C) 2022
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os.path as op
+import sqlite3
+from datetime import datetime
+
+from .replay import GamePlayerInfo, GameResult
+
+
+class ReplayCatalog:
+    """Persistent cache of parsed replays.
+
+    Replays are immutable once written by the game server, so the outcome of
+    `replay.get_result()` (or the reason it failed) only needs to be computed
+    once per file. Entries are keyed by the absolute path of the replay and
+    invalidated whenever its size or modification time changes.
+
+    The catalog is a standalone SQLite file so that it can be shared between
+    the different ladder databases built from the same replay directories,
+    including by concurrent runs: it is kept in WAL mode, waits for the lock
+    held by another writer, and its entries are committed by batches.
+    """
+
+    # Number of entries stored between two commits
+    commit_interval = 1000
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with open(op.join(op.dirname(__file__), "catalog.sql")) as f:
+            self._conn.executescript(f.read())
+        self._pending = 0
+
+    @staticmethod
+    def _key(filename, stat):
+        return op.abspath(filename), stat.st_size, stat.st_mtime_ns
+
+    def lookup(self, filename, stat):
+        """Returns a `(hit, result, error)` tuple for the given replay file.
+
+        `hit` is False if the replay is unknown or changed since it was
+        cataloged. Otherwise, exactly one of `result` (a `GameResult`) and
+        `error` (the message of the parsing failure) is set.
+        """
+        filename, size, mtime_ns = self._key(filename, stat)
+        row = self._conn.execute(
+            "SELECT * FROM replays WHERE filename=? AND size=? AND mtime_ns=?", (filename, size, mtime_ns)
+        ).fetchone()
+        if row is None:
+            return False, None, None
+        error = row[3]
+        if error is not None:
+            return True, None, error
+        start_time, end_time, map_uid, map_title = row[4:8]
+        p0 = GamePlayerInfo(*row[8:12])
+        p1 = GamePlayerInfo(*row[12:16])
+        result = GameResult(
+            datetime.fromisoformat(start_time),
+            datetime.fromisoformat(end_time),
+            filename,
+            p0,
+            p1,
+            map_uid,
+            map_title,
+        )
+        return True, result, None
+
+    def store(self, filename, stat, result=None, error=None):
+        """Record the outcome of parsing a replay file (either a `GameResult` or an error message)"""
+        key = self._key(filename, stat)
+        if result is None:
+            row = key + (error,) + (None,) * 12
+        else:
+            row = key + (
+                None,
+                result.start_time.isoformat(" "),
+                result.end_time.isoformat(" "),
+                result.map_uid,
+                result.map_title,
+                result.player0.fingerprint,
+                result.player0.display_name,
+                result.player0.faction,
+                result.player0.selected_faction,
+                result.player1.fingerprint,
+                result.player1.display_name,
+                result.player1.faction,
+                result.player1.selected_faction,
+            )
+        self._conn.execute("INSERT OR REPLACE INTO replays VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", row)
+        self._pending += 1
+        if self._pending >= self.commit_interval:
+            self._conn.commit()
+            self._pending = 0
+
+    def close(self):
+        self._conn.commit()
+        self._conn.close()
@@ -0,0 +1,18 @@
+CREATE TABLE IF NOT EXISTS replays (
+	filename              TEXT NOT NULL PRIMARY KEY,
+	size                  INTEGER NOT NULL,
+	mtime_ns              INTEGER NOT NULL,
+	error                 TEXT,
+	start_time            TEXT,
+	end_time              TEXT,
+	map_uid               TEXT,
+	map_title             TEXT,
+	fingerprint_0         TEXT,
+	display_name_0        TEXT,
+	faction_0             TEXT,
+	selected_faction_0    TEXT,
+	fingerprint_1         TEXT,
+	display_name_1        TEXT,
+	faction_1             TEXT,
+	selected_faction_1    TEXT
+);
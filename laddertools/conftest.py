@@ -0,0 +1,167 @@
+import io
+import re
+import sqlite3
+import struct
+
+import pytest
+
+from . import utils
+
+
+_FOOTER_TEMPLATE = """Root:
+\tMod: ra
+\tVersion: release-20210321
+\tMapUid: {map_uid}
+\tMapTitle: {map_title}
+\tFinalGameTick: 24000
+\tStartTimeUtc: {start_time}
+\tEndTimeUtc: {end_time}
+Player@0:
+\tClientIndex: 0
+\tName: {p0_name}
+\tIsHuman: True
+\tIsBot: False
+\tFactionName: {p0_faction}
+\tFactionId: {p0_faction_id}
+\tColor: FE1100
+\tTeam: 0
+\tSpawnPoint: 1
+\tIsRandomFaction: False
+\tIsRandomSpawnPoint: False
+\tFingerprint: {p0_fingerprint}
+\tOutcome: {p0_outcome}
+\tOutcomeTimestampUtc: {end_time}
+\tDisconnectFrame: 0
+Player@1:
+\tClientIndex: 1
+\tName: {p1_name}
+\tIsHuman: True
+\tIsBot: False
+\tFactionName: {p1_faction}
+\tFactionId: {p1_faction_id}
+\tColor: 1100FE
+\tTeam: 0
+\tSpawnPoint: 2
+\tIsRandomFaction: False
+\tIsRandomSpawnPoint: False
+\tFingerprint: {p1_fingerprint}
+\tOutcome: {p1_outcome}
+\tOutcomeTimestampUtc: {end_time}
+\tDisconnectFrame: 0
+"""
+
+
+def build_replay(
+    start_time="2022-03-01 10-00-00",
+    end_time="2022-03-01 10-20-00",
+    winner=("alice", "fp-alice"),
+    loser=("bob", "fp-bob"),
+    map_title="Test Map",
+    factions=("Soviet", "Allies"),
+    payload=b"\0" * 64,
+):
+    """Returns the content of a minimal replay file with the given winner and loser"""
+    footer = _FOOTER_TEMPLATE.format(
+        map_uid=map_title.lower().replace(" ", "-"),
+        map_title=map_title,
+        start_time=start_time,
+        end_time=end_time,
+        p0_name=winner[0],
+        p0_fingerprint=winner[1],
+        p0_outcome="Won",
+        p0_faction=factions[0],
+        p0_faction_id=factions[0].lower(),
+        p1_name=loser[0],
+        p1_fingerprint=loser[1],
+        p1_outcome="Lost",
+        p1_faction=factions[1],
+        p1_faction_id=factions[1].lower(),
+    ).encode()
+    length = len(footer) + 4
+    return payload + struct.pack("<iii", -1, 1, len(footer)) + footer + struct.pack("<ii", length, -2)
+
+
+@pytest.fixture
+def make_replay(tmp_path):
+    """Writes a replay (see `build_replay()` for the parameters) and returns its path"""
+    counter = iter(range(1 << 30))
+
+    def _make_replay(name=None, directory=None, **kwargs):
+        directory = tmp_path / "replays" if directory is None else directory
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / (name or f"replay-{next(counter):05d}.orarep")
+        path.write_bytes(build_replay(**kwargs))
+        return path
+
+    return _make_replay
+
+
+@pytest.fixture
+def fake_accounts(monkeypatch):
+    """Replaces the OpenRA account service: fingerprint "fp-<name>" is registered as player <name>
+
+    Returns the list of queried fingerprints.
+    """
+    queried = []
+
+    def _urlopen(url):
+        fingerprint = url.rsplit("/", 1)[-1]
+        queried.append(fingerprint)
+        name = fingerprint[len("fp-") :]
+        profile_id = sum(ord(c) << (8 * i) for i, c in enumerate(name[:3]))
+        info = f"Player:\n\tFingerprint: {fingerprint}\n\tProfileID: {profile_id}\n\tProfileName: {name}\n\tAvatar:\n"
+        return io.BytesIO(info.encode())
+
+    monkeypatch.setattr(utils, "urlopen", _urlopen)
+    return queried
+
+
+# Plan steps reading a whole table row by row, without the help of any index
+_FULL_SCAN = re.compile(r"^SCAN (\w+)$")
+_USED_INDEX = re.compile(r"USING (?:COVERING )?INDEX (\w+)")
+
+
+def trace_queries(monkeypatch):
+    """Records the SELECT queries run by the web applications, with their parameters bound"""
+    queries = []
+    connect = sqlite3.connect
+
+    def _connect(*args, **kwargs):
+        conn = connect(*args, **kwargs)
+        conn.set_trace_callback(lambda sql: queries.append((args[0], kwargs.get("uri", False), sql)))
+        return conn
+
+    monkeypatch.setattr(sqlite3, "connect", _connect)
+    return queries
+
+
+def get_query_plans(queries):
+    """Returns the steps of the query plans of the SELECT queries"""
+    steps = set()
+    for database, uri, sql in queries:
+        if not sql.lstrip().upper().startswith("SELECT"):
+            continue
+        conn = sqlite3.connect(database, uri=uri)
+        steps.update((detail, sql) for *_, detail in conn.execute("EXPLAIN QUERY PLAN " + sql))
+        conn.close()
+    return steps
+
+
+def get_full_scans(queries):
+    """Returns the (table, query) of the queries reading a whole table, without the help of any index"""
+    return {(match.group(1), sql) for detail, sql in get_query_plans(queries) if (match := _FULL_SCAN.match(detail))}
+
+
+def get_used_indexes(queries):
+    """Returns the names of the indexes used by the queries"""
+    return {match.group(1) for detail, _ in get_query_plans(queries) if (match := _USED_INDEX.search(detail))}
+
+
+def get_migration_indexes(database):
+    """Returns the names of the indexes of the database, except the automatic ones of the primary keys"""
+    conn = sqlite3.connect(database)
+    indexes = {
+        name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type='index' AND sql IS NOT NULL")
+    }
+    conn.close()
+    return indexes
@@ -18,19 +18,34 @@
 import argparse
 import datetime
 import hashlib
+import itertools
+import json
 import logging
+import os
 import os.path as op
-import shutil
+import re
 import sqlite3
+import sys
 from collections import UserDict
+from contextlib import ExitStack, closing
 from math import ceil
 
+import numpy as np
 from filelock import FileLock, Timeout
 
+from .catalog import ReplayCatalog
 from .ranking import ranking_systems
-from .replay import GamePlayerInfo
+from .replay import GamePlayerInfo, jobs_type
+from .payloads import pack_rating_history, write_payloads
+from .profiling import profile, stage
+from .schema import migrate
 from .utils import get_results, get_profile_ids
 
+# The chart of the player page leaves out the first games of the player, and resamples the others to a fixed number
+# of points
+_rating_chart_skipped_games = 10
+_rating_chart_points = 50
+
 
 class PlayerLookup(UserDict):
     """Connects a `GamePlayerInfo` (or its fingerprint) to a `_Player`.
@@ -74,6 +89,8 @@ class PlayerLookup(UserDict):
 
 
 class _Player:
+    __slots__ = ("profile_id", "name", "wins", "losses", "prv_rating", "rating", "avatar_url", "banned")
+
     def __init__(self, ranking, profile_id, name, avatar_url, banned=False):
         self.profile_id = profile_id
         self.name = name
@@ -105,18 +122,42 @@ class _Player:
         )
 
 
+def _result_hash(result):
+    return hashlib.sha256(result.filename.encode()).hexdigest()
+
+
 class _OutCome:
+    # Only the displayed values of the ratings are kept, the rating objects of every game would weigh much more
+    __slots__ = (
+        "_hash",
+        "_filename",
+        "_start_time",
+        "_end_time",
+        "_p0_profile_id",
+        "_p1_profile_id",
+        "_p0_rating0",
+        "_p1_rating0",
+        "_p0_rating1",
+        "_p1_rating1",
+        "_p0_faction",
+        "_p1_faction",
+        "_p0_selected_faction",
+        "_p1_selected_faction",
+        "_map_uid",
+        "_map_title",
+    )
+
     def __init__(self, result, p0, p1):
-        self._hash = hashlib.sha256(result.filename.encode()).hexdigest()
+        self._hash = _result_hash(result)
         self._filename = result.filename
         self._start_time = result.start_time
         self._end_time = result.end_time
         self._p0_profile_id = p0.profile_id
         self._p1_profile_id = p1.profile_id
-        self._p0_rating0 = p0.prv_rating
-        self._p1_rating0 = p1.prv_rating
-        self._p0_rating1 = p0.rating
-        self._p1_rating1 = p1.rating
+        self._p0_rating0 = p0.prv_rating.display_value
+        self._p1_rating0 = p1.prv_rating.display_value
+        self._p0_rating1 = p0.rating.display_value
+        self._p1_rating1 = p1.rating.display_value
         self._p0_faction = result.player0.faction
         self._p1_faction = result.player1.faction
         self._p0_selected_faction = result.player0.selected_faction
@@ -124,6 +165,10 @@ class _OutCome:
         self._map_uid = result.map_uid
         self._map_title = result.map_title
 
+    @property
+    def hash(self):
+        return self._hash
+
     @staticmethod
     def _sql_date_fmt(dt):
         return dt.strftime("%Y-%m-%d %H:%M:%S")
@@ -137,10 +182,10 @@ class _OutCome:
             self._filename,
             self._p0_profile_id,
             self._p1_profile_id,
-            self._p0_rating0.display_value,
-            self._p1_rating0.display_value,
-            self._p0_rating1.display_value,
-            self._p1_rating1.display_value,
+            self._p0_rating0,
+            self._p1_rating0,
+            self._p0_rating1,
+            self._p1_rating1,
             self._p0_faction,
             self._p1_faction,
             self._p0_selected_faction,
@@ -149,30 +194,144 @@ class _OutCome:
             self._map_title,
         )
 
+    @property
+    def player_games_sql_rows(self):
+        """One row for each player of the game, from their point of view"""
+        end_time = self._sql_date_fmt(self._end_time)
+        duration = round((self._end_time - self._start_time).total_seconds())
+        return (
+            (
+                self._p0_profile_id,
+                end_time,
+                self._hash,
+                0,
+                True,
+                self._p1_profile_id,
+                self._p0_rating0,
+                self._p0_rating1,
+                self._p0_faction,
+                self._p0_selected_faction,
+                self._map_uid,
+                self._map_title,
+                duration,
+            ),
+            (
+                self._p1_profile_id,
+                end_time,
+                self._hash,
+                1,
+                False,
+                self._p0_profile_id,
+                self._p1_rating0,
+                self._p1_rating1,
+                self._p1_faction,
+                self._p1_selected_faction,
+                self._map_uid,
+                self._map_title,
+                duration,
+            ),
+        )
+
+
+# Number of most recent rating checkpoints kept, see `_get_obsolete_checkpoints()`
+_RECENT_CHECKPOINTS = 4
+
+
+def _chain_digest(digest, result_hash):
+    """Returns the digest identifying a series of games from the one of the previous games and the new game hash"""
+    return hashlib.sha256((digest + result_hash).encode()).hexdigest()
+
+
+class _Checkpoint:
+    """Saved state of the ranking after the first `game_index` games, identified by their chained `digest`"""
+
+    def __init__(self, game_index, end_time, digest, state):
+        self.game_index = game_index
+        self.end_time = end_time
+        self.digest = digest
+        self.state = state  # JSON, see `_dump_checkpoint_state()`
+
+    @property
+    def sql_row(self):
+        return (self.game_index, self.end_time, self.digest, self.state)
+
+
+def _dump_checkpoint_state(state, players):
+    """Serializes the ranking `state` along with the players having played so far"""
+    ranking_state = dict(state, ratings={p.profile_id: r.state for p, r in state["ratings"].items()})
+    players_state = {
+        p.profile_id: [p.name, p.avatar_url, p.wins, p.losses, p.prv_rating.state, p.rating.state]
+        for p in players
+        if p.wins or p.losses
+    }
+    return json.dumps(dict(players=players_state, ranking=ranking_state))
 
-def _get_players_outcomes(accounts_db, results, ranking_system):
 
-    ranking = ranking_systems[ranking_system]()
+def _load_checkpoint_state(state, ranking, player_lookup):
+    """Registers the players of a checkpoint state into the lookup, and returns the ranking state"""
+    state = json.loads(state)
+    for profile_id, (name, avatar_url, wins, losses, prv_state, rating_state) in state["players"].items():
+        player = _Player(ranking, int(profile_id), name, avatar_url)
+        player.wins = wins
+        player.losses = losses
+        player.prv_rating = ranking.get_rating_from_state(prv_state)
+        player.rating = ranking.get_rating_from_state(rating_state)
+        player_lookup[player.profile_id] = player
+    ranking_state = state["ranking"]
+    ranking_state["ratings"] = {
+        player_lookup[int(profile_id)]: ranking.get_rating_from_state(rating_state)
+        for profile_id, rating_state in ranking_state["ratings"].items()
+    }
+    return ranking_state
+
+
+def _get_players_outcomes(accounts_db, results, ranking, checkpoint=None):
+    """Ranks the players from the (ordered) results
+
+    If a `_Checkpoint` is specified, the results are the games following it and the ranking continues from its state.
+
+    Returns the players, the outcomes of the results, and the new checkpoints. The outcomes are generated as the
+    ratings are computed, so that they can be inserted without holding them all in memory (the ratings themselves are
+    streamed by the ranking systems yielding them, see `RankingBase.resume_ratings_from_series_of_games()`): the
+    players and the checkpoints are only complete once all the outcomes have been consumed.
+    """
 
     player_lookup = PlayerLookup(accounts_db, ranking)
-    outcomes = []
-
-    ratings = ranking.compute_ratings_from_series_of_games(results, player_lookup)
-
-    for result, (r0, r1) in zip(results, ratings):
-        p0 = player_lookup[result.player0]
-        p1 = player_lookup[result.player1]
-        p0.update_rating(r0)
-        p1.update_rating(r1)
-        p0.wins += 1
-        p1.losses += 1
-        outcomes.append(_OutCome(result, p0, p1))
+    checkpoints = []
+
+    state = None
+    game_index, digest = 0, ""
+    if checkpoint is not None:
+        state = _load_checkpoint_state(checkpoint.state, ranking, player_lookup)
+        game_index, digest = checkpoint.game_index, checkpoint.digest
+
+    def _iter_outcomes(digest):
+        checkpoint_states = {}
+        ratings = ranking.resume_ratings_from_series_of_games(results, player_lookup, state, checkpoint_states)
+
+        for i, (result, (r0, r1)) in enumerate(zip(results, ratings), 1):
+            p0 = player_lookup[result.player0]
+            p1 = player_lookup[result.player1]
+            p0.update_rating(r0)
+            p1.update_rating(r1)
+            p0.wins += 1
+            p1.losses += 1
+            outcome = _OutCome(result, p0, p1)
+            digest = _chain_digest(digest, outcome.hash)
+            if i in checkpoint_states:
+                checkpoint_state = _dump_checkpoint_state(checkpoint_states.pop(i), player_lookup.values())
+                end_time = _OutCome._sql_date_fmt(result.end_time)
+                checkpoints.append(_Checkpoint(game_index + i, end_time, digest, checkpoint_state))
+                obsolete = set(_get_obsolete_checkpoints([(c.game_index, c.end_time) for c in checkpoints]))
+                checkpoints[:] = [c for c in checkpoints if c.game_index not in obsolete]
+            yield outcome
+
     players = player_lookup.values()
-    return players, outcomes
+    return players, _iter_outcomes(digest), checkpoints
 
 
-def _preprocess_period(args):
-    """Forms CLI arguments "period", "start", and "end" into a dictionary
+def _get_period_dict(period, start=None, end=None):
+    """Forms a period name and optional start/end ISO dates into a dictionary
 
     Possible combinations:
         - period in {1m, 2m}, start and end missing: returns the 1 or 2 month period
@@ -184,64 +343,451 @@ def _preprocess_period(args):
     Returns a dict with elements, "name" (str), "start", "end" (datetime.date)
     """
     today = datetime.date.today()
-    if args.start:
-        start = datetime.date.fromisoformat(args.start)
-        if args.end:
-            end = datetime.date.fromisoformat(args.end)
+    if start:
+        start = datetime.date.fromisoformat(start)
+        if end:
+            end = datetime.date.fromisoformat(end)
         else:
             end = today + datetime.timedelta(days=1)
     else:
-        if args.period == "1m":
+        if period == "1m":
             start = datetime.date(today.year, today.month, 1)
-        elif args.period == "2m":
+        elif period == "2m":
             start_month = ((today.month - 1) & ~1) + 1
             start = datetime.date(today.year, start_month, 1)
         else:
             start = datetime.date(year=1990, month=1, day=1)
         end = today + datetime.timedelta(days=1)
-    return {"name": args.period, "start": start, "end": end}
+    return {"name": period, "start": start, "end": end}
 
 
-def _main(args):
-    conn = sqlite3.connect(args.database)
+def _preprocess_period(args):
+    """Forms CLI arguments "period", "start", and "end" into a dictionary (see `_get_period_dict()`)"""
+    return _get_period_dict(args.period, args.start, args.end)
 
-    c = conn.cursor()
 
-    # We don't know if the new submitted replays will be properly ordered, so
-    # all the information needs to be reconstructed
-    c.execute("DROP TABLE IF EXISTS players")
-    c.execute("DROP TABLE IF EXISTS outcomes")
+def _open_catalog(args, database):
+    """Opens the replay catalog, stored by default alongside the database unless disabled"""
+    if args.no_catalog:
+        return None
+    catalog_path = args.catalog or op.join(op.dirname(op.abspath(database)), "replays-catalog.sqlite3")
+    return ReplayCatalog(catalog_path)
+
 
-    with open(args.schema) as f:
-        c.executescript(f.read())
+def _open_database(database, schema):
+    conn = sqlite3.connect(database)
+    # Let the web application read the database while it is being updated
+    conn.execute("PRAGMA journal_mode=WAL")
+    with open(schema) as f:
+        conn.executescript(f.read())
+    return conn
 
+
+def _load_accounts(conn):
     # Re-use the cached OpenRA account information to prevent stressing too
     # much the service
-    request_accounts = c.execute("SELECT * FROM accounts")
-    accounts_db = {fp: (pid, pname, avatar_url) for fp, pid, pname, avatar_url in request_accounts.fetchall()}
+    request_accounts = conn.execute("SELECT * FROM accounts")
+    return {fp: (pid, pname, avatar_url) for fp, pid, pname, avatar_url in request_accounts.fetchall()}
+
+
+def _find_checkpoint(conn, results, hashes, ranking):
+    """Returns the latest stored `_Checkpoint` the ranking of the (ordered) results can continue from, if any
+
+    The games covered by a checkpoint must still be exactly the first ones of the results.
+    """
+    stored_digests = dict(conn.execute("SELECT game_index, digest FROM rating_checkpoints"))
+    candidates = []
+    digest = ""
+    for game_index, result_hash in enumerate(hashes, 1):
+        digest = _chain_digest(digest, result_hash)
+        if stored_digests.get(game_index) == digest:
+            candidates.append(game_index)
+
+    for game_index in reversed(candidates):
+        row = conn.execute("SELECT * FROM rating_checkpoints WHERE game_index=?", (game_index,)).fetchone()
+        checkpoint = _Checkpoint(*row)
+        if ranking.can_resume(json.loads(checkpoint.state)["ranking"], results[game_index:]):
+            return checkpoint
+    return None
 
-    period_dict = _preprocess_period(args)
-    results = get_results(accounts_db, args.replays, period_dict)
 
-    players, outcomes = _get_players_outcomes(accounts_db, results, args.ranking)
+def _get_checkpoint_season(end_time):
+    """Returns the 2-month season (see `_get_season_periods()`) of a checkpoint from its SQL formatted end time"""
+    return end_time[:4], (int(end_time[5:7]) - 1) // 2
 
-    if args.bans_file:
-        banned_profiles = get_profile_ids(args.bans_file)
+
+def _get_obsolete_checkpoints(checkpoints):
+    """Returns the game indexes of the checkpoints to remove from the (game_index, end_time) ones, ordered by game
+
+    Each checkpoint holds the state of every player: only the most recent ones are kept (late replays usually follow
+    the last games closely), along with the last checkpoint of each season before them.
+    """
+    return [
+        game_index
+        for (game_index, end_time), (_, next_end_time) in zip(checkpoints[:-_RECENT_CHECKPOINTS], checkpoints[1:])
+        if _get_checkpoint_season(end_time) == _get_checkpoint_season(next_end_time)
+    ]
+
+
+def _prune_checkpoints(conn):
+    """Removes the stored checkpoints which are not worth keeping, see `_get_obsolete_checkpoints()`"""
+    checkpoints = conn.execute("SELECT game_index, end_time FROM rating_checkpoints ORDER BY game_index").fetchall()
+    conn.executemany(
+        "DELETE FROM rating_checkpoints WHERE game_index=?", [(i,) for i in _get_obsolete_checkpoints(checkpoints)]
+    )
+
+
+def _apply_bans(players, bans_file):
+    if bans_file:
+        banned_profiles = get_profile_ids(bans_file)
         for player in players:
             player.banned = player.profile_id in banned_profiles
 
-    outcomes_sql = [o.sql_row for o in outcomes]
-    players_sql = [p.sql_row for p in players]
-    accounts_sql = [(fp, acc[0], acc[1], acc[2]) for fp, acc in accounts_db.items() if acc is not None]
 
+def _get_ladder_info(ranking_system, period_dict):
+    """Returns the parameters the ratings depend on, which must not change for an incremental update"""
+    period_start = period_dict["start"] if period_dict else None
+    return dict(ranking=ranking_system, period_start=str(period_start))
+
+
+# Number of outcomes inserted at once, see `_insert_outcomes()`
+_OUTCOMES_CHUNK_SIZE = 10000
+
+
+def _insert_outcomes(conn, outcomes):
+    """Inserts the outcomes (and their player games) by chunks as they are generated, returns their number"""
+    outcomes = iter(outcomes)
+    count = 0
+    c = conn.cursor()
+    while chunk := list(itertools.islice(outcomes, _OUTCOMES_CHUNK_SIZE)):
+        c.executemany(
+            "INSERT OR IGNORE INTO outcomes VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", (o.sql_row for o in chunk)
+        )
+        c.executemany(
+            "INSERT OR IGNORE INTO player_games VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)",
+            (row for o in chunk for row in o.player_games_sql_rows),
+        )
+        count += len(chunk)
+    return count
+
+
+def _insert_rows(conn, accounts_db, players, checkpoints, ladder_info):
+    """Inserts the rows known once all the outcomes are inserted (see `_insert_outcomes()`)"""
+    players_sql = (p.sql_row for p in players)
+    checkpoints_sql = (c.sql_row for c in checkpoints)
+    accounts_sql = ((fp, acc[0], acc[1], acc[2]) for fp, acc in accounts_db.items() if acc is not None)
+
+    c = conn.cursor()
     c.executemany("INSERT OR IGNORE INTO accounts VALUES (?,?,?,?)", accounts_sql)
-    c.executemany("INSERT OR IGNORE INTO players VALUES (?,?,?,?,?,?,?,?)", players_sql)
-    c.executemany("INSERT OR IGNORE INTO outcomes VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", outcomes_sql)
+    c.executemany("INSERT OR REPLACE INTO players VALUES (?,?,?,?,?,?,?,?)", players_sql)
+    c.executemany("INSERT OR REPLACE INTO rating_checkpoints VALUES (?,?,?,?)", checkpoints_sql)
+    c.executemany("INSERT OR REPLACE INTO ladder_info VALUES (?,?)", ladder_info.items())
+
+
+def _write_player_stats(conn):
+    """Aggregates the players and player_games tables into the player_stats table
+
+    The rank is dense and only accounts for the players who are not banned, who get a NULL rank. The factions column
+    is a JSON object mapping the selected factions to the number of games, and the maps column a JSON object mapping
+    the map titles to the numbers of wins and losses.
+    """
+    conn.execute("DELETE FROM player_stats")
+    conn.execute(
+        """
+        INSERT INTO player_stats
+        WITH
+        games AS (
+            SELECT profile_id, AVG(duration) AS avg_duration, MIN(end_time) AS first_game, MAX(end_time) AS last_game
+            FROM player_games GROUP BY profile_id
+        ),
+        factions AS (
+            SELECT profile_id, json_group_object(selected_faction, count) AS factions
+            FROM (
+                SELECT profile_id, selected_faction, COUNT(*) AS count
+                FROM player_games GROUP BY profile_id, selected_faction
+            )
+            GROUP BY profile_id
+        ),
+        maps AS (
+            SELECT profile_id, json_group_object(map_title, json_array(wins, losses)) AS maps
+            FROM (
+                SELECT profile_id, map_title, SUM(won) AS wins, SUM(NOT won) AS losses
+                FROM player_games GROUP BY profile_id, map_title
+            )
+            GROUP BY profile_id
+        )
+        SELECT
+            p.profile_id,
+            CASE WHEN p.banned THEN NULL ELSE DENSE_RANK() OVER (PARTITION BY p.banned ORDER BY p.rating DESC) END,
+            g.avg_duration,
+            g.first_game,
+            g.last_game,
+            f.factions,
+            m.maps
+        FROM players p
+        JOIN games g ON g.profile_id = p.profile_id
+        JOIN factions f ON f.profile_id = p.profile_id
+        JOIN maps m ON m.profile_id = p.profile_id
+        """
+    )
+
+
+def _scaled(a, m):
+    n = len(a)
+    nr = range(n)
+    mr = [x * n / m for x in range(m)]
+    return [round(x) for x in np.interp(mr, nr, a)]
+
+
+def _write_player_ratings(conn):
+    """Stores the rating history of every player into the player_ratings table
+
+    The history column holds every game of the player (see `payloads.pack_rating_history()`), and the chart column
+    the JSON array of the ratings charted on the player page: the first games are left out, and the others resampled
+    to a fixed number of points. It is NULL for the players without enough games.
+    """
+    conn.execute("DELETE FROM player_ratings")
+    cur = conn.execute(
+        """
+        SELECT profile_id, CAST(strftime('%s', end_time) AS INTEGER), rating
+        FROM player_games
+        ORDER BY profile_id, end_time, hash
+        """
+    )
+    rows = []
+    for profile_id, games in itertools.groupby(cur, key=lambda game: game[0]):
+        points = [(end_time, rating) for _, end_time, rating in games]
+        ratings = [rating for _, rating in points[_rating_chart_skipped_games:]]
+        chart = json.dumps(_scaled(ratings, _rating_chart_points)) if ratings else None
+        rows.append((profile_id, pack_rating_history(points), chart))
+    conn.executemany("INSERT INTO player_ratings VALUES (?,?,?)", rows)
+
+
+def _write_global_stats(conn):
+    """Aggregates the whole ladder into the small global_* and daily_activity tables read by the stats page
+
+    The faction histogram counts the factions selected by both players of every game, and the daily activity has a
+    row for every day between the first and the last game, including the days without any game.
+    """
+    for table in ("global_stats", "global_faction_stats", "global_map_stats", "daily_activity"):
+        conn.execute(f"DELETE FROM {table}")
+    conn.execute(
+        """
+        INSERT INTO global_stats
+        SELECT
+            (SELECT COUNT(*) FROM outcomes),
+            (SELECT COUNT(*) FROM players WHERE NOT banned),
+            (SELECT AVG((julianday(end_time) - julianday(start_time)) * 86400) FROM outcomes)
+        """
+    )
+    conn.execute(
+        """
+        INSERT INTO global_faction_stats
+        SELECT selected_faction, COUNT(*) FROM player_games GROUP BY selected_faction
+        """
+    )
+    conn.execute("INSERT INTO global_map_stats SELECT map_title, COUNT(*) FROM outcomes GROUP BY map_title")
+    conn.execute(
+        """
+        INSERT INTO daily_activity
+        WITH RECURSIVE
+        games AS (SELECT date(end_time) AS date, COUNT(*) AS count FROM outcomes GROUP BY 1),
+        days(date) AS (
+            SELECT MIN(date) FROM games
+            UNION ALL
+            SELECT date(date, '+1 day') FROM days WHERE date < (SELECT MAX(date) FROM games)
+        )
+        SELECT days.date, COALESCE(games.count, 0)
+        FROM days LEFT JOIN games ON games.date = days.date
+        WHERE days.date IS NOT NULL
+        """
+    )
+
+
+def _fsync(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_database(conn, database, schema, accounts_db, results, ranking_system, bans_file, period_dict):
+    """Ranks the players from the (ordered) results and publishes a new database with everything
+
+    The new database is built into a temporary file which then atomically replaces the published one (opened with
+    `conn`), so readers never see a partially written database nor get blocked during the build. Returns False when
+    the published database could not be replaced.
+    """
+    tmp_database = database + ".tmp"
+    if op.exists(tmp_database):
+        os.remove(tmp_database)
+    tmp_conn = sqlite3.connect(tmp_database)
+    with stage("sql write"):
+        # Bulk load: a failed build leaves nothing to recover, the temporary file is simply discarded
+        tmp_conn.execute("PRAGMA journal_mode=OFF")
+        tmp_conn.execute("PRAGMA synchronous=OFF")
+        with open(schema) as f:
+            tmp_conn.executescript(f.read())
+
+    with stage("ranking") as s:
+        # The outcomes are inserted as they are ranked
+        ranking = ranking_systems[ranking_system]()
+        players, outcomes, checkpoints = _get_players_outcomes(accounts_db, results, ranking)
+        s.items = _insert_outcomes(tmp_conn, outcomes)
+        _apply_bans(players, bans_file)
 
+    with stage("sql write") as s:
+        ladder_info = _get_ladder_info(ranking_system, period_dict)
+        _insert_rows(tmp_conn, accounts_db, players, checkpoints, ladder_info)
+        _write_player_stats(tmp_conn)
+        _write_player_ratings(tmp_conn)
+        _write_global_stats(tmp_conn)
+        tmp_conn.commit()
+        # Indexes are created by the migrations, which are faster to run once everything is loaded
+        migrate(tmp_conn, "ladder")
+        s.items = len(results)
+    with stage("commit"):
+        tmp_conn.execute("PRAGMA journal_mode=WAL")
+        tmp_conn.close()
+        _fsync(tmp_database)
+
+    # The WAL file of the published database must be empty when it gets replaced, otherwise its pages would be
+    # applied to the new database
+    busy, _, _ = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    conn.close()
+    if busy:
+        logging.error("Could not checkpoint %s, %s is left unpublished", database, tmp_database)
+        return False
+    with stage("commit"):
+        os.replace(tmp_database, database)
+        _fsync(op.dirname(op.abspath(database)))
+    return True
+
+
+def _update_database(conn, accounts_db, results, ranking_system, bans_file, period_dict):
+    """Updates the database with the results, recomputing the ratings from the nearest stored checkpoint
+
+    New results happening after the ones already recorded only need their own ranking, while an older replay (or a
+    missing one) implies recomputing the games following it. Returns False (and leaves the database untouched) when
+    no checkpoint can be used and a full rebuild is required.
+    """
+    ladder_info = dict(conn.execute("SELECT key, value FROM ladder_info"))
+    if ladder_info != _get_ladder_info(ranking_system, period_dict):
+        logging.info(f"Ladder parameters changed (previously {ladder_info})")
+        return False
+
+    migrate(conn, "ladder")
+
+    with stage("ranking"):
+        ranking = ranking_systems[ranking_system]()
+        hashes = [_result_hash(r) for r in results]
+        checkpoint = _find_checkpoint(conn, results, hashes, ranking)
+        if checkpoint is None:
+            logging.info("No checkpoint to continue from")
+            return False
+
+        game_index = checkpoint.game_index
+        kept_hashes = set(hashes[:game_index])
+        obsolete_outcomes = [
+            row
+            for row in conn.execute("SELECT hash, profile_id0, profile_id1, end_time FROM outcomes")
+            if row[0] not in kept_hashes
+        ]
+
+    with stage("sql write"):
+        c = conn.cursor()
+        c.executemany("DELETE FROM outcomes WHERE hash=?", [(h,) for h, _, _, _ in obsolete_outcomes])
+        c.executemany(
+            "DELETE FROM player_games WHERE profile_id IN (?,?) AND end_time=? AND hash=?",
+            [(pid0, pid1, end_time, h) for h, pid0, pid1, end_time in obsolete_outcomes],
+        )
+        c.execute("DELETE FROM players")
+        c.execute("DELETE FROM rating_checkpoints WHERE game_index>?", (game_index,))
+
+    with stage("ranking") as s:
+        # The outcomes are inserted as they are ranked
+        players, outcomes, checkpoints = _get_players_outcomes(accounts_db, results[game_index:], ranking, checkpoint)
+        ranked = s.items = _insert_outcomes(conn, outcomes)
+        _apply_bans(players, bans_file)
+
+    with stage("sql write") as s:
+        _insert_rows(conn, accounts_db, players, checkpoints, ladder_info)
+        _write_player_stats(conn)
+        _write_player_ratings(conn)
+        _write_global_stats(conn)
+        _prune_checkpoints(conn)
+        s.items = ranked
+    logging.info(f"Ranked {ranked} outcomes from game #{game_index}")
+
+    with stage("commit"):
+        conn.commit()
+        # Empty the WAL file while we are at it, so that the next full rebuild can be published without waiting
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.close()
+    return True
+
+
+def _get_season_id(database):
+    """Returns the season of a database named db-{mod}-{season}.sqlite3 ("all", "2m", "2022-1", ...)"""
+    name = op.basename(database)
+    match = re.fullmatch(r"db-[^-]+-(.+)\.sqlite3", name)
+    return match.group(1) if match else name
+
+
+def _update_summary(summary, database, season):
+    """Copies the per-player statistics of a (published) season database into the cross-season summary database"""
+    conn = sqlite3.connect(summary, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    with open(op.join(op.dirname(__file__), "summary.sql")) as f:
+        conn.executescript(f.read())
+    conn.execute("ATTACH DATABASE ? AS season", (database,))
+    conn.execute("DELETE FROM season_players WHERE season=?", (season,))
+    conn.execute(
+        """
+        INSERT INTO season_players
+        SELECT p.profile_id, :season, s.rank, p.rating, p.wins, p.losses, s.avg_game_duration
+        FROM season.players p JOIN season.player_stats s ON s.profile_id = p.profile_id
+        """,
+        dict(season=season),
+    )
     conn.commit()
+    conn.execute("DETACH DATABASE season")
     conn.close()
 
 
+def _main(args):
+    """Updates the database from the replays, returns False when it could not be published"""
+    conn = _open_database(args.database, args.schema)
+    # Without any cached account, the account of every player is requested again
+    accounts_db = {} if args.refresh_accounts else _load_accounts(conn)
+
+    period_dict = _preprocess_period(args)
+    catalog = _open_catalog(args, args.database)
+    try:
+        results = get_results(accounts_db, args.replays, period_dict, catalog, args.jobs)
+    finally:
+        if catalog is not None:
+            catalog.close()
+
+    updated = (
+        args.incremental
+        and not args.refresh_accounts
+        and _update_database(conn, accounts_db, results, args.ranking, args.bans_file, period_dict)
+    )
+    if not updated and not _write_database(
+        conn, args.database, args.schema, accounts_db, results, args.ranking, args.bans_file, period_dict
+    ):
+        return False
+    if args.summary:
+        with stage("summary"):
+            _update_summary(args.summary, args.database, args.season or _get_season_id(args.database))
+    if args.json_dir:
+        with stage("payloads"):
+            write_payloads(args.database, args.json_dir)
+    return True
+
+
 def run():
     logging.basicConfig(level="INFO")
     parser = argparse.ArgumentParser()
@@ -252,7 +798,30 @@ def run():
     parser.add_argument("--start")
     parser.add_argument("--end")
     parser.add_argument("--bans-file")
+    parser.add_argument("--catalog", help="Replay catalog file (defaults to replays-catalog.sqlite3 next to the DB)")
+    parser.add_argument("--no-catalog", action="store_true", help="Parse all the replays without using the catalog")
+    parser.add_argument(
+        "-j", "--jobs", type=jobs_type, default=1, help="Number of replay decoding processes (0: one per CPU)"
+    )
+    parser.add_argument(
+        "-i",
+        "--incremental",
+        action="store_true",
+        help="Only rank the games following the nearest checkpoint, instead of reconstructing the whole database",
+    )
+    parser.add_argument(
+        "--refresh-accounts",
+        action="store_true",
+        help="Request the account of every player again instead of using the cached ones (implies a reconstruction)",
+    )
+    parser.add_argument("--summary", help="Cross-season summary database to update with the player statistics")
+    parser.add_argument(
+        "--season", help="Season of the database in the summary (defaults to {season} from db-{mod}-{season}.sqlite3)"
+    )
+    parser.add_argument("--json-dir", help="Directory where to write the JSON payloads of the web application")
     parser.add_argument("-l", "--log-level", default="WARNING")
+    parser.add_argument("--profile", help="JSON file where to write the timings of the stages")
+    parser.add_argument("--profile-stage", help="Stage whose cProfile statistics are dumped into {profile}.pstats")
     parser.add_argument("replays", nargs="*")
     args = parser.parse_args()
 
@@ -261,10 +830,58 @@ def run():
     lockfile = args.database + ".lock"
     lock = FileLock(lockfile, timeout=1)
     try:
-        with lock:
-            _main(args)
+        with lock, profile(args.profile, args.profile_stage):
+            published = _main(args)
     except Timeout:
         logging.error("Another instance of this application currently holds the %s lock file.", lockfile)
+        sys.exit(1)
+    if not published:
+        sys.exit(1)
+
+
+def _get_season_periods(mod, year, start_month):
+    """Returns the (database filename, period dictionary) of each 2-month season of the year from the start month on
+
+    Seasons starting in the future are omitted.
+    """
+    # Correct to previous month for even-numbered months (February, April, ...)
+    start_month = start_month - (start_month & 1 == 0)
+
+    start_date = datetime.date(year=year, month=start_month, day=1)
+    season_counter = ceil(start_month / 2)
+    seasons = []
+
+    while True:
+        # calculate the seasons end date (start + 2 months - 1 day)
+        end_date = datetime.date(start_date.year, (start_date.month + 2) % 12, start_date.day)
+        # in case we have reached January again, update year
+        if end_date.month == 1:
+            end_date = end_date.replace(year=end_date.year + 1)
+        end_date -= datetime.timedelta(days=1)
+
+        db_name = f"db-{mod}-{start_date.year}-{season_counter}.sqlite3"
+        seasons.append((db_name, _get_period_dict("", str(start_date), str(end_date))))
+
+        start_date = start_date.replace(month=(start_date.month + 2) % 12)
+        season_counter += 1
+
+        # stop the loop if we completed a year or if the start date is in the future
+        if start_date.month == 1 or start_date > datetime.date.today():
+            break
+
+    return seasons
+
+
+def _partition_results(results, periods):
+    """Splits the (ordered) results into one list per period, in a single pass over the results"""
+    partitions = [[] for _ in periods]
+    bounds = [(period["start"], period["end"], partition) for period, partition in zip(periods, partitions)]
+    for result in results:
+        end_date = result.end_time.date()
+        for start, end, partition in bounds:
+            if start <= end_date <= end:
+                partition.append(result)
+    return partitions
 
 
 def initialize_periodic_databases():
@@ -279,6 +896,13 @@ def initialize_periodic_databases():
     If invoked with a start month that does not mark the beginning of one of these periods, it will get corrected by
     subtracting one month so that the resulting DB files will be true to the defined format/content.
 
+    The replays are parsed only once: the results are then partitioned by season, and each season is ranked
+    independently before being written to its own database file. The all-time and current season databases can be
+    generated in the same pass with the "all-time" and "current-season" flags.
+
+    The statistics of the players in each season are also copied into the db-{mod}-summary.sqlite3 database, from
+    which the web application reads the season history of the players.
+
     For less customized database file creation, refer to the `ora-ladder` CLI tool utilizing "start" and "end"
     parameters.
     """
@@ -286,64 +910,136 @@ def initialize_periodic_databases():
     parser.add_argument("-s", "--schema", default=op.join(op.dirname(__file__), "ladder.sql"))
     parser.add_argument("-r", "--ranking", choices=ranking_systems.keys(), default="trueskill")
     parser.add_argument("--bans-file")
+    parser.add_argument("--catalog", help="Replay catalog file (defaults to replays-catalog.sqlite3 next to the DB)")
+    parser.add_argument("--no-catalog", action="store_true", help="Parse all the replays without using the catalog")
+    parser.add_argument(
+        "-j", "--jobs", type=jobs_type, default=1, help="Number of replay decoding processes (0: one per CPU)"
+    )
     parser.add_argument("-m", "--mod", default="ra")
     parser.add_argument("-y", "--year", type=int, default=datetime.date.today().year)
     parser.add_argument("--start-month", type=int, default="1", help="Number between 1 and 12")
+    parser.add_argument("--all-time", action="store_true", help="Also create the db-{mod}-all.sqlite3 database")
+    parser.add_argument("--current-season", action="store_true", help="Also create the db-{mod}-2m.sqlite3 database")
+    parser.add_argument("--json-dir", help="Directory where to write the JSON payloads of the web application")
     parser.add_argument("-l", "--log-level", default="WARNING")
+    parser.add_argument("--profile", help="JSON file where to write the timings of the stages")
+    parser.add_argument("--profile-stage", help="Stage whose cProfile statistics are dumped into {profile}.pstats")
     parser.add_argument("replays", nargs="*")
     args = parser.parse_args()
 
     logging.basicConfig(level=args.log_level)
 
-    # Correct to previous month for even-numbered months (February, April, ...)
-    start_month = args.start_month - (args.start_month & 1 == 0)
+    periods = _get_season_periods(args.mod, args.year, args.start_month)
+    if args.all_time:
+        periods.append((f"db-{args.mod}-all.sqlite3", _get_period_dict("all")))
+    if args.current_season:
+        periods.append((f"db-{args.mod}-2m.sqlite3", _get_period_dict("2m")))
 
-    start_date = datetime.date(year=args.year, month=start_month, day=1)
-    season_counter = ceil(start_month / 2)
-    prev_db_name = None
+    unpublished = []
+    with ExitStack() as stack:
+        stack.enter_context(profile(args.profile, args.profile_stage))
+        databases = []
+        for db_name, period_dict in periods:
+            lockfile = db_name + ".lock"
+            try:
+                stack.enter_context(FileLock(lockfile, timeout=1))
+            except Timeout:
+                logging.error("Another instance of this application currently holds the %s lock file.", lockfile)
+                unpublished.append(db_name)
+                continue
+            databases.append((db_name, period_dict, _open_database(db_name, args.schema)))
 
-    while True:
-        # calculate the seasons end date (start + 2 months - 1 day)
-        end_date = datetime.date(start_date.year, (start_date.month + 2) % 12, start_date.day)
-        # in case we have reached January again, update year
-        if end_date.month == 1:
-            end_date = end_date.replace(year=end_date.year + 1)
-        end_date -= datetime.timedelta(days=1)
+        if not databases:
+            sys.exit(1)
+
+        # Merge the cached accounts of all the databases to reduce API calls to the OpenRA user account service
+        accounts_db = {}
+        for _, _, conn in databases:
+            accounts_db.update(_load_accounts(conn))
+
+        catalog = _open_catalog(args, databases[0][0])
+        try:
+            results = get_results(accounts_db, args.replays, None, catalog, args.jobs)
+        finally:
+            if catalog is not None:
+                catalog.close()
+
+        partitions = _partition_results(results, [period_dict for _, period_dict, _ in databases])
+        for (db_name, period_dict, conn), period_results in zip(databases, partitions):
+            if not _write_database(
+                conn, db_name, args.schema, accounts_db, period_results, args.ranking, args.bans_file, period_dict
+            ):
+                unpublished.append(db_name)
+                continue
+            with stage("summary"):
+                _update_summary(f"db-{args.mod}-summary.sqlite3", db_name, _get_season_id(db_name))
+            if args.json_dir:
+                with stage("payloads"):
+                    write_payloads(db_name, args.json_dir)
+            logging.info(
+                f"Created database file {db_name} using "
+                f"start date {period_dict['start']}, end date {period_dict['end']}, source "
+                f"folder {args.replays}."
+            )
+    if unpublished:
+        logging.error("Some databases could not be published: %s", ", ".join(unpublished))
+        sys.exit(1)
 
-        # prepare arguments for creating the actual database files
-        db_name = f"db-{args.mod}-{start_date.year}-{season_counter}.sqlite3"
 
-        # If the first database from the batch has already been created, copy that to use it as a base for the
-        # next iteration; this reduces API calls to the OpenRA user account service
-        if prev_db_name is not None:
-            shutil.copyfile(prev_db_name, db_name)
-            logging.info(f"Copied {prev_db_name} to {db_name}")
+def _upgrade_database(database, schema):
+    """Brings a database written by a previous version of ora-ladder up to date, in place
 
-        # Track database filename for next iteration
-        prev_db_name = db_name
+    The missing tables are created and the migrations applied (which fill the player_games table), then the
+    per-player and global aggregates are computed if the database was written before they existed.
+    """
+    conn = _open_database(database, schema)
+    migrate(conn, "ladder")
+    if conn.execute("SELECT 1 FROM player_stats LIMIT 1").fetchone() is None:
+        logging.info("Computing the player statistics of %s", database)
+        _write_player_stats(conn)
+        _write_player_ratings(conn)
+    # Always written by ora-ladder, even for an empty ladder
+    if conn.execute("SELECT 1 FROM global_stats").fetchone() is None:
+        logging.info("Computing the global statistics of %s", database)
+        _write_global_stats(conn)
+    conn.commit()
+    # The web application reads the past seasons as immutable databases, which ignore the WAL
+    busy, _, _ = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    conn.close()
+    return not busy
 
-        lockfile = db_name + ".lock"
-        args.start = str(start_date)
-        args.end = str(end_date)
-        args.database = db_name
-        args.period = ""
 
-        # create the actual database files using _main() method
+def upgrade_databases():
+    """A CLI tool to upgrade the ladder databases written by a previous version, in place
+
+    The web application expects every database it reads to have the tables of the current schema, while the
+    databases of the past seasons are never written again by ora-ladder: they must be upgraded once when the ladder
+    is updated, before the new version of the web application serves them.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--schema", default=op.join(op.dirname(__file__), "ladder.sql"))
+    parser.add_argument("-l", "--log-level", default="INFO")
+    parser.add_argument("databases", nargs="+")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+
+    failed = []
+    for database in args.databases:
+        lockfile = database + ".lock"
+        with closing(sqlite3.connect(database)) as conn:
+            summary = conn.execute("SELECT 1 FROM sqlite_master WHERE name='season_players'").fetchone() is not None
+        if summary:
+            logging.info("Skipping the summary database %s", database)
+            continue
         try:
             with FileLock(lockfile, timeout=1):
-                _main(args)
-                logging.info(
-                    f"Created database file {db_name} using "
-                    f"start date {start_date}, end date {end_date}, source "
-                    f"folder {args.replays}."
-                )
+                upgraded = _upgrade_database(database, args.schema)
         except Timeout:
             logging.error("Another instance of this application currently holds the %s lock file.", lockfile)
-
-        #
-        start_date = start_date.replace(month=(start_date.month + 2) % 12)
-        season_counter += 1
-
-        # stop the loop if we completed a year or if the start date is in the future
-        if start_date.month == 1 or start_date > datetime.date.today():
-            break
+            upgraded = False
+        if not upgraded:
+            logging.error("Could not upgrade %s", database)
+            failed.append(database)
+    if failed:
+        sys.exit(1)
@@ -34,3 +34,69 @@ CREATE TABLE IF NOT EXISTS outcomes (
 	map_uid               TEXT NOT NULL,
 	map_title             TEXT NOT NULL
 );
+
+CREATE TABLE IF NOT EXISTS player_games (
+	profile_id        INTEGER NOT NULL,
+	end_time          TEXT NOT NULL,
+	hash              TEXT NOT NULL,
+	side              INTEGER NOT NULL,
+	won               BOOLEAN NOT NULL,
+	opponent_id       INTEGER NOT NULL,
+	rating_prv        INTEGER NOT NULL,
+	rating            INTEGER NOT NULL,
+	faction           TEXT NOT NULL,
+	selected_faction  TEXT NOT NULL,
+	map_uid           TEXT NOT NULL,
+	map_title         TEXT NOT NULL,
+	duration          INTEGER NOT NULL,
+	PRIMARY KEY (profile_id, end_time, hash)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS player_stats (
+	profile_id         INTEGER PRIMARY KEY,
+	rank               INTEGER,
+	avg_game_duration  REAL NOT NULL,
+	first_game         TEXT NOT NULL,
+	last_game          TEXT NOT NULL,
+	factions           TEXT NOT NULL,
+	maps               TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS player_ratings (
+	profile_id    INTEGER PRIMARY KEY,
+	history       BLOB NOT NULL,
+	chart         TEXT
+);
+
+CREATE TABLE IF NOT EXISTS global_stats (
+	nb_games      INTEGER NOT NULL,
+	nb_players    INTEGER NOT NULL,
+	avg_duration  REAL
+);
+
+CREATE TABLE IF NOT EXISTS global_faction_stats (
+	faction      TEXT PRIMARY KEY,
+	count        INTEGER NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS global_map_stats (
+	map_title    TEXT PRIMARY KEY,
+	count        INTEGER NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS daily_activity (
+	date         TEXT PRIMARY KEY,
+	count        INTEGER NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS rating_checkpoints (
+	game_index   INTEGER PRIMARY KEY,
+	end_time     TEXT NOT NULL,
+	digest       TEXT NOT NULL,
+	state        TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS ladder_info (
+	key          TEXT PRIMARY KEY,
+	value        TEXT NOT NULL
+);
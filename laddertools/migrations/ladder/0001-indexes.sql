@@ -0,0 +1,14 @@
+-- Leaderboard and player ranks: ORDER BY rating, COUNT(*) of non-banned players above a rating
+CREATE INDEX IF NOT EXISTS players_rating ON players (rating, banned);
+
+-- Latest games, activity and average duration
+CREATE INDEX IF NOT EXISTS outcomes_end_time ON outcomes (end_time, start_time);
+
+-- Games of a player, as winner or loser
+CREATE INDEX IF NOT EXISTS outcomes_profile_id0 ON outcomes (profile_id0, end_time);
+CREATE INDEX IF NOT EXISTS outcomes_profile_id1 ON outcomes (profile_id1, end_time);
+
+-- Global faction and map histograms
+CREATE INDEX IF NOT EXISTS outcomes_selected_faction_0 ON outcomes (selected_faction_0);
+CREATE INDEX IF NOT EXISTS outcomes_selected_faction_1 ON outcomes (selected_faction_1);
+CREATE INDEX IF NOT EXISTS outcomes_map_title ON outcomes (map_title);
@@ -0,0 +1,11 @@
+-- Fill the player_games table of the databases created before it existed
+INSERT INTO player_games
+SELECT
+	profile_id0, end_time, hash, 0, 1, profile_id1, rating_0_prv, rating_0, faction_0, selected_faction_0,
+	map_uid, map_title, CAST(round((julianday(end_time) - julianday(start_time)) * 86400) AS INTEGER)
+FROM outcomes WHERE NOT EXISTS (SELECT 1 FROM player_games)
+UNION ALL
+SELECT
+	profile_id1, end_time, hash, 1, 0, profile_id0, rating_1_prv, rating_1, faction_1, selected_faction_1,
+	map_uid, map_title, CAST(round((julianday(end_time) - julianday(start_time)) * 86400) AS INTEGER)
+FROM outcomes WHERE NOT EXISTS (SELECT 1 FROM player_games);
@@ -0,0 +1,2 @@
+-- Latest games pages: keyset pagination on (end_time, hash)
+CREATE INDEX IF NOT EXISTS outcomes_end_time_hash ON outcomes (end_time, hash);
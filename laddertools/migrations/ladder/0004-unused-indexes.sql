@@ -0,0 +1,6 @@
+-- Indexes of the first migration that no query uses any more: the latest games follow outcomes_end_time_hash, and
+-- the global statistics are read from their own tables
+DROP INDEX IF EXISTS outcomes_end_time;
+DROP INDEX IF EXISTS outcomes_selected_faction_0;
+DROP INDEX IF EXISTS outcomes_selected_faction_1;
+DROP INDEX IF EXISTS outcomes_map_title;
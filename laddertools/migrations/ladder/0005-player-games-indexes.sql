@@ -0,0 +1,4 @@
+-- Indexes of the first migration superseded by the player_games primary key: the games of a player are read from
+-- player_games
+DROP INDEX IF EXISTS outcomes_profile_id0;
+DROP INDEX IF EXISTS outcomes_profile_id1;
@@ -0,0 +1,16 @@
+-- Scoreboards and opponents of a player
+CREATE INDEX IF NOT EXISTS players_division ON players (division, status, wins DESC);
+
+-- Games lists
+CREATE INDEX IF NOT EXISTS outcomes_end_time ON outcomes (end_time);
+CREATE INDEX IF NOT EXISTS playoff_outcomes_end_time ON playoff_outcomes (end_time);
+
+-- Games of a player, as winner or loser
+CREATE INDEX IF NOT EXISTS outcomes_profile_id0 ON outcomes (profile_id0, end_time);
+CREATE INDEX IF NOT EXISTS outcomes_profile_id1 ON outcomes (profile_id1, end_time);
+
+CREATE INDEX IF NOT EXISTS playoff_playersets_playoff_id ON playoff_playersets (playoff_id);
+
+-- Forfeit games of a player, as winner or loser
+CREATE INDEX IF NOT EXISTS forfeit_games_profile_id0 ON forfeit_games (profile_id0);
+CREATE INDEX IF NOT EXISTS forfeit_games_profile_id1 ON forfeit_games (profile_id1);
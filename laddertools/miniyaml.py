@@ -15,6 +15,12 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+"""Decoder of the MiniYAML format of OpenRA (replay metadata, account service responses)
+
+Each line holds a `key: value` pair, nested under the previous key with one tab less of indentation. Keys without a
+value map to the dictionary of their children, or to an empty string if they have none.
+"""
+
 import re
 
 
@@ -31,7 +37,8 @@ def _cleanup(d):
     return d
 
 
-def load(yaml_str):
+def _load_regex(yaml_str):
+    """Reference implementation of `load()`, kept to check it against (see misc/bench_miniyaml.py)"""
     yaml_str = yaml_str.decode()
     levels = [{}]
     for line in yaml_str.splitlines():
@@ -46,3 +53,59 @@ def load(yaml_str):
         parent = levels[level]
         parent[key] = value
     return _cleanup(levels[0])
+
+
+def load(yaml_str, keys=None):
+    """Decodes the MiniYAML buffer (bytes or any bytes-like object) into nested dictionaries
+
+    If `keys` is not None, only the top-level keys it holds are decoded, along with those starting with its keys
+    ending with "@" (e.g. "Player@" selects "Player@0", "Player@1", ...): the lines of the other sections are skipped.
+    """
+    if keys is not None:
+        prefixes = tuple(k for k in keys if k.endswith("@"))
+    skipping = False
+    root = {}
+    # Stack of the nodes of each indentation level. A key without a value is first recorded as an empty string,
+    # with a (parent, key) pair on the stack which is only turned into a dictionary when a child shows up.
+    levels = [root]
+    for line in str(yaml_str, "utf-8").splitlines():
+        if skipping and line[:1] == "\t":
+            continue
+        key, sep, value = line.partition(":")
+        if not sep:
+            continue
+        indented_key = key
+        key = key.lstrip("\t")
+        if not key:
+            continue
+        level = len(indented_key) - len(key)
+        value = value.lstrip()
+        if level == 0 and keys is not None:
+            # The indented lines following a key with a value belong to the previous section
+            selected = key in keys or key.startswith(prefixes)
+            if not value:
+                skipping = not selected
+            if not selected:
+                continue
+        try:
+            parent = levels[level]
+        except IndexError:
+            if level != len(levels) or value:
+                raise
+            # A key without a value indented one level too deep starts a dictionary outside of the tree, in which
+            # the following keys of its level end up
+            levels.append({})
+            continue
+        if parent.__class__ is tuple:
+            grandparent, parent_key = parent
+            parent = levels[level] = {}
+            # Unless the key got a value in the meantime, which leaves its children out of the tree
+            if grandparent[parent_key] == "":
+                grandparent[parent_key] = parent
+        if value:
+            parent[key] = value
+        else:
+            parent[key] = ""
+            del levels[level + 1 :]
+            levels.append((parent, key))
+    return root or ""
@@ -0,0 +1,266 @@
+#
+# Copyright (C) 2022
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""JSON payloads of the ladder web application, computed from a ladder database
+
+They only hold the identifiers of the players and replays: the web pages build the URLs from them. Since they only
+change when the database is written, `write_payloads()` lets `ora-ladder` store them (along with their compressed
+versions) for the web application or the web server to send as is.
+"""
+
+import gzip
+import html
+import json
+import logging
+import os
+import os.path as op
+import re
+import sqlite3
+import struct
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+LATEST_GAMES_QUERY = """
+    SELECT
+        hash,
+        end_time,
+        strftime('%M:%S', julianday(end_time) - julianday(start_time)) AS duration,
+        profile_id0,
+        profile_id1,
+        rating_0 - rating_0_prv AS diff0,
+        rating_1 - rating_1_prv AS diff1,
+        p0.profile_name AS p0_name,
+        p1.profile_name AS p1_name,
+        p0.banned AS p0_banned,
+        p1.banned AS p1_banned,
+        map_title
+    FROM outcomes o
+    LEFT JOIN players p0 ON p0.profile_id = o.profile_id0
+    LEFT JOIN players p1 ON p1.profile_id = o.profile_id1
+"""
+
+_tag_regex = re.compile(r"\s*\[[^\]]*\]")
+
+# A point of the rating history of a player: the end time of the game (UNIX timestamp) and the rating following it
+_rating_point = struct.Struct("<qi")
+
+
+def stripped_map_name(map_name):
+    return _tag_regex.sub("", map_name).strip()
+
+
+def pack_rating_history(points):
+    """Packs the (end time, rating) points of the rating history of a player into a blob"""
+    return b"".join(_rating_point.pack(end_time, rating) for end_time, rating in points)
+
+
+def unpack_rating_history(blob):
+    """Returns an iterator over the (end time, rating) points of a rating history packed by `pack_rating_history()`"""
+    return _rating_point.iter_unpack(blob)
+
+
+def get_leaderboard(conn):
+    cur = conn.execute(
+        """
+        SELECT
+            profile_id,
+            profile_name,
+            avatar_url,
+            wins,
+            losses,
+            prv_rating,
+            rating
+        FROM players
+        WHERE rating > 0 AND NOT banned
+        ORDER BY rating DESC
+        """
+    )
+
+    rows = []
+    for i, (profile_id, profile_name, avatar_url, wins, losses, prv_rating, rating) in enumerate(cur, 1):
+        rows.append(
+            dict(
+                row_id=i,
+                player=dict(
+                    id=profile_id,
+                    name=html.escape(profile_name),
+                    avatar_url=avatar_url,
+                ),
+                rating=dict(
+                    value=rating,
+                    diff=rating - prv_rating,
+                ),
+                played=wins + losses,
+                wins=wins,
+                losses=losses,
+                winrate=wins / (wins + losses) * 100,
+            )
+        )
+    cur.close()
+    return rows
+
+
+def get_latest_game(row):
+    """Returns the payload of a game from a row of the `LATEST_GAMES_QUERY`
+
+    The banned players are left out, as well as the replay of their games.
+    """
+    (
+        hash_,
+        end_time,
+        duration,
+        profile_id0,
+        profile_id1,
+        diff0,
+        diff1,
+        p0_name,
+        p1_name,
+        p0_banned,
+        p1_banned,
+        map_title,
+    ) = row
+    return dict(
+        hash=hash_ if not (p0_banned or p1_banned) else None,
+        date=end_time,
+        duration=duration,
+        map=stripped_map_name(map_title),
+        p0=dict(id=profile_id0, name=html.escape(p0_name), diff=diff0) if not p0_banned else None,
+        p1=dict(id=profile_id1, name=html.escape(p1_name), diff=diff1) if not p1_banned else None,
+    )
+
+
+def get_latest_games(conn):
+    cur = conn.execute(LATEST_GAMES_QUERY + "ORDER BY o.end_time DESC, o.hash DESC")
+    games = [get_latest_game(row) for row in cur]
+    cur.close()
+    return games
+
+
+def _get_histogram(conn, table, column):
+    hist = conn.execute(f"SELECT {column}, count FROM {table}").fetchall()
+    names, data = zip(*hist) if hist else ((), ())
+    return dict(names=list(names), data=list(data), total=sum(data))
+
+
+def _get_activity_stats(conn):
+    records = conn.execute("SELECT date, count FROM daily_activity").fetchall()
+    if not records:
+        return dict(dates=None, data=None, games_per_day=0)
+    dates, data = zip(*records)
+    return dict(dates=list(dates), data=list(data), games_per_day=sum(data) / len(data))
+
+
+def get_global_stats(conn):
+    """Returns the global statistics of the ladder, as aggregated by `ora-ladder` in the global_* tables"""
+    nb_games, nb_players, avg_duration = conn.execute(
+        "SELECT nb_games, nb_players, strftime('%M:%S', avg_duration, 'unixepoch') FROM global_stats"
+    ).fetchone()
+    return dict(
+        nb_games=nb_games,
+        nb_players=nb_players,
+        avg_duration=avg_duration,
+        faction_stats=_get_histogram(conn, "global_faction_stats", "faction"),
+        map_stats=_get_histogram(conn, "global_map_stats", "map_title"),
+        activity_stats=_get_activity_stats(conn),
+    )
+
+
+# Identity of the database the payloads were written from, see `write_payloads()`
+DATABASE_INFO = "database.json"
+
+_PAYLOADS = {
+    "leaderboard.json": get_leaderboard,
+    "latest.json": get_latest_games,
+    "globalstats.json": get_global_stats,
+}
+
+
+def get_database_identity(path):
+    """Returns a value changing whenever the database file is replaced or updated, with its modification time
+
+    A rebuilt database replaces the file (new inode), while an incremental update writes into the file and its WAL.
+    """
+    st = os.stat(path)
+    identity = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+    try:
+        wal_st = os.stat(path + "-wal")
+    except FileNotFoundError:
+        pass
+    else:
+        # An empty WAL is created by the first reader, it does not change the content
+        if wal_st.st_size:
+            identity += (wal_st.st_size, wal_st.st_mtime_ns)
+    return identity, st.st_mtime
+
+
+def get_payloads_directory(json_dir, database):
+    """Returns the directory of the payloads of the database (named after it) within the JSON directory"""
+    return op.join(json_dir, op.splitext(op.basename(database))[0])
+
+
+def write_file(path, data):
+    """Atomically writes the data into the file"""
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+
+
+def write_precompressed(path, data):
+    """Writes the data into the file, along with its gzip (and brotli, if available) compressed versions
+
+    The compressed versions are written first, so that a web server never picks one older than the file.
+    """
+    if brotli is not None:
+        write_file(path + ".br", brotli.compress(data))
+    elif op.exists(path + ".br"):
+        os.remove(path + ".br")
+    write_file(path + ".gz", gzip.compress(data, mtime=0))
+    write_file(path, data)
+
+
+def write_payloads(database, json_dir):
+    """Writes the JSON payloads of the database, along with their compressed versions (see `write_precompressed()`)"""
+    directory = get_payloads_directory(json_dir, database)
+    os.makedirs(directory, exist_ok=True)
+    if brotli is None:
+        logging.info("The brotli module is not available, only the gzip compressed payloads are written")
+
+    conn = sqlite3.connect(database)
+    for name, get_payload in _PAYLOADS.items():
+        data = json.dumps(get_payload(conn), separators=(",", ":")).encode()
+        write_precompressed(op.join(directory, name), data)
+    conn.close()
+    # Written last: until then, the payloads of a previous version of the database are not trusted
+    identity, published = get_database_identity(database)
+    write_file(op.join(directory, DATABASE_INFO), json.dumps(dict(identity=identity, published=published)).encode())
+
+
+def get_payloads_database_info(directory):
+    """Returns the identity and publication time of the database the payloads of the directory were written from
+
+    None is returned when the payloads were never completely written.
+    """
+    try:
+        with open(op.join(directory, DATABASE_INFO), "rb") as f:
+            info = json.load(f)
+    except FileNotFoundError:
+        return None
+    return tuple(info["identity"]), info["published"]
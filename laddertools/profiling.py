@@ -0,0 +1,120 @@
+#
+# Copyright (C) 2022
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Stage timings of the ora-ladder, ora-dbtool and ora-ragl pipelines (see their --profile option)
+
+The pipelines delimit their stages with `stage()`, which does nothing unless a `profile()` is active. The report has,
+for each stage (aggregated over its runs): the number of runs, the wall time, the CPU time (including the one of the
+replay decoding processes), the peak resident memory of the process at the end of the stage (in KiB) and the number
+of items processed.
+"""
+
+import cProfile
+import json
+import logging
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+_profiler = None
+
+
+class _Stage:
+    """A running stage, on which the pipeline sets the number of processed items"""
+
+    items = None
+
+
+def _get_usage():
+    """Returns the wall time, CPU time and peak resident memory of the process"""
+    if resource is None:
+        return time.perf_counter(), time.process_time(), None
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu_time = usage.ru_utime + usage.ru_stime + children.ru_utime + children.ru_stime
+    # ru_maxrss is in bytes on macOS
+    peak_rss = usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss
+    return time.perf_counter(), cpu_time, peak_rss
+
+
+class _Profiler:
+    def __init__(self, profiled_stage):
+        self.profiled_stage = profiled_stage
+        self.cprofile = cProfile.Profile() if profiled_stage else None
+        self.stages = {}
+
+    def add(self, name, start, end, items):
+        report = self.stages.setdefault(name, dict(runs=0, wall_time=0, cpu_time=0, peak_rss_kb=None, items=None))
+        report["runs"] += 1
+        report["wall_time"] += end[0] - start[0]
+        report["cpu_time"] += end[1] - start[1]
+        report["peak_rss_kb"] = end[2]
+        if items is not None:
+            report["items"] = (report["items"] or 0) + items
+
+
+@contextmanager
+def stage(name):
+    """Delimits a stage of the pipeline, yielding a `_Stage` to set the number of processed items on"""
+    handle = _Stage()
+    profiler = _profiler
+    if profiler is None:
+        yield handle
+        return
+
+    cprofile = profiler.cprofile if name == profiler.profiled_stage else None
+    start = _get_usage()
+    if cprofile is not None:
+        cprofile.enable()
+    try:
+        yield handle
+    finally:
+        if cprofile is not None:
+            cprofile.disable()
+        profiler.add(name, start, _get_usage(), handle.items)
+
+
+@contextmanager
+def profile(report_path, profiled_stage=None):
+    """Writes the JSON report of the stages run within the context into the file, if not None
+
+    The cProfile statistics of the `profiled_stage` (if any) are dumped next to it, with a `.pstats` suffix.
+    """
+    global _profiler
+    if report_path is None:
+        yield
+        return
+
+    _profiler = profiler = _Profiler(profiled_stage)
+    start = _get_usage()
+    try:
+        yield
+    finally:
+        _profiler = None
+        profiler.add("total", start, _get_usage(), None)
+        with open(report_path, "w") as f:
+            json.dump(profiler.stages, f, indent=2)
+        if profiled_stage is not None:
+            if profiled_stage in profiler.stages:
+                profiler.cprofile.dump_stats(report_path + ".pstats")
+            else:
+                logging.warning("The %s stage was not run, no profiling statistics to dump", profiled_stage)
@@ -23,6 +23,9 @@ import sqlite3
 import yaml
 from filelock import FileLock, Timeout
 
+from .profiling import profile, stage
+from .replay import jobs_type
+from .schema import migrate
 from .utils import get_results
 
 
@@ -189,6 +192,7 @@ def _main(args):
     c.execute("DROP TABLE IF EXISTS playoff_playersets")
     c.execute("DROP TABLE IF EXISTS playoffs")
     c.execute("DROP TABLE IF EXISTS forfeit_games")
+    c.execute("PRAGMA user_version=0")
 
     with open(args.schema) as f:
         c.executescript(f.read())
@@ -198,28 +202,35 @@ def _main(args):
     request_accounts = c.execute("SELECT * FROM accounts")
     accounts_db = {fp: (pid, pname, avatar_url) for fp, pid, pname, avatar_url in request_accounts.fetchall()}
 
-    results = get_results(accounts_db, args.replays)
+    results = get_results(accounts_db, args.replays, jobs=args.jobs)
 
     with open(args.playersinfo) as f:
         players_info = yaml.safe_load(f)
-    players, outcomes, extra_outcomes = _get_players_outcomes(accounts_db, results, players_info)
-
-    outcomes_sql = [o.sql_row for o in outcomes]
-    players_sql = [p.sql_row for p in players]
-    accounts_sql = [(fp, acc[0], acc[1], acc[2]) for fp, acc in accounts_db.items() if acc is not None]
-
-    c.executemany("INSERT OR IGNORE INTO accounts VALUES (?,?,?,?)", accounts_sql)
-    c.executemany("INSERT OR IGNORE INTO players VALUES (?,?,?,?,?,?,?)", players_sql)
-    c.executemany("INSERT OR IGNORE INTO outcomes VALUES (?,?,?,?,?,?,?,?,?,?,?,?)", outcomes_sql)
-
-    playoffs = players_info.get("Playoffs")
-    if playoffs:
-        _handle_extra_outcomes(c, extra_outcomes, playoffs)
-
-    if "Forfeit_Games" in players_info.keys():
-        c.executemany("INSERT OR IGNORE INTO forfeit_games VALUES (?,?,?,?)", players_info["Forfeit_Games"])
-
-    conn.commit()
+    with stage("ranking") as s:
+        players, outcomes, extra_outcomes = _get_players_outcomes(accounts_db, results, players_info)
+        s.items = len(outcomes) + len(extra_outcomes)
+
+    with stage("sql write") as s:
+        outcomes_sql = (o.sql_row for o in outcomes)
+        players_sql = (p.sql_row for p in players)
+        accounts_sql = ((fp, acc[0], acc[1], acc[2]) for fp, acc in accounts_db.items() if acc is not None)
+
+        c.executemany("INSERT OR IGNORE INTO accounts VALUES (?,?,?,?)", accounts_sql)
+        c.executemany("INSERT OR IGNORE INTO players VALUES (?,?,?,?,?,?,?)", players_sql)
+        c.executemany("INSERT OR IGNORE INTO outcomes VALUES (?,?,?,?,?,?,?,?,?,?,?,?)", outcomes_sql)
+
+        playoffs = players_info.get("Playoffs")
+        if playoffs:
+            _handle_extra_outcomes(c, extra_outcomes, playoffs)
+
+        if "Forfeit_Games" in players_info.keys():
+            c.executemany("INSERT OR IGNORE INTO forfeit_games VALUES (?,?,?,?)", players_info["Forfeit_Games"])
+        s.items = len(outcomes)
+
+    with stage("commit"):
+        conn.commit()
+    with stage("sql write"):
+        migrate(conn, "ragl")
     conn.close()
 
 
@@ -229,13 +240,18 @@ def run():
     parser.add_argument("-d", "--database", default="db-ragl.sqlite3")
     parser.add_argument("-s", "--schema", default=op.join(op.dirname(__file__), "ragl.sql"))
     parser.add_argument("-p", "--playersinfo", default=op.join(op.dirname(__file__), "ragl-s12.yml"))
+    parser.add_argument(
+        "-j", "--jobs", type=jobs_type, default=1, help="Number of replay decoding processes (0: one per CPU)"
+    )
+    parser.add_argument("--profile", help="JSON file where to write the timings of the stages")
+    parser.add_argument("--profile-stage", help="Stage whose cProfile statistics are dumped into {profile}.pstats")
     parser.add_argument("replays", nargs="*")
     args = parser.parse_args()
 
     lockfile = args.database + ".lock"
     lock = FileLock(lockfile, timeout=1)
     try:
-        with lock:
+        with lock, profile(args.profile, args.profile_stage):
             _main(args)
     except Timeout:
         logging.error("Another instance of this application currently holds the %s lock file.", lockfile)
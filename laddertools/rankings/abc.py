@@ -19,10 +19,32 @@ from abc import ABC, abstractmethod
 
 
 class RankingBase(ABC):
-    def compute_ratings_from_series_of_games(self, games, player_lookup):
-        player_ratings = {}
-        game_ratings = []
-        for g in games:
+
+    # Number of games between two saved states of the computation (see `resume_ratings_from_series_of_games()`)
+    checkpoint_interval = 1000
+
+    def compute_ratings_from_series_of_games(self, games, player_lookup, checkpoints=None):
+        """Computes the per-game ratings of the players involved in `games`.
+
+        See `resume_ratings_from_series_of_games()` for `checkpoints`.
+        """
+        return self.resume_ratings_from_series_of_games(games, player_lookup, None, checkpoints)
+
+    def resume_ratings_from_series_of_games(self, games, player_lookup, state, checkpoints=None):
+        """Computes the per-game ratings of the players involved in `games`, continuing from `state`.
+
+        A state is a dict whose "ratings" item maps the players to their rating; the other items (if any) are specific
+        to the ranking system and JSON serializable. A `state` of None starts the computation from scratch.
+
+        If specified, the `checkpoints` dict is filled with the states the computation can be resumed from, indexed by
+        the number of games processed: roughly every `checkpoint_interval` games, and after the last game.
+
+        The ratings are yielded as they are computed (and the checkpoint of a game is saved before its ratings are
+        yielded), so that the caller does not need to keep the ratings of all the games at once. Ranking systems
+        which need the whole series of games first can return a list instead.
+        """
+        player_ratings = dict(state["ratings"]) if state else {}
+        for i, g in enumerate(games, 1):
             p0 = player_lookup[g.player0]
             p1 = player_lookup[g.player1]
             r0 = player_ratings.get(p0, self.get_default_rating())
@@ -32,9 +54,16 @@ class RankingBase(ABC):
             player_ratings[p0] = r0_new
             player_ratings[p1] = r1_new
 
-            item = (r0_new, r1_new)
-            game_ratings.append(item)
-        return game_ratings
+            if checkpoints is not None and (i % self.checkpoint_interval == 0 or i == len(games)):
+                checkpoints[i] = dict(ratings=dict(player_ratings))
+            yield r0_new, r1_new
+
+    def can_resume(self, state, games):
+        """Returns whether the computation can continue from `state` with the (ordered) `games`.
+
+        The ratings of the state are not deserialized at this point: only the other items should be used.
+        """
+        return True
 
     @classmethod
     @abstractmethod
@@ -44,3 +73,7 @@ class RankingBase(ABC):
     @abstractmethod
     def record_result(self, winner_rating, loser_rating):
         """Returns a pair of new ratings, one for the winner and one for the loser."""
+
+    @abstractmethod
+    def get_rating_from_state(self, state):
+        """Returns the rating saved with the `state` property of a rating."""
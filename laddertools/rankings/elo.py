@@ -19,6 +19,8 @@ from .abc import RankingBase
 
 
 class _RatingELO:
+    __slots__ = ("value",)
+
     def __init__(self, value):
         self.value = value
 
@@ -26,6 +28,15 @@ class _RatingELO:
     def display_value(self):
         return round(self.value)
 
+    @property
+    def state(self):
+        return [self.value]
+
+    @classmethod
+    def from_state(cls, state):
+        (value,) = state
+        return cls(value)
+
 
 class RankingELO(RankingBase):
 
@@ -49,3 +60,6 @@ class RankingELO(RankingBase):
     @classmethod
     def get_default_rating(cls):
         return _RatingELO(1000)
+
+    def get_rating_from_state(self, state):
+        return _RatingELO.from_state(state)
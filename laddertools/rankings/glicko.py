@@ -17,13 +17,14 @@
 
 from math import sqrt, pi, exp, log, hypot
 from itertools import count
-from datetime import timedelta
+from datetime import datetime, timedelta
 from collections import deque, defaultdict
 
 from .abc import RankingBase
 
 
 class _RatingGlicko:
+    __slots__ = ("r", "std", "RD")
 
     _initial_rating = 1500
 
@@ -62,6 +63,15 @@ class _RatingGlicko:
     def phi_to_RD(cls, phi):
         return cls._k * phi
 
+    @property
+    def state(self):
+        return [self.r, self.RD, self.std]
+
+    @classmethod
+    def from_state(cls, state):
+        r, RD, std = state
+        return cls(r, RD, std)
+
     def __repr__(self):
         return f"<_RatingGlicko r={self.r:.1f}, RD={self.RD:.1f}, std={self.std:.4f}>"
 
@@ -193,19 +203,40 @@ class RankingGlicko(RankingBase):
         # except a higher fluctuation in rating, at least initially.
         return _RatingGlicko(_RatingGlicko._initial_rating, std=0.1, RD=100)
 
-    def compute_ratings_from_series_of_games(
+    def get_rating_from_state(self, state):
+        return _RatingGlicko.from_state(state)
+
+    def can_resume(self, state, games):
+        # The games are assigned to the rating periods in the order they started: the computed periods would change
+        # with a game ending before the end of the last one, or starting before one of the games already assigned
+        if not games:
+            return True
+        period = datetime.fromisoformat(state["period"])
+        last_start_time = datetime.fromisoformat(state["last_start_time"])
+        return min(g.end_time for g in games) >= period and min(g.start_time for g in games) >= last_start_time
+
+    def resume_ratings_from_series_of_games(
         self,
         games,
         player_lookup,
+        state,
+        checkpoints=None,
         rating_period=timedelta(days=3),
     ):
         """Computes the per-game rating of each involved player in `games`.
 
+        The computation can only be resumed at the end of a rating period, so
+        the checkpoints are saved at the end of the rating periods where all
+        the games assigned so far are the first ones of `games`.
+
         Returns:
             a list of same length as `games`, where each elemnet is a pair of
             `_RatingGlicko` instances.
         """
 
+        if not games:
+            return []
+
         # (datetime, _Player) -> _RatingGlicko
         # ... this is the 'official' ratings. They are provided every
         # `rating_period`, and is the basis for rating calculation. Because a
@@ -258,13 +289,23 @@ class RankingGlicko(RankingBase):
                 return 0
             raise ValueError("Expected `player` to be involved in the game.")
 
-        start_date = min(map(lambda g: g.end_time, games))
-        start_date = start_date.replace(hour=0, minute=0, second=0)
+        if state:
+            start_date = datetime.fromisoformat(state["period"])
+            last_start_time = datetime.fromisoformat(state["last_start_time"])
+            for player, rating in state["ratings"].items():
+                player_ratings_by_period[player, start_date] = rating
+        else:
+            start_date = min(map(lambda g: g.end_time, games))
+            start_date = start_date.replace(hour=0, minute=0, second=0)
+            last_start_time = datetime.min
 
         games_by_period = _partition_games_in_rating_periods(games, start_date, rating_period)
-        current_registered_players = set()
+        current_registered_players = set(state["ratings"]) if state else set()
 
-        for period, G in games_by_period.items():
+        game_indexes = {id(g): i for i, g in enumerate(games, 1)}
+        processed = last_index = last_checkpoint = 0
+
+        for period_index, (period, G) in enumerate(games_by_period.items()):
             # TODO: if no games in particular period, we should still increase the RD.
             # Currently, we assume there's at least one game per period.
             groups = _group_games_by_player(G, player_lookup)
@@ -306,6 +347,21 @@ class RankingGlicko(RankingBase):
 
                 player_ratings_by_period[player, period] = new_rating
 
+            if checkpoints is None or not G:
+                continue
+            processed += len(G)
+            last_index = max(last_index, max(game_indexes[id(g)] for g in G))
+            last_start_time = max(last_start_time, max(g.start_time for g in G))
+            if last_index != processed:
+                continue  # the games of this period are not the next ones of the series
+            if processed - last_checkpoint >= self.checkpoint_interval or period_index >= len(games_by_period) - 2:
+                checkpoints[processed] = dict(
+                    ratings={p: player_ratings_by_period[p, period] for p in current_registered_players},
+                    period=period.isoformat(),
+                    last_start_time=last_start_time.isoformat(),
+                )
+                last_checkpoint = processed
+
         # The order of ratings must match the order of games. That's why we
         # can't return `player_ratings_by_game.values()` directly, since
         # they are not processed in the same order as `games` appear.
@@ -21,6 +21,8 @@ from .abc import RankingBase
 
 
 class _RatingTrueskill:
+    __slots__ = ("internal", "_env")
+
     def __init__(self, env, internal=None):
         self.internal = trueskill.Rating() if internal is None else internal
         self._env = env
@@ -34,6 +36,15 @@ class _RatingTrueskill:
         # XXX: needs more accuracy?
         return round(self.value * 100)
 
+    @property
+    def state(self):
+        return [self.internal.mu, self.internal.sigma]
+
+    @classmethod
+    def from_state(cls, env, state):
+        mu, sigma = state
+        return cls(env, env.create_rating(mu, sigma))
+
 
 class RankingTrueskill(RankingBase):
     def __init__(self):
@@ -48,3 +59,6 @@ class RankingTrueskill(RankingBase):
     @classmethod
     def get_default_rating(cls):
         return _RatingTrueskill(cls()._env)
+
+    def get_rating_from_state(self, state):
+        return _RatingTrueskill.from_state(self._env, state)
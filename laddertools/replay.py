@@ -21,183 +21,259 @@ import os.path as op
 import argparse
 import logging
 import struct
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
 from . import miniyaml
 
 
+def _intern(string):
+    return None if string is None else sys.intern(string)
+
+
+# The results of a whole replay history are held in memory at once: they have no instance dictionary, and share the
+# strings repeated across the games (names, factions, maps). Pickling them (from the decoding processes) goes through
+# their constructor, so that the unpickled strings are shared as well.
+
+
 class GamePlayerInfo:
+    __slots__ = ("fingerprint", "display_name", "faction", "selected_faction")
+
     def __init__(self, fingerprint, display_name, faction, selected_faction):
-        self.fingerprint = fingerprint
-        self.display_name = display_name
-        self.faction = faction
-        self.selected_faction = selected_faction
+        self.fingerprint = _intern(fingerprint)
+        self.display_name = _intern(display_name)
+        self.faction = _intern(faction)
+        self.selected_faction = _intern(selected_faction)
+
+    def __reduce__(self):
+        return GamePlayerInfo, (self.fingerprint, self.display_name, self.faction, self.selected_faction)
 
     def __str__(self):
         return self.display_name
 
 
 class GameResult:
+    __slots__ = ("start_time", "end_time", "filename", "player0", "player1", "map_uid", "map_title")
+
     def __init__(self, start_time, end_time, filename, player0, player1, map_uid, map_title):
         self.start_time = start_time
         self.end_time = end_time
         self.filename = op.abspath(filename)
         self.player0 = player0
         self.player1 = player1
-        self.map_uid = map_uid
-        self.map_title = map_title
+        self.map_uid = _intern(map_uid)
+        self.map_title = _intern(map_title)
+
+    def __reduce__(self):
+        return GameResult, (
+            self.start_time,
+            self.end_time,
+            self.filename,
+            self.player0,
+            self.player1,
+            self.map_uid,
+            self.map_title,
+        )
 
     def __str__(self):
         return f"{self.filename}: {self.player0} wins vs {self.player1}"
 
 
+# Sections of the replay metadata read by get_result(), the others (spectators, lobby options...) are not decoded
+_GAME_INFO_KEYS = {"Root", "Player@"}
+
+
 def _parse_date_fmt(date_string):
     return datetime.strptime(date_string, "%Y-%m-%d %H-%M-%S")
 
 
-def _parse_fmt(data, fmt):
-    n = struct.calcsize(fmt)
-    return struct.unpack("<" + fmt, data[:n])
+# The metadata block at the end of the replay files starts with a start marker, a version and the length of the
+# MiniYAML data, and is followed by its length and an end marker
+_footer_header = struct.Struct("<iii")
+_footer_trailer = struct.Struct("<ii")
 
+# Size of the tail of the replay files read at once, enough to hold the metadata of most replays
+_TAIL_SIZE = 16384
 
-def _read_data_fmt(reader, fmt):
-    n = struct.calcsize(fmt)
-    data = reader.read(n)
-    assert len(data) == n
-    return _parse_fmt(data, fmt)
 
-
-def _parse_game_info(input_file):
-    # TODO: check file size
-    input_file.seek(-8, 2)
-    length, end_marker = _read_data_fmt(input_file, "ii")
-    if end_marker != -2:
-        raise Exception(f"Invalid end marker {end_marker}")
-    input_file.seek(-(length + 16), 1)
-    start_marker, version = _read_data_fmt(input_file, "ii")
+def _read_game_yaml(filename):
+    """Returns the MiniYAML metadata block at the end of the replay file, as a view on the read bytes"""
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        if size < _footer_header.size + _footer_trailer.size:
+            raise Exception(f"File too small ({size} bytes)")
+        tail = memoryview(os.pread(fd, min(size, _TAIL_SIZE), max(0, size - _TAIL_SIZE)))
+        length, end_marker = _footer_trailer.unpack_from(tail, len(tail) - _footer_trailer.size)
+        if end_marker != -2:
+            raise Exception(f"Invalid end marker {end_marker}")
+        # Start marker and version, MiniYAML length and data, trailer
+        block_size = length + 16
+        if length < 4 or block_size > size:
+            raise Exception(f"Invalid metadata length {length}")
+        if block_size > len(tail):
+            tail = memoryview(os.pread(fd, block_size, size - block_size))
+    finally:
+        os.close(fd)
+
+    offset = len(tail) - block_size
+    start_marker, version, yaml_length = _footer_header.unpack_from(tail, offset)
     if start_marker != -1:
         raise Exception(f"Invalid start marker {start_marker}")
-    game_data = input_file.read(length)
-    (length2,) = _parse_fmt(game_data, "i")
-    assert length2 == length - 4
-    game_yaml = game_data[4:]
-    return miniyaml.load(game_yaml)
+    if yaml_length != length - 4:
+        raise Exception(f"Invalid MiniYAML length {yaml_length}")
+    return tail[offset + _footer_header.size : len(tail) - _footer_trailer.size]
+
+
+def _parse_game_info(filename):
+    return miniyaml.load(_read_game_yaml(filename), keys=_GAME_INFO_KEYS)
 
 
 def get_result(filename):
+    game_info = _parse_game_info(filename)
+
+    root_info = game_info["Root"]
+    start_time = _parse_date_fmt(root_info["StartTimeUtc"])
+    end_time = _parse_date_fmt(root_info["EndTimeUtc"])
+    map_uid = root_info["MapUid"]
+    map_title = root_info["MapTitle"]
+
+    players = [k for k in game_info.keys() if k.startswith("Player@")]
+    if len(players) != 2:
+        raise Exception(f"game doesn't have 2 but {len(players)} players")
+    player0, player1 = [game_info[f"Player@{i}"] for i in range(2)]
+    p0_name, p0_outcome, p0_fingerprint, p0_handicap = (
+        player0["Name"],
+        player0["Outcome"],
+        player0["Fingerprint"],
+        int(player0.get("Handicap", 0)),
+    )
+    p1_name, p1_outcome, p1_fingerprint, p1_handicap = (
+        player1["Name"],
+        player1["Outcome"],
+        player1["Fingerprint"],
+        int(player1.get("Handicap", 0)),
+    )
+
+    if p0_handicap or p1_handicap:
+        raise Exception(f"Handicap matchups are not allowed ({p0_name}:{p0_handicap}, {p1_name}:{p1_handicap})")
+
+    p0_faction = player0["FactionName"]
+    p1_faction = player1["FactionName"]
+    p0_selected_faction = player0.get("DisplayFactionName")
+    p1_selected_faction = player1.get("DisplayFactionName")
+    if None in (p0_selected_faction, p1_selected_faction):
+        p0_selected_faction = "Any" if player0["IsRandomFaction"] == "True" else p0_faction
+        p1_selected_faction = "Any" if player1["IsRandomFaction"] == "True" else p1_faction
+
+    if not p0_fingerprint or not p1_fingerprint:
+        p0_auth = "yes" if p0_fingerprint else "no"
+        p1_auth = "yes" if p1_fingerprint else "no"
+        raise Exception(f"not all players are authenticated ({p0_name}: {p0_auth}, {p1_name}: {p1_auth})")
+
+    if p0_fingerprint == p1_fingerprint:
+        raise Exception(f"player {p0_name} and {p1_name} are the same player")
+
+    #
+    # Override the end time with the outcome time if available. This gives
+    # a more accurate game duration because it doesn't take into account
+    # the time between the end of the game and the moment all players and
+    # spectators disconnected.
+    #
+    # Unfortunately, it may be undefined, typicall in the case of a
+    # disconnect loss.
+    #
+    if p0_outcome in ("Won", "Lost") and p1_outcome in ("Won", "Lost"):
+        p0_outcome_time = player0.get("OutcomeTimestampUtc")
+        p1_outcome_time = player1.get("OutcomeTimestampUtc")
+        if p0_outcome_time and p0_outcome_time == p1_outcome_time:
+            end_time = _parse_date_fmt(p0_outcome_time)
+
+    pA = GamePlayerInfo(p0_fingerprint, p0_name, p0_faction, p0_selected_faction)
+    pB = GamePlayerInfo(p1_fingerprint, p1_name, p1_faction, p1_selected_faction)
+
+    if (p0_outcome, p1_outcome) == ("Won", "Lost"):
+        p0 = pA
+        p1 = pB
+    elif (p1_outcome, p0_outcome) == ("Won", "Lost"):
+        p0 = pB
+        p1 = pA
+    else:
+        if p0_outcome != p1_outcome:
+            raise Exception(f"game result is half set: {p0_outcome} / {p1_outcome}")
 
-    with open(filename, "rb") as f:
-        game_info = _parse_game_info(f)
-
-        root_info = game_info["Root"]
-        start_time = _parse_date_fmt(root_info["StartTimeUtc"])
-        end_time = _parse_date_fmt(root_info["EndTimeUtc"])
-        map_uid = root_info["MapUid"]
-        map_title = root_info["MapTitle"]
-
-        players = [k for k in game_info.keys() if k.startswith("Player@")]
-        if len(players) != 2:
-            raise Exception(f"game doesn't have 2 but {len(players)} players")
-        player0, player1 = [game_info[f"Player@{i}"] for i in range(2)]
-        p0_name, p0_outcome, p0_fingerprint, p0_handicap = (
-            player0["Name"],
-            player0["Outcome"],
-            player0["Fingerprint"],
-            int(player0.get("Handicap", 0)),
-        )
-        p1_name, p1_outcome, p1_fingerprint, p1_handicap = (
-            player1["Name"],
-            player1["Outcome"],
-            player1["Fingerprint"],
-            int(player1.get("Handicap", 0)),
-        )
+        p0_disconnect = int(player0.get("DisconnectFrame", 0))
+        p1_disconnect = int(player1.get("DisconnectFrame", 0))
+        if not p0_disconnect or not p1_disconnect:
+            raise Exception(f"invalid disconnect frames {p0_disconnect} / {p1_disconnect}")
 
-        if p0_handicap or p1_handicap:
-            raise Exception(f"Handicap matchups are not allowed ({p0_name}:{p0_handicap}, {p1_name}:{p1_handicap})")
-
-        p0_faction = player0["FactionName"]
-        p1_faction = player1["FactionName"]
-        p0_selected_faction = player0.get("DisplayFactionName")
-        p1_selected_faction = player1.get("DisplayFactionName")
-        if None in (p0_selected_faction, p1_selected_faction):
-            p0_selected_faction = "Any" if player0["IsRandomFaction"] == "True" else p0_faction
-            p1_selected_faction = "Any" if player1["IsRandomFaction"] == "True" else p1_faction
-
-        if not p0_fingerprint or not p1_fingerprint:
-            p0_auth = "yes" if p0_fingerprint else "no"
-            p1_auth = "yes" if p1_fingerprint else "no"
-            raise Exception(f"not all players are authenticated ({p0_name}: {p0_auth}, {p1_name}: {p1_auth})")
-
-        if p0_fingerprint == p1_fingerprint:
-            raise Exception(f"player {p0_name} and {p1_name} are the same player")
-
-        #
-        # Override the end time with the outcome time if available. This gives
-        # a more accurate game duration because it doesn't take into account
-        # the time between the end of the game and the moment all players and
-        # spectators disconnected.
-        #
-        # Unfortunately, it may be undefined, typicall in the case of a
-        # disconnect loss.
-        #
-        if p0_outcome in ("Won", "Lost") and p1_outcome in ("Won", "Lost"):
-            p0_outcome_time = player0.get("OutcomeTimestampUtc")
-            p1_outcome_time = player1.get("OutcomeTimestampUtc")
-            if p0_outcome_time and p0_outcome_time == p1_outcome_time:
-                end_time = _parse_date_fmt(p0_outcome_time)
-
-        pA = GamePlayerInfo(p0_fingerprint, p0_name, p0_faction, p0_selected_faction)
-        pB = GamePlayerInfo(p1_fingerprint, p1_name, p1_faction, p1_selected_faction)
-
-        if (p0_outcome, p1_outcome) == ("Won", "Lost"):
+        if p0_disconnect > p1_disconnect:
             p0 = pA
             p1 = pB
-        elif (p1_outcome, p0_outcome) == ("Won", "Lost"):
+        elif p0_disconnect < p1_disconnect:
             p0 = pB
             p1 = pA
         else:
-            if p0_outcome != p1_outcome:
-                raise Exception(f"game result is half set: {p0_outcome} / {p1_outcome}")
+            raise Exception(f"players disconnected at the same time ({p0_disconnect}), draw")
 
-            p0_disconnect = int(player0.get("DisconnectFrame", 0))
-            p1_disconnect = int(player1.get("DisconnectFrame", 0))
-            if not p0_disconnect or not p1_disconnect:
-                raise Exception(f"invalid disconnect frames {p0_disconnect} / {p1_disconnect}")
+    return GameResult(start_time, end_time, filename, p0, p1, map_uid, map_title)
 
-            if p0_disconnect > p1_disconnect:
-                p0 = pA
-                p1 = pB
-            elif p0_disconnect < p1_disconnect:
-                p0 = pB
-                p1 = pA
-            else:
-                raise Exception(f"players disconnected at the same time ({p0_disconnect}), draw")
 
-        return GameResult(start_time, end_time, filename, p0, p1, map_uid, map_title)
+def iter_files(paths):
+    """Yields the files in `paths`, directories being walked recursively"""
+    for path in paths:
+        if op.isdir(path):
+            for root, dirs, files in os.walk(path):
+                for name in files:
+                    yield op.join(root, name)
+        else:
+            yield path
 
 
-def _log_result(filename):
+def _get_result_or_error(filename):
     try:
-        result = get_result(filename)
+        return get_result(filename), None
     except Exception as e:
-        logging.error(f"{op.basename(filename)}: {e}")
-    else:
-        logging.info(result)
+        return None, str(e)
+
+
+def get_results_or_errors(filenames, jobs=1):
+    """Decodes the replays and yields a (result, error) pair for each of them, in the order of `filenames`
+
+    With more than one job, the replays are decoded in chunks by a pool of worker processes. Passing 0 jobs uses one
+    process per CPU.
+    """
+    jobs = jobs or os.cpu_count()
+    if jobs == 1 or len(filenames) < 2:
+        yield from map(_get_result_or_error, filenames)
+        return
+    chunksize = max(1, min(64, len(filenames) // (jobs * 4)))
+    with ProcessPoolExecutor(jobs) as executor:
+        yield from executor.map(_get_result_or_error, filenames, chunksize=chunksize)
+
+
+def jobs_type(value):
+    """argparse type of the number of decoding processes passed to `get_results_or_errors()`"""
+    jobs = int(value)
+    if jobs < 0:
+        raise argparse.ArgumentTypeError(f"invalid number of jobs: {value} (0: one per CPU)")
+    return jobs
 
 
 def _main(args):
     logging.basicConfig(level="INFO", format="%(message)s")
-    for filename in sorted(args.replays):
-        if op.isdir(filename):
-            for root, dirs, files in os.walk(filename):
-                for name in files:
-                    _log_result(op.join(root, name))
+    filenames = list(iter_files(sorted(args.replays)))
+    for filename, (result, error) in zip(filenames, get_results_or_errors(filenames, args.jobs)):
+        if error is not None:
+            logging.error(f"{op.basename(filename)}: {error}")
         else:
-            _log_result(filename)
+            logging.info(result)
 
 
 def run():
     parser = argparse.ArgumentParser()
+    parser.add_argument("-j", "--jobs", type=jobs_type, default=1, help="Number of decoding processes (0: one per CPU)")
     parser.add_argument("replays", nargs="+")
     args = parser.parse_args()
     _main(args)
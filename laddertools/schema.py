@@ -0,0 +1,42 @@
+#
+# Copyright (C) 2022
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import glob
+import logging
+import os.path as op
+
+
+def _get_migrations(name):
+    """Returns the paths of the migration scripts of the `name` schema, in order"""
+    return sorted(glob.glob(op.join(op.dirname(__file__), "migrations", name, "[0-9]*.sql")))
+
+
+def migrate(conn, name):
+    """Brings a database created with the `name` schema ("ladder" or "ragl") up to date.
+
+    The migrations are the numbered SQL scripts of the `migrations/<name>/`
+    directory. The number of migrations applied is kept as the `user_version`
+    of the database, so that each of them only runs once; they are still
+    expected to be idempotent. Tables dropped and re-created from the base
+    schema must reset the `user_version` to 0.
+    """
+    (version,) = conn.execute("PRAGMA user_version").fetchone()
+    migrations = _get_migrations(name)
+    for number, path in enumerate(migrations[version:], version + 1):
+        logging.info(f"Applying {name} migration {op.basename(path)}")
+        with open(path) as f:
+            conn.executescript(f"BEGIN;\n{f.read()}\nPRAGMA user_version={number};\nCOMMIT;")
@@ -0,0 +1,13 @@
+CREATE TABLE IF NOT EXISTS season_players (
+	profile_id         INTEGER NOT NULL,
+	season             TEXT NOT NULL,
+	rank               INTEGER,
+	rating             INTEGER NOT NULL,
+	wins               INTEGER NOT NULL,
+	losses             INTEGER NOT NULL,
+	avg_game_duration  REAL NOT NULL,
+	PRIMARY KEY (profile_id, season)
+) WITHOUT ROWID;
+
+-- Seasons copied into the summary, the other ones are read from their own database
+CREATE INDEX IF NOT EXISTS season_players_season ON season_players (season);
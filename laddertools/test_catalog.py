@@ -0,0 +1,106 @@
+import os
+
+from . import replay
+from .catalog import ReplayCatalog
+from .utils import get_results
+
+
+def _accounts(*names):
+    return {f"fp-{name}": (i, name, "") for i, name in enumerate(names, 1)}
+
+
+def _count_decodes(monkeypatch):
+    decoded = []
+    get_result = replay.get_result
+
+    def _get_result(filename):
+        decoded.append(filename)
+        return get_result(filename)
+
+    monkeypatch.setattr(replay, "get_result", _get_result)
+    return decoded
+
+
+def test_catalog_skips_known_replays(tmp_path, make_replay, monkeypatch):
+    make_replay(end_time="2022-03-01 10-20-00")
+    make_replay(end_time="2022-03-02 10-20-00", winner=("bob", "fp-bob"), loser=("alice", "fp-alice"))
+    replays_dir = str(tmp_path / "replays")
+    catalog_path = str(tmp_path / "catalog.sqlite3")
+    decoded = _count_decodes(monkeypatch)
+
+    catalog = ReplayCatalog(catalog_path)
+    first = get_results(_accounts("alice", "bob"), [replays_dir], catalog=catalog)
+    catalog.close()
+    assert len(decoded) == 2
+
+    decoded.clear()
+    catalog = ReplayCatalog(catalog_path)
+    second = get_results(_accounts("alice", "bob"), [replays_dir], catalog=catalog)
+    catalog.close()
+    assert decoded == []
+
+    assert [str(r) for r in first] == [str(r) for r in second]
+    assert [(r.start_time, r.end_time, r.map_title) for r in first] == [
+        (r.start_time, r.end_time, r.map_title) for r in second
+    ]
+    assert [r.player1.faction for r in second] == ["Allies", "Allies"]
+
+
+def test_catalog_invalidates_modified_replays(tmp_path, make_replay, monkeypatch):
+    path = make_replay()
+    catalog_path = str(tmp_path / "catalog.sqlite3")
+    decoded = _count_decodes(monkeypatch)
+
+    catalog = ReplayCatalog(catalog_path)
+    get_results(_accounts("alice", "bob"), [str(path)], catalog=catalog)
+    catalog.close()
+
+    path.write_bytes(path.read_bytes()[:-8] + b"\0" * 8)  # broken end marker
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+
+    decoded.clear()
+    for _ in range(2):
+        catalog = ReplayCatalog(catalog_path)
+        assert get_results(_accounts("alice", "bob"), [str(path)], catalog=catalog) == []
+        catalog.close()
+    assert len(decoded) == 1  # parsing errors are cached as well
+
+
+def test_catalog_keeps_walk_order_of_simultaneous_games(tmp_path, make_replay):
+    names = ["alice", "bob", "carol", "dave"]
+    replays_dir = str(tmp_path / "replays")
+    catalog_path = str(tmp_path / "catalog.sqlite3")
+    make_replay(name="b.orarep", winner=("bob", "fp-bob"), loser=("carol", "fp-carol"))
+
+    catalog = ReplayCatalog(catalog_path)
+    get_results(_accounts(*names), [replays_dir], catalog=catalog)
+    catalog.close()
+
+    make_replay(name="a.orarep")
+    make_replay(name="c.orarep", winner=("dave", "fp-dave"), loser=("alice", "fp-alice"))
+    catalog = ReplayCatalog(catalog_path)
+    cached = get_results(_accounts(*names), [replays_dir], catalog=catalog)
+    catalog.close()
+
+    walk_order = list(replay.iter_files([replays_dir]))
+    assert [r.filename for r in cached] == [r.filename for r in get_results(_accounts(*names), [replays_dir])]
+    assert [r.filename for r in cached] == walk_order
+
+
+def test_catalog_is_shared_by_concurrent_runs(tmp_path, make_replay, monkeypatch):
+    make_replay(end_time="2022-03-01 10-20-00")
+    make_replay(end_time="2022-03-02 10-20-00")
+    replays_dir = str(tmp_path / "replays")
+    catalog_path = str(tmp_path / "catalog.sqlite3")
+    monkeypatch.setattr(ReplayCatalog, "commit_interval", 2)
+    decoded = _count_decodes(monkeypatch)
+
+    # The entries of a run still in progress are committed by batches, without blocking the other runs
+    catalog = ReplayCatalog(catalog_path)
+    get_results(_accounts("alice", "bob"), [replays_dir], catalog=catalog)
+    other_catalog = ReplayCatalog(catalog_path)
+    get_results(_accounts("alice", "bob"), [replays_dir], catalog=other_catalog)
+    other_catalog.close()
+    catalog.close()
+    assert len(decoded) == 2
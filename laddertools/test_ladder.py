@@ -0,0 +1,254 @@
+import json
+import pstats
+import sqlite3
+import sys
+
+import pytest
+
+from . import ladder, utils
+from .rankings.abc import RankingBase
+
+
+def _outcomes(database):
+    conn = sqlite3.connect(database)
+    rows = conn.execute("SELECT end_time FROM outcomes ORDER BY end_time").fetchall()
+    conn.close()
+    return [end_time for (end_time,) in rows]
+
+
+def test_dbtool_parses_once_for_all_seasons(tmp_path, make_replay, fake_accounts, monkeypatch):
+    for end_time in ("2021-01-15", "2021-02-28", "2021-03-01", "2021-06-30", "2021-12-31"):
+        make_replay(end_time=f"{end_time} 10-20-00")
+
+    calls = []
+    get_results = utils.get_results
+
+    def _get_results(*args, **kwargs):
+        calls.append(args)
+        return get_results(*args, **kwargs)
+
+    monkeypatch.setattr(ladder, "get_results", _get_results)
+    monkeypatch.chdir(tmp_path)
+    argv = ["ora-dbtool", "-y", "2021", "--all-time", str(tmp_path / "replays")]
+    monkeypatch.setattr(sys, "argv", argv)
+    ladder.initialize_periodic_databases()
+
+    assert len(calls) == 1
+    assert sorted(fake_accounts) == ["fp-alice", "fp-bob"]
+    assert _outcomes("db-ra-2021-1.sqlite3") == ["2021-01-15 10:20:00", "2021-02-28 10:20:00"]
+    assert _outcomes("db-ra-2021-2.sqlite3") == ["2021-03-01 10:20:00"]
+    assert _outcomes("db-ra-2021-3.sqlite3") == ["2021-06-30 10:20:00"]
+    assert _outcomes("db-ra-2021-6.sqlite3") == ["2021-12-31 10:20:00"]
+    assert len(_outcomes("db-ra-all.sqlite3")) == 5
+
+    conn = sqlite3.connect("db-ra-summary.sqlite3")
+    seasons = conn.execute("SELECT season, SUM(wins), SUM(losses) FROM season_players GROUP BY season").fetchall()
+    conn.close()
+    assert seasons == [("2021-1", 2, 2), ("2021-2", 1, 1), ("2021-3", 1, 1), ("2021-6", 1, 1), ("all", 5, 5)]
+
+
+def _run_ladder(monkeypatch, *args):
+    monkeypatch.setattr(sys, "argv", ["ora-ladder", *args])
+    ladder.run()
+
+
+def _dump(database):
+    conn = sqlite3.connect(database)
+    dump = {
+        table: conn.execute(f"SELECT * FROM {table} ORDER BY 1, 2, 3").fetchall()
+        for table in ("players", "outcomes", "player_games", "player_stats", "player_ratings")
+    }
+    for table in ("global_stats", "global_faction_stats", "global_map_stats", "daily_activity"):
+        dump[table] = conn.execute(f"SELECT * FROM {table} ORDER BY 1").fetchall()
+    conn.close()
+    return dump
+
+
+def _make_games(make_replay, days):
+    players = [("alice", "fp-alice"), ("bob", "fp-bob"), ("carol", "fp-carol")]
+    for day in days:
+        make_replay(
+            name=f"game-{day:02d}.orarep",
+            start_time=f"2022-03-{day:02d} 10-00-00",
+            end_time=f"2022-03-{day:02d} 10-20-00",
+            winner=players[day % 3],
+            loser=players[(day + 1 + day // 3 % 2) % 3],
+        )
+
+
+def test_incremental_update_matches_full_rebuild(tmp_path, make_replay, fake_accounts, monkeypatch):
+    replays = str(tmp_path / "replays")
+    incremental_db = str(tmp_path / "incremental.sqlite3")
+    full_db = str(tmp_path / "full.sqlite3")
+
+    _make_games(make_replay, range(1, 8))
+    _run_ladder(monkeypatch, "-i", "-d", incremental_db, replays)
+    _make_games(make_replay, range(8, 12))
+
+    write_database = ladder._write_database
+    rebuilds = []
+    monkeypatch.setattr(ladder, "_write_database", lambda *args: rebuilds.append(args))
+    _run_ladder(monkeypatch, "-i", "-d", incremental_db, replays)
+    assert rebuilds == []
+    monkeypatch.setattr(ladder, "_write_database", write_database)
+
+    _run_ladder(monkeypatch, "-d", full_db, replays)
+    assert _dump(incremental_db) == _dump(full_db)
+    dump = _dump(full_db)
+    assert len(dump["outcomes"]) == 11
+    assert sum(count for _, count in dump["global_faction_stats"]) == 2 * 11
+
+
+def test_incremental_update_falls_back_on_older_replays(tmp_path, make_replay, fake_accounts, monkeypatch):
+    replays = str(tmp_path / "replays")
+    incremental_db = str(tmp_path / "incremental.sqlite3")
+    full_db = str(tmp_path / "full.sqlite3")
+
+    _make_games(make_replay, range(5, 10))
+    _run_ladder(monkeypatch, "-i", "-d", incremental_db, replays)
+    _make_games(make_replay, [3, 11])
+    _run_ladder(monkeypatch, "-i", "-d", incremental_db, replays)
+
+    _run_ladder(monkeypatch, "-d", full_db, replays)
+    assert _dump(incremental_db) == _dump(full_db)
+    assert len(_dump(full_db)["outcomes"]) == 7
+
+
+@pytest.mark.parametrize("ranking", ["trueskill", "glicko"])
+def test_incremental_update_resumes_from_checkpoint(tmp_path, make_replay, fake_accounts, monkeypatch, ranking):
+    replays = str(tmp_path / "replays")
+    incremental_db = str(tmp_path / "incremental.sqlite3")
+    full_db = str(tmp_path / "full.sqlite3")
+    monkeypatch.setattr(RankingBase, "checkpoint_interval", 2)
+    monkeypatch.setattr(ladder, "_OUTCOMES_CHUNK_SIZE", 4)
+
+    _make_games(make_replay, range(1, 16))
+    _run_ladder(monkeypatch, "-i", "-r", ranking, "-d", incremental_db, replays)
+    make_replay(
+        start_time="2022-03-13 08-00-00",
+        end_time="2022-03-13 08-20-00",
+        winner=("carol", "fp-carol"),
+        loser=("alice", "fp-alice"),
+    )
+    (tmp_path / "replays" / "game-14.orarep").unlink()
+
+    ranked = []
+    get_players_outcomes = ladder._get_players_outcomes
+
+    def _get_players_outcomes(accounts_db, results, *args):
+        ranked.append(len(results))
+        return get_players_outcomes(accounts_db, results, *args)
+
+    monkeypatch.setattr(ladder, "_get_players_outcomes", _get_players_outcomes)
+    _run_ladder(monkeypatch, "-i", "-r", ranking, "-d", incremental_db, replays)
+    _run_ladder(monkeypatch, "-r", ranking, "-d", full_db, replays)
+    assert 0 < ranked[0] < ranked[1] == 15
+    assert _dump(incremental_db) == _dump(full_db)
+
+
+def test_checkpoints_are_pruned(tmp_path, make_replay, fake_accounts, monkeypatch):
+    replays = str(tmp_path / "replays")
+    database = str(tmp_path / "db.sqlite3")
+    monkeypatch.setattr(RankingBase, "checkpoint_interval", 2)
+
+    def _make_month_games(month, days):
+        for day in days:
+            make_replay(
+                end_time=f"2022-{month:02d}-{day:02d} 10-20-00", start_time=f"2022-{month:02d}-{day:02d} 10-00-00"
+            )
+
+    def _checkpoint_months():
+        conn = sqlite3.connect(database)
+        rows = conn.execute("SELECT end_time FROM rating_checkpoints ORDER BY game_index").fetchall()
+        conn.close()
+        return [int(end_time[5:7]) for (end_time,) in rows]
+
+    # A checkpoint at the end of each month: the last 4 ones are kept, and the last one of each previous season
+    for month in range(1, 13):
+        _make_month_games(month, (5, 20))
+    _run_ladder(monkeypatch, "-d", database, replays)
+    assert _checkpoint_months() == [2, 4, 6, 8, 9, 10, 11, 12]
+
+    _make_month_games(12, (21, 22, 23, 24))
+    _run_ladder(monkeypatch, "-i", "-d", database, replays)
+    assert _checkpoint_months() == [2, 4, 6, 8, 10, 11, 12, 12, 12]
+
+
+def test_rebuild_replaces_published_database_atomically(tmp_path, make_replay, fake_accounts, monkeypatch):
+    replays = str(tmp_path / "replays")
+    database = str(tmp_path / "db.sqlite3")
+    _make_games(make_replay, range(1, 4))
+    _run_ladder(monkeypatch, "-d", database, replays)
+
+    reader = sqlite3.connect(database)
+    reader.execute("BEGIN")
+    assert reader.execute("SELECT COUNT(*) FROM outcomes").fetchone() == (3,)
+    _make_games(make_replay, range(4, 6))
+    _run_ladder(monkeypatch, "-d", database, replays)
+    assert reader.execute("SELECT COUNT(*) FROM outcomes").fetchone() == (3,)
+    reader.close()
+
+    assert len(_outcomes(database)) == 5
+    conn = sqlite3.connect(database)
+    assert conn.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+    conn.close()
+    assert not (tmp_path / "db.sqlite3.tmp").exists()
+
+
+def test_rebuild_fails_when_the_published_database_is_busy(tmp_path, make_replay, fake_accounts, monkeypatch):
+    replays = str(tmp_path / "replays")
+    database = str(tmp_path / "db.sqlite3")
+    _make_games(make_replay, range(1, 4))
+    _run_ladder(monkeypatch, "-d", database, replays)
+
+    # A reader still needs the previous version of the pages written into the WAL, which cannot be checkpointed
+    reader = sqlite3.connect(database)
+    reader.execute("BEGIN")
+    reader.execute("SELECT COUNT(*) FROM outcomes").fetchone()
+    writer = sqlite3.connect(database)
+    writer.execute("DELETE FROM outcomes")
+    writer.commit()
+    writer.close()
+
+    with pytest.raises(SystemExit) as exc_info:
+        _run_ladder(monkeypatch, "-d", database, replays)
+    assert exc_info.value.code == 1
+    reader.close()
+    assert _outcomes(database) == []
+
+
+def test_refresh_accounts(tmp_path, make_replay, fake_accounts, monkeypatch):
+    replays = str(tmp_path / "replays")
+    database = str(tmp_path / "db.sqlite3")
+    _make_games(make_replay, range(1, 4))
+    _run_ladder(monkeypatch, "-d", database, replays)
+    queried = len(fake_accounts)
+    _run_ladder(monkeypatch, "-i", "-d", database, replays)
+    assert len(fake_accounts) == queried
+    _run_ladder(monkeypatch, "-i", "--refresh-accounts", "-d", database, replays)
+    assert len(fake_accounts) == 2 * queried > 0
+    assert len(_outcomes(database)) == 3
+
+
+def test_profile_report(tmp_path, make_replay, fake_accounts, monkeypatch):
+    replays = str(tmp_path / "replays")
+    report = tmp_path / "profile.json"
+    _make_games(make_replay, range(1, 4))
+    _run_ladder(
+        monkeypatch, "-d", str(tmp_path / "db.sqlite3"), "--profile", str(report), "--profile-stage", "ranking", replays
+    )
+
+    stages = json.loads(report.read_text())
+    assert stages.keys() == {
+        "directory walk",
+        "replay decode",
+        "account resolution",
+        "ranking",
+        "sql write",
+        "commit",
+        "total",
+    }
+    assert stages["replay decode"]["items"] == 3
+    assert stages["ranking"]["items"] == 3
+    assert all(s["wall_time"] >= 0 and s["cpu_time"] >= 0 for s in stages.values())
+    assert any("_get_players_outcomes" in func for _, _, func in pstats.Stats(f"{report}.pstats").stats)
@@ -0,0 +1,35 @@
+import pytest
+
+from . import miniyaml
+from .conftest import build_replay
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"",
+        b"Player:\n\tFingerprint: abc\n\tAvatar:\n",
+        b"A:\n\tB:\n\t\tC: x: y\n\tD:\nE:  value with spaces \r\nno key\n:no key either\n\tF: 1\n",
+        b"A:\n\tB: 1\nA: 2\n\tC: 3\nD:\n",
+        b"A:\n\t\tB:\n\t\tC: 1\n",
+        "Name: \u00e9t\u00e9\n".encode(),
+    ],
+)
+def test_load_matches_reference(data):
+    assert miniyaml.load(data) == miniyaml._load_regex(data)
+
+
+def test_load_replay_footer():
+    replay = build_replay()
+    footer = replay[replay.index(b"Root:") : -8]
+    info = miniyaml.load(footer)
+    assert info == miniyaml._load_regex(footer)
+    assert info["Root"]["MapTitle"] == "Test Map"
+    assert info["Player@1"]["Outcome"] == "Lost"
+
+
+def test_load_selected_keys():
+    data = b"Root:\n\tMod: ra\nSpectator@0:\n\tName: eve\nPlayer@0:\n\tName: alice\nPlayer: x\nLobby:\n\tOption:\n\t\tA: 1\n"
+    assert miniyaml.load(data, keys={"Root", "Player@"}) == {"Root": {"Mod": "ra"}, "Player@0": {"Name": "alice"}}
+    assert miniyaml.load(data, keys={"Player"}) == {"Player": "x"}
+    assert miniyaml.load(data, keys=set()) == ""
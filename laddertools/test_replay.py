@@ -0,0 +1,33 @@
+import pytest
+
+from . import replay
+from .conftest import build_replay
+
+
+def test_read_game_yaml(tmp_path):
+    path = tmp_path / "game.orarep"
+    data = build_replay(payload=b"\0" * 100000)
+    path.write_bytes(data)
+    assert replay._read_game_yaml(path) == data[data.index(b"Root:") : -8]
+
+    # Metadata larger than the tail read at once
+    data = build_replay(map_title="M" * replay._TAIL_SIZE)
+    path.write_bytes(data)
+    assert replay.get_result(path).map_title == "M" * replay._TAIL_SIZE
+
+
+@pytest.mark.parametrize(
+    "data, error",
+    [
+        (b"\xfe\xff\xff\xff", "too small"),
+        (build_replay()[:-1], "end marker"),
+        (build_replay()[200:], "metadata length"),
+        (b"\0" + build_replay(payload=b"")[1:], "start marker"),
+    ],
+    ids=["small", "end", "length", "start"],
+)
+def test_read_game_yaml_invalid(tmp_path, data, error):
+    path = tmp_path / "game.orarep"
+    path.write_bytes(data)
+    with pytest.raises(Exception, match=error):
+        replay._read_game_yaml(path)
@@ -0,0 +1,65 @@
+import os.path as op
+import sqlite3
+
+from .conftest import get_full_scans, get_migration_indexes, get_used_indexes, trace_queries
+from .schema import migrate
+
+
+def test_migrations_are_applied_once(tmp_path):
+    conn = sqlite3.connect(tmp_path / "db.sqlite3")
+    with open(op.join(op.dirname(__file__), "ladder.sql")) as f:
+        conn.executescript(f.read())
+    migrate(conn, "ladder")
+    (version,) = conn.execute("PRAGMA user_version").fetchone()
+    indexes = conn.execute("SELECT name FROM sqlite_master WHERE type='index' AND sql IS NOT NULL").fetchall()
+    assert version > 0 and indexes
+
+    conn.execute("DROP INDEX outcomes_end_time_hash")
+    migrate(conn, "ladder")
+    assert conn.execute("PRAGMA user_version").fetchone() == (version,)
+    assert len(conn.execute("SELECT name FROM sqlite_master WHERE type='index' AND sql IS NOT NULL").fetchall()) == (
+        len(indexes) - 1
+    )
+
+    # The indexes of the first migration no query uses any more are dropped by the following ones
+    conn.execute("PRAGMA user_version=0")
+    migrate(conn, "ladder")
+    assert conn.execute("SELECT name FROM sqlite_master WHERE type='index' AND sql IS NOT NULL").fetchall() == indexes
+    conn.close()
+
+
+def test_raglweb_queries_use_indexes(tmp_path, make_replay, fake_accounts, monkeypatch):
+    database = tmp_path / "db-ragl.sqlite3"
+    conn = sqlite3.connect(database)
+    with open(op.join(op.dirname(__file__), "ragl.sql")) as f:
+        conn.executescript(f.read())
+    path = make_replay()
+    conn.executemany(
+        "INSERT INTO players VALUES (?,?,?,?,?,?,?)",
+        [(1, "alice", "", 1, 0, "Division 1", None), (2, "bob", "", 0, 1, "Division 1", None)],
+    )
+    row = ("h", "2022-03-01 10:00:00", "2022-03-01 10:20:00", str(path), 1, 2, "a", "b", "a", "b", "m", "Map")
+    conn.execute("INSERT INTO outcomes VALUES (?,?,?,?,?,?,?,?,?,?,?,?)", row)
+    conn.execute("INSERT INTO forfeit_games VALUES (2, 1, '2022-03-02', NULL)")
+    conn.execute("INSERT INTO playoffs VALUES ('Final', 3)")
+    conn.executemany("INSERT INTO playoff_playersets VALUES ('Final', ?)", [(1,), (2,)])
+    conn.commit()
+    migrate(conn, "ragl")
+    conn.close()
+
+    monkeypatch.setenv("RAGL_CONFIG", op.join(op.dirname(__file__), "..", "misc", "ragl_config.py"))
+    monkeypatch.setenv("RAGLWEB_DATABASE", str(database))
+    from raglweb import app
+
+    monkeypatch.setitem(app.config, "DATABASE", str(database))
+    monkeypatch.setitem(app.config, "LEAGUE_TITLE_SHORT", "RAGL")
+    queries = trace_queries(monkeypatch)
+
+    client = app.test_client()
+    for url in ("/", "/playoffs", "/games", "/games/json", "/player/1", "/player/2", "/replay/h"):
+        assert client.get(url).status_code == 200, url
+
+    # The players (a few dozens at most) and playoffs tables are small enough to be read whole
+    assert queries
+    assert {table for table, _ in get_full_scans(queries)} <= {"players", "pl", "playoffs"}
+    assert get_migration_indexes(database) <= get_used_indexes(queries)
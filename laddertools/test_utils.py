@@ -0,0 +1,31 @@
+import argparse
+
+import pytest
+
+from .replay import jobs_type
+from .utils import get_results
+
+
+def test_parallel_decoding_matches_sequential(tmp_path, make_replay):
+    players = [("alice", "fp-alice"), ("bob", "fp-bob"), ("carol", "fp-carol")]
+    for i in range(12):
+        make_replay(
+            end_time=f"2022-03-{12 - i:02d} 10-20-00",
+            winner=players[i % 3],
+            loser=players[(i + 1) % 3],
+        )
+    (tmp_path / "replays" / "broken.orarep").write_bytes(b"\0" * 16)
+    accounts = {fp: (i, name, "") for i, (name, fp) in enumerate(players, 1)}
+
+    sequential = get_results(dict(accounts), [str(tmp_path / "replays")])
+    parallel = get_results(dict(accounts), [str(tmp_path / "replays")], jobs=3)
+
+    assert len(sequential) == 12
+    assert [(r.filename, r.end_time) for r in parallel] == [(r.filename, r.end_time) for r in sequential]
+    assert [r.end_time for r in parallel] == sorted(r.end_time for r in parallel)
+
+
+def test_jobs_type():
+    assert jobs_type("0") == 0 and jobs_type("4") == 4
+    with pytest.raises(argparse.ArgumentTypeError):
+        jobs_type("-1")
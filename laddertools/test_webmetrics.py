@@ -0,0 +1,50 @@
+import hashlib
+import logging
+import sqlite3
+
+from flask import Flask, jsonify
+
+from .webmetrics import InstrumentedConnection, init_app, record_cache
+
+
+def test_metrics(tmp_path, caplog):
+    conn = sqlite3.connect(tmp_path / "db.sqlite3", factory=InstrumentedConnection, check_same_thread=False)
+    conn.execute("CREATE TABLE t (x INTEGER)")
+    conn.executemany("INSERT INTO t VALUES (?)", [(i,) for i in range(10)])
+
+    app = Flask(__name__)
+    init_app(app, slow_query_time=0)
+
+    @app.route("/values/<int:n>")
+    def values(n):
+        record_cache("test", n > 5)
+        return jsonify([x for (x,) in conn.execute("SELECT x FROM t WHERE x < ?", (n,))])
+
+    @app.route("/first")
+    def first():
+        # The cursor is not finished, it is recorded once garbage collected
+        return jsonify(conn.execute("SELECT MIN(x) FROM t").fetchone()[0])
+
+    @app.route("/fail")
+    def fail():
+        raise ValueError
+
+    client = app.test_client()
+    with caplog.at_level(logging.INFO):
+        assert client.get("/values/3").json == [0, 1, 2]
+    label = hashlib.sha1(b"SELECT x FROM t WHERE x < ?").hexdigest()[:12]
+    assert f"Query {label}: SELECT x FROM t WHERE x < ?" in caplog.text
+    assert "Slow query" in caplog.text and "SCAN t" in caplog.text
+    assert client.get("/values/7").status_code == 200
+    assert client.get("/first").json == 0
+    assert client.get("/fail").status_code == 500
+
+    metrics = client.get("/metrics").data.decode().splitlines()
+    assert 'http_request_duration_seconds_count{endpoint="values",method="GET",status="200"} 2' in metrics
+    assert 'http_request_duration_seconds_count{endpoint="fail",method="GET",status="500"} 1' in metrics
+    assert f'sqlite_query_duration_seconds_count{{endpoint="values",query="{label}"}} 2' in metrics
+    assert f'sqlite_query_rows_total{{endpoint="values",query="{label}"}} 10' in metrics
+    label = hashlib.sha1(b"SELECT MIN(x) FROM t").hexdigest()[:12]
+    assert f'sqlite_query_rows_total{{endpoint="first",query="{label}"}} 1' in metrics
+    assert 'cache_requests_total{cache="test",result="hit"} 1' in metrics
+    assert 'cache_requests_total{cache="test",result="miss"} 1' in metrics
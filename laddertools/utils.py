@@ -23,6 +23,7 @@ from typing import Optional
 from urllib.request import urlopen
 
 from . import miniyaml, replay
+from .profiling import stage
 
 
 def _update_account_cache(accounts_db, player):
@@ -72,38 +73,87 @@ def _update_account_cache(accounts_db, player):
     return True
 
 
-def _parse_replay(results, accounts_db, filename):
-    if not filename.endswith(".orarep"):
-        return
-    try:
-        result = replay.get_result(filename)
-    except Exception as e:
-        logging.error(f"{op.basename(filename)}: {e}")
-        return
-    if _update_account_cache(accounts_db, result.player0) and _update_account_cache(accounts_db, result.player1):
-        results.append(result)
+def _iter_decoded(filenames, catalog, jobs):
+    """Yields the index, result and error of each replay file, decoding only the ones unknown to the catalog
+
+    The replays known to the catalog come first, then the decoded ones as they are decoded.
+    """
+    pending = []
+    for index, filename in enumerate(filenames):
+        if catalog is None:
+            pending.append((index, filename, None))
+            continue
+        try:
+            stat = os.stat(filename)
+        except OSError as e:
+            yield index, None, str(e)
+            continue
+        hit, result, error = catalog.lookup(filename, stat)
+        if hit:
+            yield index, result, error
+        else:
+            pending.append((index, filename, stat))
+
+    pending_filenames = [filename for _, filename, _ in pending]
+    for (index, filename, stat), (result, error) in zip(pending, replay.get_results_or_errors(pending_filenames, jobs)):
+        if catalog is not None:
+            catalog.store(filename, stat, result, error)
+        yield index, result, error
+
+
+def _in_period(result, period_dict: Optional[dict]):
+    return period_dict is None or period_dict["start"] <= result.end_time.date() <= period_dict["end"]
+
+
+def iter_results(accounts_db, replays, period_dict: Optional[dict] = None, catalog=None, jobs=1):
+    """Yields the results of the games with identified players as the replays are decoded, along with the index of
+    their replay in the directory walk
+
+    See `get_results()` for the parameters. The results are not ordered (the ones known to the catalog come first),
+    but only the ones within the period are yielded, so that the memory used by the caller gathering them does not
+    depend on the number of replays outside of it.
+    """
+    with stage("directory walk") as s:
+        filenames = [f for f in replay.iter_files(replays) if f.endswith(".orarep")]
+        s.items = len(filenames)
+    decoded = _iter_decoded(filenames, catalog, jobs)
+    while True:
+        with stage("replay decode") as s:
+            item = next(decoded, None)
+            s.items = int(item is not None)
+        if item is None:
+            return
+        index, result, error = item
+        filename = filenames[index]
+        if error is not None:
+            logging.error(f"{op.basename(filename)}: {error}")
+            continue
+        with stage("account resolution") as s:
+            identified = _update_account_cache(accounts_db, result.player0) and _update_account_cache(
+                accounts_db, result.player1
+            )
+            s.items = int(identified)
+        if not identified:
+            continue
         logging.info(f"{op.basename(filename)}: recorded")
+        if _in_period(result, period_dict):
+            yield index, result
 
 
-def _filter_period(results, period_dict: Optional[dict]):
-    if period_dict is None:
-        return results
-    start = period_dict["start"]
-    end = period_dict["end"]
-    return [r for r in results if (start <= r.end_time.date() <= end)]
+def get_results(accounts_db, replays, period_dict: Optional[dict] = None, catalog=None, jobs=1):
+    """Parse all the replays and return the results of the games with identified players, ordered by end time
 
+    If a `catalog.ReplayCatalog` is specified, it is used to skip the decoding of the replays that were already
+    parsed in a previous run. The remaining replays are decoded by `jobs` processes, while the identification of the
+    players through the OpenRA account service always happens in the current process.
 
-def get_results(accounts_db, replays, period_dict: Optional[dict] = None):
-    results = []
-    for filename in replays:
-        if op.isdir(filename):
-            for root, dirs, files in os.walk(filename):
-                for name in files:
-                    _parse_replay(results, accounts_db, op.join(root, name))
-        else:
-            _parse_replay(results, accounts_db, filename)
-    results = _filter_period(results, period_dict)
-    return sorted(results, key=lambda r: r.end_time)
+    Only the decoding is streamed (see `iter_results()`): the results within the period are gathered into a list and
+    sorted, since the rankings (the rating periods of Glicko) and the checkpoints need the whole ordered series.
+    """
+    results = list(iter_results(accounts_db, replays, period_dict, catalog, jobs))
+    # Games ending at the same time keep the order of the directory walk
+    results.sort(key=lambda item: (item[1].end_time, item[0]))
+    return [result for _, result in results]
 
 
 _banned_profile_re = re.compile(r"^\d+")
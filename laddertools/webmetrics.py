@@ -0,0 +1,317 @@
+#
+# Copyright (C) 2022
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Request, SQLite query and cache metrics of the web applications (ladderweb and raglweb)
+
+Once `init_app()` is called, the latency of every request is recorded per endpoint, and the metrics are exposed in
+the Prometheus text format at `/metrics`. The queries are recorded (execution time, including the fetching of the
+rows, and number of rows) per endpoint when they run on an `InstrumentedConnection`, and the caches of the
+application report their hits and misses with `record_cache()`. The queries are labelled with a short hash of their
+SQL, logged (at the INFO level) along with the SQL the first time the query is recorded.
+
+The metrics are kept in the memory of the process: with several worker processes (e.g. `gunicorn -w 4`), each scrape
+of `/metrics` only gets the share of the worker answering it, and the counters of a worker restart from zero with it.
+The application must then run in a single process (with threads for concurrency) for the metrics to cover every
+request.
+"""
+
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from flask import current_app, g, has_app_context, has_request_context, request
+
+_DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_space_regex = re.compile(r"\s+")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    labels = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class _Counter:
+    def __init__(self, name, doc, labels):
+        self.name = name
+        self.doc = doc
+        self.labels = labels
+        self.series = {}
+
+    def inc(self, values, amount=1):
+        self.series[values] = self.series.get(values, 0) + amount
+
+    def expose(self):
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} counter"
+        for values, count in sorted(self.series.items()):
+            yield f"{self.name}{_format_labels(self.labels, values)} {count}"
+
+
+class _Histogram:
+    def __init__(self, name, doc, labels, buckets=_DURATION_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, values, value):
+        # Bucket counts (not cumulative), sum and count
+        series = self.series.setdefault(values, [0] * (len(self.buckets) + 2))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        series[-2] += value
+        series[-1] += 1
+
+    def expose(self):
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} histogram"
+        for values, series in sorted(self.series.items()):
+            cumulated = 0
+            for bound, count in zip(self.buckets, series):
+                cumulated += count
+                yield f"{self.name}_bucket{_format_labels(self.labels, values, [('le', bound)])} {cumulated}"
+            yield f"{self.name}_bucket{_format_labels(self.labels, values, [('le', '+Inf')])} {series[-1]}"
+            yield f"{self.name}_sum{_format_labels(self.labels, values)} {series[-2]}"
+            yield f"{self.name}_count{_format_labels(self.labels, values)} {series[-1]}"
+
+
+class Metrics:
+    """The metrics of an application, see `init_app()`"""
+
+    def __init__(self, slow_query_time=None):
+        self.slow_query_time = slow_query_time
+        self._lock = threading.Lock()
+        self._request_duration = _Histogram(
+            "http_request_duration_seconds",
+            "Time spent handling the requests",
+            ("endpoint", "method", "status"),
+        )
+        self._query_duration = _Histogram(
+            "sqlite_query_duration_seconds",
+            "Time spent executing the queries and fetching their rows",
+            ("endpoint", "query"),
+        )
+        self._query_rows = _Counter("sqlite_query_rows_total", "Rows fetched by the queries", ("endpoint", "query"))
+        self._cache_requests = _Counter("cache_requests_total", "Lookups in the caches", ("cache", "result"))
+        self._query_labels = {}
+        # Queries recorded by the cursors garbage collected before being finished, see `defer_query()`
+        self._deferred_queries = deque()
+
+    def observe_request(self, endpoint, method, status, duration):
+        self._observe_deferred_queries()
+        with self._lock:
+            self._request_duration.observe((endpoint, method, str(status)), duration)
+
+    def observe_query(self, endpoint, sql, duration, rows, plan=None):
+        """Records a query, and logs it (with its query `plan` rows, if known) when it is slow"""
+        query = _space_regex.sub(" ", sql).strip()
+        with self._lock:
+            label = self._query_labels.get(query)
+            new = label is None
+            if new:
+                label = self._query_labels[query] = hashlib.sha1(query.encode()).hexdigest()[:12]
+            self._query_duration.observe((endpoint, label), duration)
+            self._query_rows.inc((endpoint, label), rows)
+        if new:
+            logging.info("Query %s: %s", label, query)
+        if self.slow_query_time is not None and duration >= self.slow_query_time:
+            logging.warning(
+                "Slow query %s (%.3fs, %d rows) in %s: %s\n%s",
+                label,
+                duration,
+                rows,
+                endpoint,
+                query,
+                "\n".join(row[-1] for row in plan) if plan is not None else "(no query plan)",
+            )
+
+    def defer_query(self, endpoint, sql, duration, rows):
+        """Records a query later, without taking any lock (nor running any query) now
+
+        The queries are then recorded by the next call of one of the other methods.
+        """
+        self._deferred_queries.append((endpoint, sql, duration, rows))
+
+    def _observe_deferred_queries(self):
+        while self._deferred_queries:
+            try:
+                query = self._deferred_queries.popleft()
+            except IndexError:  # taken by another thread
+                break
+            self.observe_query(*query)
+
+    def count_cache(self, cache, hit):
+        self._observe_deferred_queries()
+        with self._lock:
+            self._cache_requests.inc((cache, "hit" if hit else "miss"))
+
+    def expose(self):
+        """Returns the metrics in the Prometheus text format"""
+        self._observe_deferred_queries()
+        with self._lock:
+            metrics = (self._request_duration, self._query_duration, self._query_rows, self._cache_requests)
+            return "".join(line + "\n" for metric in metrics for line in metric.expose())
+
+
+def _get_metrics():
+    return current_app.extensions.get("metrics") if has_app_context() else None
+
+
+def record_cache(cache, hit):
+    """Records a hit (or a miss) of the cache, if the application is instrumented"""
+    metrics = _get_metrics()
+    if metrics is not None:
+        metrics.count_cache(cache, hit)
+
+
+class _InstrumentedCursor(sqlite3.Cursor):
+    """Cursor measuring the time spent in its query until all its rows are fetched (or it is closed)"""
+
+    _query = None
+    _duration = 0
+    _rows = 0
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        metrics = _get_metrics()
+        if metrics is not None:
+            endpoint = request.endpoint if has_request_context() else None
+            self._query = (metrics, endpoint, sql, parameters)
+            self._duration = 0
+            self._rows = 0
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._duration += time.perf_counter() - start
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._duration += time.perf_counter() - start
+            self._finish()
+            raise
+        self._duration += time.perf_counter() - start
+        self._rows += 1
+        return row
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._duration += time.perf_counter() - start
+        if row is None:
+            self._finish()
+        else:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._duration += time.perf_counter() - start
+        self._rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._duration += time.perf_counter() - start
+        self._rows += len(rows)
+        self._finish()
+        return rows
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        # Run by the garbage collector, possibly while the lock of the metrics is held: the query is only queued
+        if self._query is not None:
+            metrics, endpoint, sql, _ = self._query
+            self._query = None
+            metrics.defer_query(endpoint, sql, self._duration, self._rows)
+
+    def _finish(self):
+        if self._query is None:
+            return
+        metrics, endpoint, sql, parameters = self._query
+        self._query = None
+        plan = None
+        if metrics.slow_query_time is not None and self._duration >= metrics.slow_query_time:
+            plan = sqlite3.Connection.execute(self.connection, "EXPLAIN QUERY PLAN " + sql, parameters).fetchall()
+        metrics.observe_query(endpoint, sql, self._duration, self._rows, plan)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection (see the `factory` parameter of `sqlite3.connect()`) recording its queries in the metrics of the
+    application, if it is instrumented"""
+
+    def cursor(self, factory=_InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+
+def _before_request():
+    g.metrics_start = time.perf_counter()
+
+
+def _after_request(response):
+    duration = time.perf_counter() - g.pop("metrics_start")
+    current_app.extensions["metrics"].observe_request(request.endpoint, request.method, response.status_code, duration)
+    return response
+
+
+def _teardown_request(exc=None):
+    # The requests failing with an exception do not get to _after_request()
+    start = g.pop("metrics_start", None)
+    if start is not None:
+        current_app.extensions["metrics"].observe_request(
+            request.endpoint, request.method, 500, time.perf_counter() - start
+        )
+
+
+def _metrics_view():
+    return current_app.response_class(current_app.extensions["metrics"].expose(), mimetype="text/plain; version=0.0.4")
+
+
+def init_app(app, slow_query_time=None):
+    """Instruments the application and adds the `/metrics` endpoint
+
+    The queries taking at least `slow_query_time` seconds (if not None) are logged with their query plan. The
+    endpoint only exposes the metrics of the current process (see the module documentation).
+    """
+    app.extensions["metrics"] = Metrics(slow_query_time)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    app.add_url_rule("/metrics", "metrics", _metrics_view)
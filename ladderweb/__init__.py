@@ -14,21 +14,19 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
-import re
 import colorsys
+import functools
 import os
 import os.path as op
 import json
+import time
 from sqlite3 import Connection
 from typing import Optional, Tuple
 
-import numpy as np
-import sqlite3
-from datetime import date, timedelta
+from datetime import date, datetime, timezone
 from flask import (
     Flask,
     escape,
-    g,
     jsonify,
     render_template,
     request,
@@ -36,15 +34,24 @@ from flask import (
     url_for,
 )
 
+from laddertools.payloads import (
+    LATEST_GAMES_QUERY,
+    get_global_stats,
+    get_latest_game,
+    get_database_identity,
+    get_latest_games,
+    get_leaderboard,
+    get_payloads_database_info,
+    get_payloads_directory,
+    stripped_map_name,
+    unpack_rating_history,
+)
+from laddertools.webmetrics import InstrumentedConnection, init_app as init_metrics, record_cache
 from ladderweb.seasons import fill_yearly_seasons, get_season_info
+from .cache import ResponseCache
+from .freeze import freeze_command
 from .mods import mods
-
-
-# XXX: store in a file probably
-_cfg = dict(
-    min_datapoints=10,
-    datapoints=50,
-)
+from .pool import ConnectionPool
 
 
 def _get_request_params() -> Tuple[str, str, str]:
@@ -80,31 +87,24 @@ def _filter_available_databases(seasons_dict: dict):
 
 
 def _db_get(db_filename: Optional[str] = None) -> Connection:
-    if db_filename is not None:
-        dbname = db_filename
-        db = op.join(app.instance_path, dbname)
-        conn = sqlite3.connect(db, detect_types=sqlite3.PARSE_DECLTYPES)
-        conn.row_factory = sqlite3.Row
-        return conn
-    elif "db" not in g:
-        _, mod, period = _get_request_params()
-        dbname = app.config.get("LADDER_SEASONS")[mod][period]
-        db = op.join(app.instance_path, dbname)
-        app.logger.debug(f"Opening database file {db}")
-        g.db = sqlite3.connect(db, detect_types=sqlite3.PARSE_DECLTYPES)
-        g.db.row_factory = sqlite3.Row
-    return g.db
-
+    """Returns a (pooled, read-only) connection to the database file, or to the database of the request's season
 
-def _db_close(e=None):
-    db = g.pop("db", None)
-    if db is not None:
-        db.close()
+    The connections are kept open between requests: they must not be closed.
+    """
+    if db_filename is None:
+        _, mod, period = _get_request_params()
+        db_filename = app.config.get("LADDER_SEASONS")[mod][period]
+    frozen = any(
+        seasons.get(season) == db_filename
+        for seasons in app.config["LADDER_SEASONS"].values()
+        for season in seasons
+        if season not in ("all", "2m")
+    )
+    return _connection_pool.get(op.join(app.instance_path, db_filename), immutable=frozen)
 
 
 def create_app():
     app = Flask(__name__)
-    app.teardown_appcontext(_db_close)
     return app
 
 
@@ -117,20 +117,129 @@ app.config["LADDER_SEASONS"] = _filter_available_databases(
     )
 )
 app.config["ALLOWED_MODS"] = list(app.config["LADDER_SEASONS"].keys())
+app.cli.add_command(freeze_command)
 app.logger.debug(f"Loaded available mods and seasons: {app.config['LADDER_SEASONS']}")
 
+if app.config.get("LADDER_METRICS", False):
+    init_metrics(app, slow_query_time=app.config.get("LADDER_SLOW_QUERY_TIME"))
+
+_connection_pool = ConnectionPool(
+    mmap_size=app.config.get("LADDER_SQLITE_MMAP_SIZE", 256 * 1024 * 1024),
+    cache_size=app.config.get("LADDER_SQLITE_CACHE_SIZE", -8 * 1024),
+    factory=InstrumentedConnection if app.config.get("LADDER_METRICS", False) else Connection,
+)
+_response_cache = ResponseCache(app.config.get("LADDER_RESPONSE_CACHE_SIZE", 256))
+
+
+def _cached_json(view):
+    """Caches the JSON built by the view from the database of the request, and answers with ETag and Cache-Control
+
+    The responses are reused until the database gets published again, which changes the cache key: conditional
+    requests then get a `304 Not Modified` without querying the database. Clients are told to keep the response until
+    the next expected update of the database (see `LADDER_UPDATE_INTERVAL`).
+    """
+
+    @functools.wraps(view)
+    def _view(**kwargs):
+        # DataTables requests are all different (draw counter), and paginated anyway
+        if "draw" in request.args:
+            return view(**kwargs)
+
+        _, mod, period = _get_request_params()
+        db_path = op.join(app.instance_path, app.config["LADDER_SEASONS"][mod][period])
+        identity, published = get_database_identity(db_path)
+        args = tuple(sorted(request.args.items(multi=True)))
+        key = (request.endpoint, tuple(sorted(kwargs.items())), args, db_path, identity)
+
+        entry = _response_cache.get(key)
+        record_cache("response", entry is not None)
+        if entry is None:
+            entry = _response_cache.put(key, view(**kwargs).get_data())
+        body, etag = entry
+
+        response = app.response_class(body, mimetype=app.json.mimetype)
+        response.set_etag(etag)
+        _set_cache_control(response, published)
+        return response.make_conditional(request)
+
+    return _view
+
+
+def _set_cache_control(response, published):
+    """Lets clients keep the response until the next expected update of the database, published at the given time"""
+    response.last_modified = published
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = max(
+        0, int(published + app.config.get("LADDER_UPDATE_INTERVAL", 300) - time.time())
+    )
+
+
+def _precomputed_json(name):
+    """Sends the payload written by ora-ladder (see its --json-dir option) when available instead of calling the view
+
+    The payloads are looked for in the `LADDER_JSON_DIR` directory; the best compressed version accepted by the client
+    is sent as is. They are only trusted when they were written from the published database: a run of ora-ladder
+    without --json-dir (or failing before writing them) leaves payloads of a previous version of the database.
+    """
+
+    def _decorator(view):
+        @functools.wraps(view)
+        def _view(**kwargs):
+            json_dir = app.config.get("LADDER_JSON_DIR")
+            if not json_dir or "draw" in request.args:
+                return view(**kwargs)
+
+            _, mod, period = _get_request_params()
+            db_filename = app.config["LADDER_SEASONS"][mod][period]
+            directory = get_payloads_directory(op.join(app.instance_path, json_dir), db_filename)
+            identity, published = get_database_identity(op.join(app.instance_path, db_filename))
+            if get_payloads_database_info(directory) != (identity, published):
+                record_cache("payload", False)
+                return view(**kwargs)
+
+            path = op.join(directory, name)
+            for suffix, encoding in ((".br", "br"), (".gz", "gzip"), ("", None)):
+                if (encoding is None or request.accept_encodings[encoding]) and op.exists(path + suffix):
+                    break
+            else:
+                record_cache("payload", False)
+                return view(**kwargs)
+            record_cache("payload", True)
+
+            response = send_file(path + suffix, mimetype=app.json.mimetype, conditional=True, etag=True)
+            del response.headers["Content-Disposition"]
+            if encoding is not None:
+                response.content_encoding = encoding
+            response.vary.add("Accept-Encoding")
+            _set_cache_control(response, published)
+            return response
+
+        return _view
+
+    return _decorator
+
 
 @app.context_processor
 def override_url_for():
-    return dict(url_for=dated_url_for)
+    return dict(url_for=dated_url_for, static_export=_is_static_export())
+
+
+def _is_static_export():
+    """Tells whether the pages are rendered by the `flask freeze` command (see freeze.py)"""
+    return "LADDER_STATIC_EXPORT" in app.config
 
 
 def dated_url_for(endpoint, **values):
     if endpoint == "static":
         filename = values.get("filename", None)
-        if filename:
+        if filename and _is_static_export():
+            # The exported static files are named after their content
+            values["filename"] = app.config["LADDER_STATIC_EXPORT"].get(filename, filename)
+        elif filename:
             file_path = op.join(app.root_path, endpoint, filename)
-            values["q"] = int(os.stat(file_path).st_mtime)
+            if op.exists(file_path):
+                values["q"] = int(os.stat(file_path).st_mtime)
     return url_for(endpoint, **values)
 
 
@@ -147,6 +256,22 @@ def _args_url(**args):
     return ("?" + param_str) if param_str else ""
 
 
+def _url_prefix(endpoint, **values):
+    """Returns the URL of the endpoint without its last path component, for the client to append an identifier"""
+    return url_for(endpoint, **values).rsplit("/", 1)[0] + "/"
+
+
+def _get_link_urls():
+    """Returns what the pages need to build the links to the players and replays (see `link_renderers()`)"""
+    _, cur_mod, _ = _get_request_params()
+    return dict(
+        player=_url_prefix("player", profile_id=0),
+        replay=_url_prefix("replay", replay_hash="-"),
+        args=_args_url(),
+        supports_analysis=mods[cur_mod].get("supports_analysis", False),
+    )
+
+
 def _get_menu(**args):
     cur_endpoint, cur_mod, cur_period = _get_request_params()
     ret = dict(
@@ -169,7 +294,7 @@ def _get_menu(**args):
         dict(
             caption=mod_info["label"],
             url=url_for(cur_endpoint, **args) + _args_url(mod=mod),
-            icon=url_for("static", filename=mod_info["icon"]) if "icon" in mod_info else None,
+            icon=dated_url_for("static", filename=mod_info["icon"]) if "icon" in mod_info else None,
             active=mod == cur_mod,
         )
         for mod, mod_info in mods.items()
@@ -213,52 +338,17 @@ def leaderboard():
         "leaderboard.html",
         navbar_menu=menu,
         ajax_url=ajax_url,
+        link_urls=_get_link_urls(),
         period_info=get_season_info(cur_period) if cur_period != "all" else None,
         mod_id=cur_mod,
     )
 
 
 @app.route("/leaderboard-js")
+@_precomputed_json("leaderboard.json")
+@_cached_json
 def leaderboard_js():
-    db = _db_get()
-    cur = db.execute(
-        """
-        SELECT
-            profile_id,
-            profile_name,
-            avatar_url,
-            wins,
-            losses,
-            prv_rating,
-            rating
-        FROM players
-        WHERE rating > 0 AND NOT banned
-        ORDER BY rating DESC
-        """
-    )
-
-    rows = []
-    for i, (profile_id, profile_name, avatar_url, wins, losses, prv_rating, rating) in enumerate(cur, 1):
-        rows.append(
-            dict(
-                row_id=i,
-                player=dict(
-                    name=escape(profile_name),
-                    url=url_for("player", profile_id=profile_id) + _args_url(),
-                    avatar_url=avatar_url,
-                ),
-                rating=dict(
-                    value=rating,
-                    diff=rating - prv_rating,
-                ),
-                played=wins + losses,
-                wins=wins,
-                losses=losses,
-                winrate=wins / (wins + losses) * 100,
-            )
-        )
-
-    return jsonify(rows)
+    return jsonify(get_leaderboard(_db_get()))
 
 
 @app.route("/latest")
@@ -267,158 +357,248 @@ def latest_games():
     menu = _get_menu()
     ajax_url = url_for("latest_games_js") + _args_url()
     return render_template(
-        "latest.html", navbar_menu=menu, ajax_url=ajax_url, period_info=get_season_info(cur_period), mod_id=cur_mod
+        "latest.html",
+        navbar_menu=menu,
+        ajax_url=ajax_url,
+        link_urls=_get_link_urls(),
+        period_info=get_season_info(cur_period),
+        mod_id=cur_mod,
     )
 
 
-_tag_regex = re.compile(r"\s*\[[^\]]*\]")
+_LATEST_GAMES_SEARCH = """(
+    o.map_title LIKE :search ESCAPE '\\'
+    OR (NOT p0.banned AND p0.profile_name LIKE :search ESCAPE '\\')
+    OR (NOT p1.banned AND p1.profile_name LIKE :search ESCAPE '\\')
+)"""
 
 
-def _stripped_map_name(map_name):
-    return _tag_regex.sub("", map_name).strip()
+def _get_datatables_params(max_length=100):
+    """Extracts the parameters of a DataTables server-side processing request
 
+    Pages are always ordered by date: only the direction of the ordering is read. The optional `cursor_end_time` and
+    `cursor_hash` parameters hold the key of the last row of the previous page, so that the requested page can be
+    read right after it instead of skipping `start` rows (see `keyset_ajax_data()` in dtfuncs.js).
+    """
+    args = request.args
+    length = args.get("length", 10, type=int)
+    if _is_static_export():
+        # The exported pages get all the rows at once (no LIMIT), and page through them client-side
+        length = -1
+    elif length < 0 or length > max_length:
+        length = max_length
+    cursor = (args.get("cursor_end_time"), args.get("cursor_hash"))
+    return dict(
+        draw=args.get("draw", 0, type=int),
+        start=max(args.get("start", 0, type=int), 0),
+        length=length,
+        search=args.get("search[value]", "").strip(),
+        descending=args.get("order[0][dir]", "desc") != "asc",
+        cursor=cursor if all(cursor) else None,
+    )
 
-@app.route("/latest-js")
-def latest_games_js():
-    _, cur_mod, _ = _get_request_params()
-    db = _db_get()
+
+def _like_pattern(value):
+    """Returns the LIKE pattern (with backslash as escape character) matching the strings containing value"""
+    escaped = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def _get_latest_games_page(db, params):
+    """Returns the DataTables server-side processing response for the requested page of the latest games
+
+    The pages follow the (end_time, hash) index: a page continuing from a cursor, or starting after an offset when not
+    searching (which only needs a walk through the index), costs the same whatever the number of games.
+    """
+    direction, cmp = ("DESC", "<") if params["descending"] else ("ASC", ">")
+    conditions = []
+    args = dict(length=params["length"], offset=0)
+    if params["cursor"]:
+        conditions.append(f"(o.end_time, o.hash) {cmp} (:cursor_end_time, :cursor_hash)")
+        args["cursor_end_time"], args["cursor_hash"] = params["cursor"]
+    elif params["search"]:
+        args["offset"] = params["start"]
+    elif params["start"]:
+        boundary = db.execute(
+            f"SELECT end_time, hash FROM outcomes ORDER BY end_time {direction}, hash {direction} LIMIT 1 OFFSET :start",
+            dict(start=params["start"]),
+        ).fetchone()
+        if boundary is None:
+            conditions.append("0")
+        else:
+            conditions.append(f"(o.end_time, o.hash) {cmp}= (:cursor_end_time, :cursor_hash)")
+            args["cursor_end_time"], args["cursor_hash"] = boundary
+
+    (records_total,) = db.execute("SELECT COUNT(*) FROM outcomes").fetchone()
+    records_filtered = records_total
+    if params["search"]:
+        conditions.append(_LATEST_GAMES_SEARCH)
+        args["search"] = _like_pattern(params["search"])
+        (records_filtered,) = db.execute(
+            """
+            SELECT COUNT(*) FROM outcomes o
+            LEFT JOIN players p0 ON p0.profile_id = o.profile_id0
+            LEFT JOIN players p1 ON p1.profile_id = o.profile_id1
+            WHERE """
+            + _LATEST_GAMES_SEARCH,
+            dict(search=args["search"]),
+        ).fetchone()
+
+    where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
     cur = db.execute(
-        """
-        SELECT
-            hash,
-            end_time,
-            strftime('%M:%S', julianday(end_time) - julianday(start_time)) AS duration,
-            profile_id0,
-            profile_id1,
-            rating_0 - rating_0_prv AS diff0,
-            rating_1 - rating_1_prv AS diff1,
-            p0.profile_name AS p0_name,
-            p1.profile_name AS p1_name,
-            p0.banned AS p0_banned,
-            p1.banned AS p1_banned,
-            map_title
-        FROM outcomes o
-        LEFT JOIN players p0 ON p0.profile_id = o.profile_id0
-        LEFT JOIN players p1 ON p1.profile_id = o.profile_id1
-        ORDER BY o.end_time DESC
-        """
+        f"""{LATEST_GAMES_QUERY}
+        {where}
+        ORDER BY o.end_time {direction}, o.hash {direction}
+        LIMIT :length OFFSET :offset""",
+        args,
     )
     matches = cur.fetchall()
     cur.close()
 
-    games = []
-    for match in matches:
-        game = dict(
-            replay=dict(
-                hash=match["hash"],
-                url=url_for("replay", replay_hash=match["hash"]) + _args_url(),
-                supports_analysis=mods[cur_mod].get("supports_analysis", False),
-            )
-            if not any((match["p0_banned"], match["p1_banned"]))
-            else None,
-            date=match["end_time"],
-            duration=match["duration"],
-            map=_stripped_map_name(match["map_title"]),
-            p0=dict(
-                name=escape(match["p0_name"]),
-                url=url_for("player", profile_id=match["profile_id0"]) + _args_url(),
-                diff=match["diff0"],
-            )
-            if not match["p0_banned"]
-            else None,
-            p1=dict(
-                name=escape(match["p1_name"]),
-                url=url_for("player", profile_id=match["profile_id1"]) + _args_url(),
-                diff=match["diff1"],
-            )
-            if not match["p1_banned"]
-            else None,
-        )
-        games.append(game)
-
-    return jsonify(games)
+    response = dict(
+        draw=params["draw"],
+        recordsTotal=records_total,
+        recordsFiltered=records_filtered,
+        data=[get_latest_game(match) for match in matches],
+    )
+    if matches:
+        last = matches[-1]
+        response["next"] = dict(start=params["start"] + len(matches))
+        # The key of a game of a banned player is not disclosed: the next page is then read with an offset
+        if not (last["p0_banned"] or last["p1_banned"]):
+            response["next"].update(end_time=last["end_time"], hash=last["hash"])
+    return response
 
 
-def _scaled(a, m):
-    n = len(a)
-    nr = range(n)
-    mr = [x * n / m for x in range(m)]
-    return [round(x) for x in np.interp(mr, nr, a)]
+@app.route("/latest-js")
+@_precomputed_json("latest.json")
+@_cached_json
+def latest_games_js():
+    db = _db_get()
+    if "draw" in request.args:
+        return jsonify(_get_latest_games_page(db, _get_datatables_params()))
+    return jsonify(get_latest_games(db))
 
 
 def _get_player_ratings(db, profile_id):
-    cur = db.execute(
-        """
-        SELECT
-            profile_id0,
-            profile_id1,
-            rating_0,
-            rating_1
-        FROM outcomes o
-        LEFT JOIN players p0 ON p0.profile_id = o.profile_id0
-        LEFT JOIN players p1 ON p1.profile_id = o.profile_id1
-        WHERE :pid IN (o.profile_id0, o.profile_id1)
-        ORDER BY o.end_time""",
-        dict(pid=profile_id),
+    row = db.execute("SELECT chart FROM player_ratings WHERE profile_id=:pid", dict(pid=profile_id)).fetchone()
+    if row is None or row["chart"] is None:
+        return {}
+    rating_labels = json.dumps([""] * len(json.loads(row["chart"])))
+    return dict(
+        labels=rating_labels,
+        data=row["chart"],
     )
-    ratings = []
-    for match in cur:
-        if match["profile_id0"] == profile_id:
-            rating = match["rating_0"]
-        elif match["profile_id1"] == profile_id:
-            rating = match["rating_1"]
-        else:
-            continue  # XXX shouldn't happen, assert?
-        ratings.append(rating)
+
+
+def _parse_timestamp(value):
+    """Parses an ISO 8601 date or time (in UTC unless specified) into a UNIX timestamp"""
+    time = datetime.fromisoformat(value)
+    if time.tzinfo is None:
+        time = time.replace(tzinfo=timezone.utc)
+    return time.timestamp()
+
+
+@app.route("/player-ratings-js/<int:profile_id>")
+@_cached_json
+def player_ratings_js(profile_id):
+    """Returns every game of the rating history of the player, within the optional [since, until) time range"""
+    since = request.args.get("since", type=_parse_timestamp)
+    until = request.args.get("until", type=_parse_timestamp)
+    row = (
+        _db_get()
+        .execute(
+            """
+        SELECT r.history
+        FROM player_ratings r JOIN players p ON p.profile_id = r.profile_id
+        WHERE r.profile_id=:pid AND NOT p.banned""",
+            dict(pid=profile_id),
+        )
+        .fetchone()
+    )
+    points = [
+        (end_time, rating)
+        for end_time, rating in unpack_rating_history(row["history"] if row else b"")
+        if (since is None or end_time >= since) and (until is None or end_time < until)
+    ]
+    return jsonify(
+        dict(
+            dates=[
+                datetime.fromtimestamp(end_time, timezone.utc).strftime("%Y-%m-%d %H:%M:%S") for end_time, _ in points
+            ],
+            ratings=[rating for _, rating in points],
+        )
+    )
+
+
+_season_stats_columns = """rank, rating, wins, losses, (wins+losses) AS games,
+    strftime('%M:%S', avg_game_duration, 'unixepoch') AS avg_game_duration"""
+
+
+@functools.lru_cache(maxsize=16)
+def _get_summary_seasons(summary_filename, identity):
+    """Returns the seasons copied into the summary database, cached until the file changes (see its identity)"""
+    cur = _db_get(summary_filename).execute("SELECT DISTINCT season FROM season_players")
+    seasons = {season for (season,) in cur}
     cur.close()
+    return seasons
 
-    ratings = ratings[_cfg["min_datapoints"] :]
-    if not ratings:
-        return [], []
 
-    datapoints = _cfg["datapoints"]
-    rating_labels = [str("") for x in range(datapoints)]
-    rating_labels = json.dumps(rating_labels)
+def _get_player_season_rows(mod, profile_id):
+    """Returns the statistics of the player in each season they played, indexed by season
 
-    ratings = _scaled(ratings, datapoints)  # rescale all ratings to a fixed number of data points
-    rating_data = json.dumps(ratings)
+    They are read at once from the summary database (see the --summary option of ora-ladder), and from the database
+    of each season missing from it, such as the past seasons created before the summary database.
+    """
+    rows = {}
+    summary_seasons = set()
+    summary_filename = f"db-{mod}-summary.sqlite3"
+    summary_path = op.join(app.instance_path, summary_filename)
+    if op.exists(summary_path):
+        summary_seasons = _get_summary_seasons(summary_filename, get_database_identity(summary_path)[0])
+        cur = _db_get(summary_filename).execute(
+            f"SELECT season, {_season_stats_columns} FROM season_players WHERE profile_id=:pid",
+            dict(pid=profile_id),
+        )
+        rows = {row["season"]: dict(row) for row in cur}
+        cur.close()
 
-    return dict(
-        labels=rating_labels,
-        data=rating_data,
-    )
+    for season_name, db_filename in app.config["LADDER_SEASONS"][mod].items():
+        if season_name in summary_seasons:
+            continue
+        cur = _db_get(db_filename).execute(
+            f"""
+            SELECT {_season_stats_columns}
+            FROM players p JOIN player_stats s ON s.profile_id = p.profile_id
+            WHERE p.profile_id=:pid""",
+            dict(pid=profile_id),
+        )
+        row = cur.fetchone()
+        cur.close()
+        if row is not None:
+            rows[season_name] = dict(row, season=season_name)
+    return rows
 
 
 def _get_player_season_history(mod, profile_id):
-    seasons = app.config["LADDER_SEASONS"][mod]
+    rows = _get_player_season_rows(mod, profile_id)
+
     player_season_history = []
-    for season_name, db_filename in seasons.items():
-        db_file = op.join(app.instance_path, db_filename)
-        with _db_get(db_file) as db:
-            row = db.execute(
-                f"""select rating, wins, losses, (wins+losses) as games,
-                (
-                    SELECT strftime('%M:%S', AVG(julianday(end_time) - julianday(start_time)))
-                    FROM outcomes
-                    WHERE {profile_id} IN (profile_id0, profile_id1)
-                ) AS avg_game_duration
-                from players where profile_id={profile_id}"""
-            ).fetchone()
-            if row is not None:
-                stats = dict(row)
-                rank = db.execute(
-                    f"""select count(profile_id) from players
-                    where rating>{stats['rating']} AND NOT banned"""
-                ).fetchone()[0]
-
-                stats["rank"] = rank + 1
-                stats["trophy"] = ""
-                if rank < 3:
-                    stats["trophy"] = ["🥇", "🥈", "🥉"][rank]
-                stats["ratio"] = "{:.2f}%".format(stats["wins"] / stats["games"] * 100)
-                stats["season"] = get_season_info(season_name)
-
-                player_season_history.append(stats)
+    for season_name in app.config["LADDER_SEASONS"][mod]:
+        row = rows.get(season_name)
+        if row is None:
+            continue
+        stats = dict(row)
+        del stats["season"]
+        rank = stats["rank"]
+        stats["trophy"] = ""
+        if rank is None:  # banned
+            stats["rank"] = ""
+        elif rank <= 3:
+            stats["trophy"] = ["🥇", "🥈", "🥉"][rank - 1]
+        stats["ratio"] = "{:.2f}%".format(stats["wins"] / stats["games"] * 100)
+        stats["season"] = get_season_info(season_name)
+        player_season_history.append(stats)
     return player_season_history
 
 
@@ -426,26 +606,15 @@ def _get_player_info(db, profile_id):
     cur = db.execute(
         """
         SELECT
-        *, (
-            SELECT COUNT(*)
-            FROM players
-            WHERE rating >= (SELECT rating FROM players WHERE profile_id=:pid) AND NOT banned
-        ) AS rank,
-        (
-            SELECT strftime('%M:%S', AVG(julianday(end_time) - julianday(start_time)))
-            FROM outcomes
-            WHERE :pid IN (profile_id0, profile_id1)
-        ) AS avg_game_duration,
-        (
-            SELECT MIN(end_time) FROM outcomes
-            WHERE :pid IN (profile_id0, profile_id1)
-        ) AS first_game,
-        (
-            SELECT MAX(end_time) FROM outcomes
-            WHERE :pid IN (profile_id0, profile_id1)
-        ) AS last_game
-        FROM players WHERE profile_id=:pid AND NOT banned
-        LIMIT 1""",
+            p.*,
+            s.rank,
+            strftime('%M:%S', s.avg_game_duration, 'unixepoch') AS avg_game_duration,
+            s.first_game,
+            s.last_game,
+            s.factions,
+            s.maps
+        FROM players p JOIN player_stats s ON s.profile_id = p.profile_id
+        WHERE p.profile_id=:pid AND NOT p.banned""",
         dict(pid=profile_id),
     )
     player = cur.fetchone()
@@ -453,21 +622,8 @@ def _get_player_info(db, profile_id):
     return player
 
 
-def _get_player_faction_stats(db, profile_id):
-    cur = db.execute(
-        """
-        SELECT COUNT(*)/2 AS count,
-            (CASE
-            WHEN o.profile_id0=:pid THEN selected_faction_0
-            WHEN o.profile_id1=:pid THEN selected_faction_1
-        END) AS faction
-        FROM outcomes o LEFT JOIN players p ON p.profile_id IN (o.profile_id0, o.profile_id1)
-        WHERE :pid IN (o.profile_id0, o.profile_id1)
-        GROUP BY faction""",
-        dict(pid=profile_id),
-    )
-    hist = [(r["faction"], r["count"]) for r in cur]
-    cur.close()
+def _get_player_faction_stats(player):
+    hist = sorted(json.loads(player["factions"]).items())
     faction_names, faction_data = zip(*hist)
     faction_colors = _get_colors(len(hist))
     return dict(
@@ -478,26 +634,11 @@ def _get_player_faction_stats(db, profile_id):
     )
 
 
-def _get_player_map_stats(db, profile_id):
-    cur = db.execute(
-        """
-        SELECT COUNT(*) AS count, map_title FROM outcomes WHERE profile_id0=:pid GROUP BY map_title""",
-        dict(pid=profile_id),
-    )
-    hist_wins = {r["map_title"]: r["count"] for r in cur}
-    cur.close()
-
-    cur = db.execute(
-        """
-        SELECT -COUNT(*) AS count, map_title FROM outcomes WHERE profile_id1=:pid GROUP BY map_title""",
-        dict(pid=profile_id),
-    )
-    hist_losses = {r["map_title"]: r["count"] for r in cur}
-    cur.close()
-
-    map_names = sorted(list(set(hist_wins.keys()) | set(hist_losses.keys())))
-    map_win_data = [hist_wins.get(m, 0) for m in map_names]
-    map_loss_data = [hist_losses.get(m, 0) for m in map_names]
+def _get_player_map_stats(player):
+    hist = json.loads(player["maps"])
+    map_names = sorted(hist.keys())
+    map_win_data = [hist[m][0] for m in map_names]
+    map_loss_data = [-hist[m][1] for m in map_names]
     return dict(
         names=map_names,
         win_data=map_win_data,
@@ -505,80 +646,122 @@ def _get_player_map_stats(db, profile_id):
     )
 
 
-@app.route("/player-games-js/<int:profile_id>")
-def player_games_js(profile_id):
-    _, cur_mod, _ = _get_request_params()
-    db = _db_get()
+_PLAYER_GAMES_SEARCH = """(
+    pg.map_title LIKE :search ESCAPE '\\'
+    OR (NOT p.banned AND p.profile_name LIKE :search ESCAPE '\\')
+)"""
+
+
+def _get_player_games_filters():
+    """Returns the SQL conditions (on the player_games table) and their parameters for the requested filters"""
+    args = request.args
+    conditions, params = [], {}
+    opponent_id = args.get("opponent", type=int)
+    if opponent_id is not None:
+        # The games against a banned player are not listed apart
+        conditions.append("pg.opponent_id = :opponent_id AND NOT p.banned")
+        params["opponent_id"] = opponent_id
+    map_title = args.get("map")
+    if map_title:
+        conditions.append("pg.map_title = :map_title")
+        params["map_title"] = map_title
+    outcome = args.get("outcome")
+    if outcome in ("won", "lost"):
+        conditions.append("pg.won" if outcome == "won" else "NOT pg.won")
+    return conditions, params
+
+
+def _get_player_games_page(db, profile_id, params):
+    """Returns the requested page of the games of a player, in the DataTables server-side processing format
+
+    The pages follow the (profile_id, end_time, hash) primary key of the player_games table (see
+    `_get_latest_games_page()`), and their rows only hold the identifiers from which the client builds the URLs.
+    """
+    direction, cmp = ("DESC", "<") if params["descending"] else ("ASC", ">")
+    conditions, args = _get_player_games_filters()
+    args.update(pid=profile_id, length=params["length"], offset=0)
+
+    (records_total,) = db.execute(
+        "SELECT wins + losses FROM players WHERE profile_id=:pid", dict(pid=profile_id)
+    ).fetchone()
+    records_filtered = records_total
+    if conditions or params["search"]:
+        if params["search"]:
+            conditions.append(_PLAYER_GAMES_SEARCH)
+            args["search"] = _like_pattern(params["search"])
+        (records_filtered,) = db.execute(
+            f"""
+            SELECT COUNT(*) FROM player_games pg
+            LEFT JOIN players p ON p.profile_id = pg.opponent_id
+            WHERE pg.profile_id=:pid AND {" AND ".join(conditions)}""",
+            args,
+        ).fetchone()
+
+    if params["cursor"]:
+        conditions.append(f"(pg.end_time, pg.hash) {cmp} (:cursor_end_time, :cursor_hash)")
+        args["cursor_end_time"], args["cursor_hash"] = params["cursor"]
+    else:
+        args["offset"] = params["start"]
+
+    where = "".join(f" AND {condition}" for condition in conditions)
     cur = db.execute(
-        """
+        f"""
         SELECT
-            hash,
-            end_time,
-            strftime('%M:%S', julianday(end_time) - julianday(start_time)) AS duration,
-            profile_id0,
-            profile_id1,
-            rating_0 - rating_0_prv AS diff0,
-            rating_1 - rating_1_prv AS diff1,
-            p0.profile_name AS p0_name,
-            p1.profile_name AS p1_name,
-            p0.banned AS p0_banned,
-            p1.banned AS p1_banned,
-            map_title
-        FROM outcomes o
-        LEFT JOIN players p0 ON p0.profile_id = o.profile_id0
-        LEFT JOIN players p1 ON p1.profile_id = o.profile_id1
-        WHERE :pid in (o.profile_id0, o.profile_id1)
-        ORDER BY o.end_time DESC
-        """,
-        dict(pid=profile_id),
+            pg.hash,
+            pg.end_time,
+            strftime('%M:%S', pg.duration, 'unixepoch') AS duration,
+            pg.won,
+            pg.rating - pg.rating_prv AS diff,
+            pg.opponent_id,
+            p.profile_name AS opponent_name,
+            p.banned AS opponent_banned,
+            pg.map_title
+        FROM player_games pg
+        LEFT JOIN players p ON p.profile_id = pg.opponent_id
+        WHERE pg.profile_id=:pid{where}
+        ORDER BY pg.end_time {direction}, pg.hash {direction}
+        LIMIT :length OFFSET :offset""",
+        args,
     )
-    games = []
-    for match in cur:
-        if match["profile_id0"] == profile_id:
-            diff = match["diff0"]
-            opponent = escape(match["p1_name"])
-            opponent_id = match["profile_id1"]
-            opponent_banned = match["p1_banned"]
-            banned = match["p0_banned"]
-            outcome = "Won"
-        elif match["profile_id1"] == profile_id:
-            diff = match["diff1"]
-            opponent = escape(match["p0_name"])
-            opponent_id = match["profile_id0"]
-            opponent_banned = match["p0_banned"]
-            banned = match["p1_banned"]
-            outcome = "Lost"
-        else:
-            continue  # XXX shouldn't happen, assert?
-        if banned:
-            break
-        game = dict(
-            date=match["end_time"],
-            opponent=dict(
-                name=opponent,
-                url=url_for("player", profile_id=opponent_id) + _args_url(),
-                # avatar_url=avatar_url,
-            )
-            if not opponent_banned
-            else None,
-            map=_stripped_map_name(match["map_title"]),
-            outcome=dict(
-                desc=outcome,
-                diff=diff,
-            ),
-            duration=match["duration"],
-            replay=dict(
-                hash=match["hash"],
-                url=url_for("replay", replay_hash=match["hash"]) + _args_url(),
-                supports_analysis=mods[cur_mod].get("supports_analysis", False),
-            )
-            if not opponent_banned
-            else None,
-        )
-        games.append(game)
+    matches = cur.fetchall()
     cur.close()
 
-    return jsonify(games)
+    response = dict(
+        draw=params["draw"],
+        recordsTotal=records_total,
+        recordsFiltered=records_filtered,
+        data=[
+            dict(
+                hash=match["hash"] if not match["opponent_banned"] else None,
+                date=match["end_time"],
+                # Games against banned players are shown without any link to them
+                opponent_id=match["opponent_id"] if not match["opponent_banned"] else None,
+                opponent=escape(match["opponent_name"]) if not match["opponent_banned"] else None,
+                map=stripped_map_name(match["map_title"]),
+                won=bool(match["won"]),
+                diff=match["diff"],
+                duration=match["duration"],
+            )
+            for match in matches
+        ],
+    )
+    if matches:
+        last = matches[-1]
+        response["next"] = dict(start=params["start"] + len(matches))
+        # The key of a game against a banned player is not disclosed: the next page is then read with an offset
+        if not last["opponent_banned"]:
+            response["next"].update(end_time=last["end_time"], hash=last["hash"])
+    return response
+
+
+@app.route("/player-games-js/<int:profile_id>")
+def player_games_js(profile_id):
+    db = _db_get()
+    params = _get_datatables_params()
+    player = db.execute("SELECT banned FROM players WHERE profile_id=:pid", dict(pid=profile_id)).fetchone()
+    if player is None or player["banned"]:
+        return jsonify(dict(draw=params["draw"], recordsTotal=0, recordsFiltered=0, data=[]))
+    return jsonify(_get_player_games_page(db, profile_id, params))
 
 
 @app.route("/player/<int:profile_id>")
@@ -590,8 +773,8 @@ def player(profile_id):
     menu = _get_menu(profile_id=profile_id)
 
     # load current period database first to see if player was active during this
-    player = _get_player_info(db, profile_id)
-    if not player:
+    period_player = _get_player_info(db, profile_id)
+    if not period_player:
         return render_template("noplayer.html", navbar_menu=menu, profile_id=profile_id, mod_id=cur_mod)
 
     # load all-time player data for all-time information
@@ -599,6 +782,8 @@ def player(profile_id):
     player = dict(player)
 
     player["seasons"] = _get_player_season_history(mod=cur_mod, profile_id=profile_id)
+    # The all-time statistics are not a season
+    player["seasons_played"] = sum(1 for season in player["seasons"] if season["season"]["id"] != "all")
     ajax_url = url_for("player_games_js", profile_id=profile_id) + _args_url()
 
     return render_template(
@@ -606,9 +791,10 @@ def player(profile_id):
         navbar_menu=menu,
         player=player,
         ajax_url=ajax_url,
+        link_urls=_get_link_urls(),
         rating_stats=_get_player_ratings(db, profile_id),
-        faction_stats=_get_player_faction_stats(db, profile_id),
-        map_stats=_get_player_map_stats(db, profile_id),
+        faction_stats=_get_player_faction_stats(period_player),
+        map_stats=_get_player_map_stats(period_player),
         mod_id=cur_mod,
         season_info=get_season_info(cur_period),
     )
@@ -622,112 +808,27 @@ def _get_colors(n):
     return [_hexc(colorsys.hls_to_rgb(i / n, 0.4, 0.6)) for i in range(n)]
 
 
-def _get_global_faction_stats(db):
-    hist = {}
-
-    # XXX: clumsy, patch welcome
-    for i in range(2):
-        cur = db.execute(
-            f"SELECT COUNT(*) AS count, selected_faction_{i} AS faction FROM outcomes GROUP BY selected_faction_{i}"
-        )
-        hist.update({r["faction"]: r["count"] for r in cur})
-        cur.close()
-    hist = hist.items()
-
-    if not hist:
-        return [], [], []
-
-    faction_names, faction_data = zip(*hist)
-    faction_colors = _get_colors(len(hist))
-    return dict(
-        names=list(faction_names),
-        data=list(faction_data),
-        total=sum(faction_data),
-        colors=faction_colors,
-    )
-
-
-def _get_global_map_stats(db):
-    cur = db.execute("SELECT COUNT(*) AS count, map_title FROM outcomes GROUP BY map_title")
-    hist = [(r["map_title"], r["count"]) for r in cur]
-    cur.close()
-
-    if not hist:
-        return [], [], []
-
-    map_names, map_data = zip(*hist)
-    map_colors = _get_colors(len(hist))
-    return dict(
-        names=list(map_names),
-        data=list(map_data),
-        total=sum(map_data),
-        colors=map_colors,
-    )
-
-
-def _get_activity_stats(db, start_date: Optional[date] = None, end_date: Optional[date] = None):
-    cur = db.execute(
-        """
-        SELECT
-            date(end_time) as date,
-            COUNT(*) as count
-        FROM outcomes
-        GROUP BY date
-        ORDER BY date ASC"""
-    )
-    outcomes_per_day = cur.fetchall()
-    if not outcomes_per_day:
-        return dict(dates=None, data=None, games_per_day=0)
-
-    if start_date is None:
-        start_date = date.fromisoformat(outcomes_per_day[0]["date"])
-    if end_date is None:
-        end_date = date.fromisoformat(outcomes_per_day[-1:][0]["date"])
-    nb_days = (end_date - start_date).days
-    all_days = [(start_date + timedelta(n)).strftime("%Y-%m-%d") for n in range(nb_days + 1)]
-    db_records = {o["date"]: o["count"] for o in outcomes_per_day}
-    records = {d: db_records.get(d, 0) for d in all_days}
-
-    return dict(
-        dates=list(records.keys()),
-        data=list(records.values()),
-        games_per_day=sum(records.values()) / len(records),
-    )
+@app.route("/globalstats-js")
+@_precomputed_json("globalstats.json")
+@_cached_json
+def globalstats_js():
+    return jsonify(get_global_stats(_db_get()))
 
 
 @app.route("/globalstats")
 def globalstats():
-    db = _db_get()
-
-    cur = db.execute(
-        """
-        SELECT
-            COUNT(*) AS nb_games,
-            strftime('%M:%S', AVG(julianday(end_time) - julianday(start_time))) AS avg_duration
-        FROM outcomes"""
-    )
-    data = cur.fetchone()
-    nb_games = data["nb_games"]
-    avg_duration = data["avg_duration"]
-    cur.close()
-
-    cur = db.execute("SELECT COUNT(*) AS nb_players FROM players WHERE NOT banned")
-    nb_players = cur.fetchone()["nb_players"]
-    cur.close()
+    stats = get_global_stats(_db_get())
+    for hist in (stats["faction_stats"], stats["map_stats"]):
+        hist["colors"] = _get_colors(len(hist["names"]))
 
     menu = _get_menu()
     _, cur_mod, cur_period = _get_request_params()
     return render_template(
         "globalstats.html",
         navbar_menu=menu,
-        faction_stats=_get_global_faction_stats(db),
-        map_stats=_get_global_map_stats(db),
-        activity_stats=_get_activity_stats(db),
-        nb_games=nb_games,
-        nb_players=nb_players,
-        avg_duration=avg_duration,
         period_info=get_season_info(cur_period) if cur_period != "all" else None,
         mod_id=cur_mod,
+        **stats,
     )
 
 
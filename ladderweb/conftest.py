@@ -0,0 +1,17 @@
+import pytest
+
+# The replays and accounts fixtures of the ladder tools tests
+from laddertools.conftest import fake_accounts, make_replay  # noqa: F401
+
+
+@pytest.fixture
+def ladderweb_app(tmp_path, monkeypatch):
+    """Returns the ladderweb application serving the db-ra-all.sqlite3 and db-ra-2m.sqlite3 databases of `tmp_path`"""
+    import ladderweb
+
+    monkeypatch.setattr(ladderweb.app, "instance_path", str(tmp_path))
+    monkeypatch.setitem(
+        ladderweb.app.config, "LADDER_SEASONS", {"ra": {"all": "db-ra-all.sqlite3", "2m": "db-ra-2m.sqlite3"}}
+    )
+    monkeypatch.setitem(ladderweb.app.config, "ALLOWED_MODS", ["ra"])
+    return ladderweb.app
@@ -0,0 +1,243 @@
+#
+# Copyright (C) 2022
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Static export of the ladder web application, see the `flask freeze` command
+
+Every page and JSON endpoint of every period of every mod is rendered through the test client into
+`<directory>/<mod>/<period>/<path>` (`index.html` for the leaderboard), along with their compressed versions. With the
+static files (copied into `<directory>/static/` and named after their content) and the replays (symbolic links), a web
+server can serve the ladder on its own by picking the directory from the `mod` and `period` query parameters.
+
+The exported pages load their whole tables at once and page through them client-side, since the server-side
+processing of the DataTables requests needs the application.
+
+The pages of a period are only rendered again when the databases they are built from (or the templates, the static
+files and the seasons) changed since the previous export, as recorded in `<directory>/.freeze.json`; the files whose
+content did not change are not rewritten either.
+"""
+
+import hashlib
+import json
+import os
+import os.path as op
+import sqlite3
+from contextlib import closing
+from urllib.parse import quote, urlencode
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from laddertools.payloads import get_database_identity, write_file, write_precompressed
+
+from .seasons import get_season_info
+
+_MANIFEST = ".freeze.json"
+
+# The map packs are downloaded by the players: they keep their names
+_UNHASHED_EXTENSIONS = (".zip",)
+_COMPRESSED_EXTENSIONS = (".css", ".js", ".svg")
+
+
+def _write(path, data, compressed):
+    """Writes the data into the file (along with its compressed versions) unless it already holds it"""
+    try:
+        with open(path, "rb") as f:
+            if f.read() == data:
+                return False
+    except FileNotFoundError:
+        pass
+    os.makedirs(op.dirname(path), exist_ok=True)
+    if compressed:
+        write_precompressed(path, data)
+    else:
+        write_file(path, data)
+    return True
+
+
+def _remove(path):
+    for suffix in ("", ".gz", ".br"):
+        if op.lexists(path + suffix):
+            os.remove(path + suffix)
+
+
+def _link(path, target):
+    """Makes the file a symbolic link to the target, unless it already is"""
+    if op.islink(path) and os.readlink(path) == target:
+        return False
+    if op.lexists(path):
+        os.remove(path)
+    os.makedirs(op.dirname(path), exist_ok=True)
+    os.symlink(target, path)
+    return True
+
+
+def _get_digest(directory):
+    digest = hashlib.sha256()
+    for dirpath, _, filenames in sorted(os.walk(directory)):
+        for filename in sorted(filenames):
+            digest.update(filename.encode())
+            with open(op.join(dirpath, filename), "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _export_static_files(app, output_dir):
+    """Copies the static files into the static directory of the export, and returns their exported names"""
+    names = {}
+    for dirpath, _, filenames in os.walk(app.static_folder):
+        for filename in filenames:
+            path = op.join(dirpath, filename)
+            name = op.relpath(path, app.static_folder).replace(os.sep, "/")
+            with open(path, "rb") as f:
+                data = f.read()
+            root, ext = op.splitext(name)
+            names[name] = (
+                name if ext in _UNHASHED_EXTENSIONS else f"{root}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+            )
+            _write(op.join(output_dir, "static", names[name]), data, compressed=ext in _COMPRESSED_EXTENSIONS)
+    return names
+
+
+def _read_database(path, query):
+    with closing(sqlite3.connect(f"file:{quote(path)}?mode=ro", uri=True)) as conn:
+        return conn.execute(query).fetchall()
+
+
+def _get_page_sets(app, mod, period):
+    """Returns the sets of URLs of the period of the mod, with the databases each set is built from
+
+    The player pages also show the all-time statistics of the player and their season history, which change with
+    other databases than the one of the period (the summary database, and the season databases missing from it).
+    """
+    seasons = app.config["LADDER_SEASONS"][mod]
+    database = op.join(app.instance_path, seasons[period])
+    profile_ids = [pid for (pid,) in _read_database(database, "SELECT profile_id FROM players WHERE NOT banned")]
+
+    query = "?" + urlencode(dict(mod=mod, period=period))
+    pages = ["/", "/latest", "/globalstats", "/info", "/leaderboard-js", "/latest-js", "/globalstats-js"]
+    for profile_id in profile_ids:
+        pages += [f"/player-games-js/{profile_id}", f"/player-ratings-js/{profile_id}"]
+    players = [f"/player/{profile_id}" for profile_id in profile_ids]
+    summary = op.join(app.instance_path, f"db-{mod}-summary.sqlite3")
+    player_databases = [database, op.join(app.instance_path, seasons["all"]), summary]
+    summary_seasons = set()
+    if op.exists(summary):
+        summary_seasons = {
+            season for (season,) in _read_database(summary, "SELECT DISTINCT season FROM season_players")
+        }
+    # The season history of the seasons missing from the summary is read from their own database
+    player_databases += [
+        op.join(app.instance_path, db_filename)
+        for season_name, db_filename in seasons.items()
+        if season_name not in summary_seasons
+    ]
+    return dict(
+        pages=([database], [url + query for url in pages]),
+        players=(player_databases, [url + query for url in players]),
+    )
+
+
+def _get_signature(databases, context):
+    identities = [get_database_identity(path)[0] if op.exists(path) else None for path in databases]
+    return hashlib.sha256(json.dumps([identities, context]).encode()).hexdigest()
+
+
+def _export_urls(client, directory, urls):
+    files = []
+    written = 0
+    for url in urls:
+        response = client.get(url)
+        if response.status_code != 200:
+            raise click.ClickException(f"{url}: {response.status}")
+        path = url.split("?", 1)[0].lstrip("/") or "index.html"
+        files.append(path)
+        written += _write(op.join(directory, path), response.get_data(), compressed=True)
+    return files, written
+
+
+def _export_replays(database, directory):
+    """Links the replays of the database, which are sent as is by the application"""
+    files = []
+    written = 0
+    for replay_hash, filename in _read_database(database, "SELECT hash, filename FROM outcomes"):
+        path = f"replay/{replay_hash}"
+        files.append(path)
+        written += _link(op.join(directory, path), op.abspath(filename))
+    return files, written
+
+
+def freeze(app, output_dir, force=False):
+    """Exports the pages of the application into the directory, see the module documentation"""
+    manifest_path = op.join(output_dir, _MANIFEST)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        manifest = {}
+
+    static_names = _export_static_files(app, output_dir)
+    context = [
+        app.config["LADDER_SEASONS"],
+        static_names,
+        _get_digest(op.join(app.root_path, app.template_folder)),
+        str(get_season_info("2m")["start"]),
+    ]
+
+    new_manifest = {}
+    client = app.test_client()
+    app.config["LADDER_STATIC_EXPORT"] = static_names
+    try:
+        for mod, seasons in app.config["LADDER_SEASONS"].items():
+            for period, db_filename in seasons.items():
+                directory = op.join(output_dir, mod, period)
+                for set_name, (databases, urls) in _get_page_sets(app, mod, period).items():
+                    key = f"{mod}/{period}/{set_name}"
+                    signature = _get_signature(databases, context)
+                    previous = manifest.get(key, dict(signature=None, files=[]))
+                    if not force and previous["signature"] == signature:
+                        click.echo(f"{key}: unchanged")
+                        new_manifest[key] = previous
+                        continue
+
+                    files, written = _export_urls(client, directory, urls)
+                    if set_name == "pages":
+                        replays, linked = _export_replays(op.join(app.instance_path, db_filename), directory)
+                        files += replays
+                        written += linked
+                    for path in set(previous["files"]) - set(files):
+                        _remove(op.join(directory, path))
+                    click.echo(f"{key}: {written} of {len(files)} files updated")
+                    new_manifest[key] = dict(signature=signature, files=sorted(files))
+
+        # Periods which are not available anymore
+        for key in manifest.keys() - new_manifest.keys():
+            mod, period, _ = key.split("/")
+            for path in manifest[key]["files"]:
+                _remove(op.join(output_dir, mod, period, path))
+    finally:
+        del app.config["LADDER_STATIC_EXPORT"]
+    write_file(manifest_path, json.dumps(new_manifest).encode())
+
+
+@click.command("freeze")
+@click.argument("output_dir", type=click.Path(file_okay=False))
+@click.option("--force", is_flag=True, help="Render all the pages, even those whose databases did not change.")
+@with_appcontext
+def freeze_command(output_dir, force):
+    """Export every page and JSON endpoint into OUTPUT_DIR, to be served as static files."""
+    freeze(current_app._get_current_object(), output_dir, force)
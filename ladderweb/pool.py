@@ -0,0 +1,64 @@
+#
+# Copyright (C) 2022
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import sqlite3
+import threading
+from urllib.parse import quote
+
+
+class ConnectionPool:
+    """Long-lived read-only connections to the databases, one per database file and thread
+
+    Keeping the connections open saves the opening of the file, the parsing of the schema and the warming of the page
+    cache on every request. A connection is transparently reopened when its database file gets replaced (see
+    `ladder._write_database()`); the updates made in place are seen as usual, except for the immutable databases
+    (frozen seasons) which are also reopened when their modification time changes.
+
+    An immutable connection does not read the WAL file: a database whose WAL holds changes not yet checkpointed (e.g.
+    written in place by `ora-upgradedb` while the web application was reading it) is opened as usual instead.
+    """
+
+    def __init__(self, mmap_size, cache_size, factory=sqlite3.Connection):
+        self._mmap_size = mmap_size
+        self._cache_size = cache_size
+        self._factory = factory
+        self._local = threading.local()
+
+    def get(self, path, immutable=False):
+        connections = self._local.__dict__.setdefault("connections", {})
+        st = os.stat(path)
+        if immutable:
+            try:
+                immutable = os.stat(path + "-wal").st_size == 0
+            except FileNotFoundError:
+                pass
+        identity = (st.st_dev, st.st_ino, st.st_mtime_ns if immutable else None)
+        entry = connections.get(path)
+        if entry is not None:
+            conn_identity, conn = entry
+            if conn_identity == identity:
+                return conn
+            conn.close()
+
+        uri = f"file:{quote(path)}?mode=ro" + ("&immutable=1" if immutable else "")
+        conn = sqlite3.connect(uri, uri=True, detect_types=sqlite3.PARSE_DECLTYPES, factory=self._factory)
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA mmap_size={int(self._mmap_size)}")
+        conn.execute(f"PRAGMA cache_size={int(self._cache_size)}")
+        connections[path] = (identity, conn)
+        return conn
@@ -20,19 +20,6 @@ function get_player_html(name, url, avatar_url) {
 	return avatar + '<a href="' + url + '">' + name + '</a>'
 }
 
-function player_with_diff_render(data, type, row, meta) {
-	if (data == undefined)
-		return '<span class=ghost>ghost</span>'
-	var player = '<a href="' + data.url + '">' + data.name + '</a>'
-	return player + ' ' + get_diff_html(data.diff)
-}
-
-function player_render(data, type, row, meta) {
-	if (data == undefined)
-		return '<span class=ghost>ghost</span>'
-	return get_player_html(data.name, data.url, data.avatar_url)
-}
-
 function rating_render(data, type, row, meta) {
 	return data.value + ' ' + get_diff_html(data.diff)
 }
@@ -41,6 +28,45 @@ function winrate_render(data, type, row, meta) {
 	return data.toFixed(1) + '%'
 }
 
-function outcome_render(data, type, row, meta) {
-	return data.desc + ' ' + get_diff_html(data.diff)
+function keyset_ajax_data(data, settings) {
+	// Continue right after the last row of the current page when moving to the next one
+	var next = settings.json ? settings.json.next : undefined
+	if (next != undefined && next.hash != undefined && data.start == next.start) {
+		data.cursor_end_time = next.end_time
+		data.cursor_hash = next.hash
+	}
+}
+
+function link_renderers(urls) {
+	// The payloads only hold the identifiers of the players and replays, from which the links are built here
+	function player_url(profile_id) {
+		return urls.player + profile_id + urls.args
+	}
+	var ghost = '<span class=ghost>ghost</span>'
+	return {
+		player: function (data, type, row, meta) {
+			if (data == undefined)
+				return ghost
+			return get_player_html(data.name, player_url(data.id), data.avatar_url)
+		},
+		player_with_diff: function (data, type, row, meta) {
+			if (data == undefined)
+				return ghost
+			return '<a href="' + player_url(data.id) + '">' + data.name + '</a> ' + get_diff_html(data.diff)
+		},
+		opponent: function (data, type, row, meta) {
+			if (data == undefined)
+				return ghost
+			return get_player_html(data, player_url(row.opponent_id))
+		},
+		outcome: function (data, type, row, meta) {
+			return (data ? 'Won' : 'Lost') + ' ' + get_diff_html(row.diff)
+		},
+		replay: function (data, type, row, meta) {
+			if (data == undefined)
+				return ''
+			var replay = { hash: data, url: urls.replay + data + urls.args, supports_analysis: urls.supports_analysis }
+			return replay_render(replay, type, row, meta)
+		},
+	}
 }
@@ -0,0 +1,416 @@
+import gzip
+import json
+import os
+import re
+import sqlite3
+import sys
+
+import pytest
+from ladderweb.pool import ConnectionPool
+
+from laddertools import ladder
+from laddertools.conftest import get_full_scans, get_migration_indexes, get_used_indexes, trace_queries
+
+
+def _run_ladder(tmp_path, monkeypatch):
+    for db_name in ("db-ra-all.sqlite3", "db-ra-2m.sqlite3"):
+        monkeypatch.setattr(sys, "argv", ["ora-ladder", "-d", str(tmp_path / db_name), str(tmp_path / "replays")])
+        ladder.run()
+
+
+def test_json_responses_are_cached_until_the_database_is_published(
+    tmp_path, make_replay, fake_accounts, ladderweb_app, monkeypatch
+):
+    make_replay(end_time="2022-03-01 10-20-00")
+    _run_ladder(tmp_path, monkeypatch)
+    client = ladderweb_app.test_client()
+
+    response = client.get("/latest-js?period=all")
+    etag = response.headers["ETag"]
+    assert response.status_code == 200 and len(response.json) == 1
+    assert response.cache_control.public and response.cache_control.max_age > 0
+    assert client.get("/latest-js?period=all", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/leaderboard-js?period=all", headers={"If-None-Match": etag}).status_code == 200
+
+    make_replay(end_time="2022-03-02 10-20-00")
+    _run_ladder(tmp_path, monkeypatch)
+    response = client.get("/latest-js?period=all", headers={"If-None-Match": etag})
+    assert response.status_code == 200 and len(response.json) == 2
+    assert response.headers["ETag"] != etag
+
+
+def test_latest_games_pages(tmp_path, make_replay, fake_accounts, ladderweb_app, monkeypatch):
+    players = [("alice", "fp-alice"), ("bob", "fp-bob"), ("carol", "fp-carol")]
+    for day in range(1, 11):
+        for hour in (10, 12):  # some games end at the same time
+            make_replay(
+                end_time=f"2022-03-{day:02d} {hour}-20-00",
+                winner=players[day % 3],
+                loser=players[(day + 1) % 3],
+                map_title="Map 100%" if day % 4 else "Map 1000",
+            )
+            make_replay(end_time=f"2022-03-{day:02d} 10-20-00", winner=players[2], loser=players[day % 2])
+    _run_ladder(tmp_path, monkeypatch)
+    client = ladderweb_app.test_client()
+    games = client.get("/latest-js?period=all").json
+    assert len(games) == 40
+
+    def _pages(search="", direction="desc", length=7, keyset=True):
+        rows, start, next_page = [], 0, None
+        while True:
+            args = {"period": "all", "draw": 1, "start": start, "length": length}
+            args.update({"search[value]": search, "order[0][column]": 0, "order[0][dir]": direction})
+            if keyset and next_page is not None:
+                args.update(cursor_end_time=next_page["end_time"], cursor_hash=next_page["hash"])
+            page = client.get("/latest-js", query_string=args).json
+            assert len(page["data"]) <= length
+            if not page["data"]:
+                return rows, page["recordsTotal"], page["recordsFiltered"]
+            rows += page["data"]
+            start, next_page = page["next"]["start"], page["next"]
+
+    for keyset in (True, False):
+        assert _pages(keyset=keyset) == (games, 40, 40)
+        assert _pages(direction="asc", keyset=keyset)[0] == games[::-1]
+        filtered = [g for g in games if g["map"] == "Map 100%"]
+        assert _pages(search="100%", keyset=keyset) == (filtered, 40, len(filtered))
+        assert _pages(search="CAROL", keyset=keyset)[0] == [
+            g for g in games if "carol" in (g["p0"]["name"], g["p1"]["name"])
+        ]
+
+
+def test_player_games_pages(tmp_path, make_replay, fake_accounts, ladderweb_app, monkeypatch):
+    players = [("alice", "fp-alice"), ("bob", "fp-bob"), ("carol", "fp-carol")]
+    for day in range(1, 21):
+        make_replay(
+            end_time=f"2022-03-{day:02d} 10-20-00",
+            winner=players[day % 3],
+            loser=players[(day + 1) % 3],
+            map_title=f"Map {day % 3}",
+        )
+    _run_ladder(tmp_path, monkeypatch)
+    client = ladderweb_app.test_client()
+    conn = sqlite3.connect(tmp_path / "db-ra-all.sqlite3")
+    alice, bob, carol = (
+        conn.execute("SELECT profile_id FROM players WHERE profile_name=?", (name,)).fetchone()[0]
+        for name, _ in players
+    )
+    conn.close()
+
+    def _pages(profile_id, keyset=True, **filters):
+        rows, start, next_page = [], 0, None
+        while True:
+            args = {"period": "all", "draw": 1, "start": start, "length": 3, **filters}
+            if keyset and next_page is not None:
+                args.update(cursor_end_time=next_page["end_time"], cursor_hash=next_page["hash"])
+            page = client.get(f"/player-games-js/{profile_id}", query_string=args).json
+            if not page["data"]:
+                return rows, page["recordsTotal"], page["recordsFiltered"]
+            rows += page["data"]
+            start, next_page = page["next"]["start"], page["next"]
+
+    for keyset in (True, False):
+        rows, total, filtered = _pages(alice, keyset)
+        assert total == filtered == len(rows) == 13
+        assert [r["date"] for r in rows] == sorted((r["date"] for r in rows), reverse=True)
+        assert {r["opponent"] for r in rows} == {"bob", "carol"}
+
+        rows, _, filtered = _pages(alice, keyset, opponent=bob, outcome="won")
+        assert filtered == len(rows) and rows and all(r["opponent_id"] == bob and r["won"] for r in rows)
+        rows, _, filtered = _pages(alice, keyset, map="Map 2", **{"search[value]": "CAR"})
+        assert filtered == len(rows) and rows and all(r["opponent"] == "carol" and r["map"] == "Map 2" for r in rows)
+        assert _pages(carol, keyset, **{"order[0][dir]": "asc"})[0] == _pages(carol, keyset)[0][::-1]
+
+
+def test_player_games_hide_banned_opponents(tmp_path, make_replay, fake_accounts, ladderweb_app, monkeypatch):
+    players = [("alice", "fp-alice"), ("bob", "fp-bob"), ("carol", "fp-carol")]
+    for day in range(1, 7):
+        make_replay(end_time=f"2022-03-{day:02d} 10-20-00", winner=players[0], loser=players[1 + day % 2])
+    _run_ladder(tmp_path, monkeypatch)
+    conn = sqlite3.connect(tmp_path / "db-ra-all.sqlite3")
+    alice, bob = (
+        conn.execute("SELECT profile_id FROM players WHERE profile_name=?", (name,)).fetchone()[0]
+        for name in ("alice", "bob")
+    )
+    conn.close()
+    (tmp_path / "bans.txt").write_text(f"{bob}\n")
+    argv = ["ora-ladder", "-d", str(tmp_path / "db-ra-all.sqlite3"), "--bans-file", str(tmp_path / "bans.txt")]
+    monkeypatch.setattr(sys, "argv", argv + [str(tmp_path / "replays")])
+    ladder.run()
+    client = ladderweb_app.test_client()
+
+    url = f"/player-games-js/{alice}"
+    rows, start, next_page = [], 0, {}
+    while True:
+        cursor = dict(cursor_end_time=next_page.get("end_time"), cursor_hash=next_page.get("hash"))
+        page = client.get(url, query_string=dict(period="all", draw=1, length=1, start=start, **cursor)).json
+        if not page["data"]:
+            break
+        rows += page["data"]
+        start, next_page = page["next"]["start"], page["next"]
+        assert next_page.get("hash") in [r["hash"] for r in page["data"] if r["opponent"] == "carol"] + [None]
+    assert len(rows) == 6
+    assert all(r["hash"] is None and r["opponent_id"] is None for r in rows if r["opponent"] is None)
+    assert [r["opponent"] for r in rows].count(None) == 3
+    assert client.get(url, query_string=dict(period="all", draw=1, opponent=bob)).json["data"] == []
+    for start in range(6):
+        page = client.get("/latest-js", query_string=dict(period="all", draw=1, length=1, start=start)).json
+        assert page["next"].get("hash") == page["data"][0]["hash"]
+
+
+def test_player_ratings(tmp_path, make_replay, fake_accounts, ladderweb_app, monkeypatch):
+    players = [("alice", "fp-alice"), ("bob", "fp-bob")]
+    for day in range(1, 16):
+        make_replay(end_time=f"2022-03-{day:02d} 10-20-00", winner=players[day % 2], loser=players[(day + 1) % 2])
+    _run_ladder(tmp_path, monkeypatch)
+    client = ladderweb_app.test_client()
+    conn = sqlite3.connect(tmp_path / "db-ra-all.sqlite3")
+    alice, rating = conn.execute("SELECT profile_id, rating FROM players WHERE profile_name='alice'").fetchone()
+    (chart,) = conn.execute("SELECT chart FROM player_ratings WHERE profile_id=?", (alice,)).fetchone()
+    conn.close()
+
+    history = client.get(f"/player-ratings-js/{alice}?period=all").json
+    assert history["dates"] == [f"2022-03-{day:02d} 10:20:00" for day in range(1, 16)]
+    assert history["ratings"][-1] == rating
+    assert len(json.loads(chart)) == 50 and json.loads(chart)[0] == history["ratings"][10]
+
+    history = client.get(f"/player-ratings-js/{alice}?period=all&since=2022-03-05&until=2022-03-07T10:20").json
+    assert history["dates"] == ["2022-03-05 10:20:00", "2022-03-06 10:20:00"]
+    assert client.get("/player-ratings-js/1?period=all").json == dict(dates=[], ratings=[])
+
+
+def _create_database(path, value):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE t (x INTEGER)")
+    conn.execute("INSERT INTO t VALUES (?)", (value,))
+    conn.commit()
+    conn.close()
+
+
+def test_pooled_connections_are_reopened_when_the_database_is_replaced(tmp_path):
+    pool = ConnectionPool(mmap_size=1 << 20, cache_size=-1024)
+    path = str(tmp_path / "db.sqlite3")
+    _create_database(path, 1)
+    conn = pool.get(path)
+    assert pool.get(path) is conn
+    assert conn.execute("SELECT x FROM t").fetchone()["x"] == 1
+
+    _create_database(path + ".tmp", 2)
+    os.replace(path + ".tmp", path)
+    assert pool.get(path) is not conn
+    assert pool.get(path).execute("SELECT x FROM t").fetchone()["x"] == 2
+    with pytest.raises(sqlite3.OperationalError):
+        pool.get(path).execute("DELETE FROM t")
+
+
+def test_immutable_connections_read_the_pending_wal(tmp_path):
+    pool = ConnectionPool(mmap_size=1 << 20, cache_size=-1024)
+    path = str(tmp_path / "db.sqlite3")
+    _create_database(path, 1)
+    assert pool.get(path, immutable=True).execute("SELECT x FROM t").fetchone()["x"] == 1
+
+    # An update in place of a frozen season is only in the WAL until it gets checkpointed
+    writer = sqlite3.connect(path)
+    writer.execute("PRAGMA journal_mode=WAL")
+    writer.execute("UPDATE t SET x=2")
+    writer.commit()
+    assert pool.get(path, immutable=True).execute("SELECT x FROM t").fetchone()["x"] == 2
+
+    writer.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    writer.close()
+    assert pool.get(path, immutable=True).execute("SELECT x FROM t").fetchone()["x"] == 2
+
+
+def test_precomputed_payloads(tmp_path, make_replay, fake_accounts, ladderweb_app, monkeypatch):
+    make_replay(end_time="2022-03-01 10-20-00")
+    make_replay(end_time="2022-03-02 10-20-00", winner=("bob", "fp-bob"), loser=("alice", "fp-alice"))
+    argv = ["ora-ladder", "-d", str(tmp_path / "db-ra-all.sqlite3"), "--json-dir", str(tmp_path / "json")]
+    monkeypatch.setattr(sys, "argv", argv + [str(tmp_path / "replays")])
+    ladder.run()
+    client = ladderweb_app.test_client()
+
+    for endpoint in ("/leaderboard-js", "/latest-js", "/globalstats-js"):
+        url = f"{endpoint}?period=all"
+        monkeypatch.delitem(ladderweb_app.config, "LADDER_JSON_DIR", raising=False)
+        computed = client.get(url)
+        assert "Content-Encoding" not in computed.headers
+
+        monkeypatch.setitem(ladderweb_app.config, "LADDER_JSON_DIR", "json")
+        response = client.get(url, headers={"Accept-Encoding": "gzip, deflate"})
+        assert response.headers["Content-Encoding"] == "gzip" and "Accept-Encoding" in response.vary
+        assert json.loads(gzip.decompress(response.data)) == computed.json
+        response = client.get(url)
+        assert "Content-Encoding" not in response.headers and response.json == computed.json
+        assert not response.cache_control.no_cache and response.cache_control.max_age > 0
+        assert client.get(url, headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+
+    # Payloads left by a previous version of the database are not sent
+    make_replay(end_time="2022-03-03 10-20-00")
+    monkeypatch.setattr(sys, "argv", argv[:3] + [str(tmp_path / "replays")])
+    ladder.run()
+    response = client.get("/latest-js?period=all", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers and len(response.json) == 3
+    make_replay(end_time="2022-03-04 10-20-00")
+    monkeypatch.setattr(sys, "argv", argv + ["-i", str(tmp_path / "replays")])
+    ladder.run()
+    response = client.get("/latest-js?period=all", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip" and len(json.loads(gzip.decompress(response.data))) == 4
+
+
+def test_freeze(tmp_path, make_replay, fake_accounts, ladderweb_app, monkeypatch):
+    replay = make_replay(end_time="2022-03-01 10-20-00")
+    _run_ladder(tmp_path, monkeypatch)
+    output = tmp_path / "export"
+    runner = ladderweb_app.test_cli_runner()
+    client = ladderweb_app.test_client()
+
+    result = runner.invoke(args=["freeze", str(output)])
+    assert result.exit_code == 0, result.output
+    assert "LADDER_STATIC_EXPORT" not in ladderweb_app.config
+    directory = output / "ra" / "all"
+    stylesheet = re.search(r"/static/(style\.[0-9a-f]{12}\.css)", (directory / "index.html").read_text()).group(1)
+    assert (output / "static" / stylesheet).exists()
+    leaderboard = json.loads((directory / "leaderboard-js").read_bytes())
+    assert leaderboard == client.get("/leaderboard-js?period=all").json
+    assert json.loads(gzip.decompress((directory / "leaderboard-js.gz").read_bytes())) == leaderboard
+    (game,) = json.loads((directory / "player-games-js" / str(leaderboard[0]["player"]["id"])).read_bytes())["data"]
+    assert os.readlink(directory / "replay" / game["hash"]) == str(replay)
+
+    mtime = os.stat(directory / "latest-js").st_mtime_ns
+    result = runner.invoke(args=["freeze", str(output)])
+    assert result.output.count("unchanged") == 4
+    assert os.stat(directory / "latest-js").st_mtime_ns == mtime
+
+    make_replay(end_time="2022-03-02 10-20-00")
+    _run_ladder(tmp_path, monkeypatch)
+    result = runner.invoke(args=["freeze", str(output)])
+    assert result.exit_code == 0 and "unchanged" not in result.output
+    assert len(json.loads((directory / "latest-js").read_bytes())) == 2
+
+
+def test_player_season_history(tmp_path, make_replay, fake_accounts, ladderweb_app, monkeypatch):
+    make_replay(end_time="2022-03-01 10-20-00")
+    _run_ladder(tmp_path, monkeypatch)
+    client = ladderweb_app.test_client()
+    conn = sqlite3.connect(tmp_path / "db-ra-all.sqlite3")
+    (alice,) = conn.execute("SELECT profile_id FROM players WHERE profile_name='alice'").fetchone()
+    conn.close()
+
+    # Without a summary database, the history is read from each season database
+    page = client.get(f"/player/{alice}?period=all").text
+    assert re.search(r"during\s+1 seasons", page) and re.search(r"<td>1</td>\s*</tr>", page)
+    rankings = page.split('id="player-rankings"')[1].split("</table>")[0]
+    assert rankings.count("period=all") == rankings.count("period=2m") == 1
+
+    # The seasons missing from the summary database are still read from their own database
+    for season in ("all", "2m"):
+        db_name = str(tmp_path / f"db-ra-{season}.sqlite3")
+        argv = ["ora-ladder", "-d", db_name, "--summary", str(tmp_path / "db-ra-summary.sqlite3"), "--season", season]
+        monkeypatch.setattr(sys, "argv", argv + [str(tmp_path / "replays")])
+        ladder.run()
+        assert client.get(f"/player/{alice}?period=all").text == page
+
+
+def _make_games(make_replay):
+    players = [("alice", "fp-alice"), ("bob", "fp-bob"), ("carol", "fp-carol")]
+    for day in range(1, 13):
+        make_replay(
+            start_time=f"2022-03-{day:02d} 10-00-00",
+            end_time=f"2022-03-{day:02d} 10-20-00",
+            winner=players[day % 3],
+            loser=players[(day + 1) % 3],
+            factions=("Soviet", "Allies") if day % 2 else ("Allies", "Soviet"),
+            map_title=f"Map {day % 4}",
+        )
+
+
+def test_ladderweb_queries_use_indexes(tmp_path, make_replay, fake_accounts, ladderweb_app, monkeypatch):
+    _make_games(make_replay)
+    for db_name in ("db-ra-all.sqlite3", "db-ra-2m.sqlite3"):
+        summary = str(tmp_path / "db-ra-summary.sqlite3")
+        argv = ["ora-ladder", "-d", str(tmp_path / db_name), "--summary", summary, str(tmp_path / "replays")]
+        monkeypatch.setattr(sys, "argv", argv)
+        ladder.run()
+    conn = sqlite3.connect(tmp_path / "db-ra-all.sqlite3")
+    (replay_hash,) = conn.execute("SELECT hash FROM outcomes LIMIT 1").fetchone()
+    profile_ids = [pid for (pid,) in conn.execute("SELECT profile_id FROM players")]
+    conn.close()
+
+    queries = trace_queries(monkeypatch)
+
+    client = ladderweb_app.test_client()
+    urls = ["/", "/leaderboard-js", "/latest", "/latest-js", "/globalstats", "/info", f"/replay/{replay_hash}"]
+    urls += [
+        "/latest-js?draw=1&start=5&length=3",
+        "/latest-js?draw=1&order[0][dir]=asc&cursor_end_time=2022&cursor_hash=0",
+    ]
+    for profile_id in profile_ids:
+        urls += [f"/player/{profile_id}", f"/player-games-js/{profile_id}", f"/player-ratings-js/{profile_id}"]
+        urls += [f"/player-games-js/{profile_id}?draw=1&start=2&length=2&outcome=won&search[value]=a"]
+    for url in urls:
+        for period in ("all", "2m"):
+            assert client.get(f"{url}{'&' if '?' in url else '?'}period={period}").status_code == 200, url
+
+    # The global stats tables are small aggregates (a row per faction, map or day) meant to be read whole
+    assert queries
+    assert {table for table, _ in get_full_scans(queries)} <= {
+        "global_stats",
+        "global_faction_stats",
+        "global_map_stats",
+        "daily_activity",
+    }
+    # Every index is used by some query
+    assert get_migration_indexes(tmp_path / "db-ra-all.sqlite3") <= get_used_indexes(queries)
+
+
+def _make_legacy_database(database):
+    """Turns the database into one written by the versions of ora-ladder preceding the per-player tables"""
+    conn = sqlite3.connect(database)
+    conn.execute("PRAGMA journal_mode=DELETE")
+    legacy_tables = ("accounts", "players", "outcomes")
+    tables = [name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+    for table in tables:
+        if table not in legacy_tables:
+            conn.execute(f"DROP TABLE {table}")
+    for (index,) in conn.execute("SELECT name FROM sqlite_master WHERE type='index' AND sql IS NOT NULL").fetchall():
+        conn.execute(f"DROP INDEX {index}")
+    conn.execute("PRAGMA user_version=0")
+    conn.commit()
+    conn.close()
+
+
+def test_upgrade_legacy_databases(tmp_path, make_replay, fake_accounts, ladderweb_app, monkeypatch):
+    players = [("alice", "fp-alice"), ("bob", "fp-bob"), ("carol", "fp-carol")]
+    for day in range(1, 7):
+        make_replay(end_time=f"2022-03-{day:02d} 10-20-00", winner=players[day % 3], loser=players[(day + 1) % 3])
+    _run_ladder(tmp_path, monkeypatch)
+    conn = sqlite3.connect(tmp_path / "db-ra-all.sqlite3")
+    (alice,) = conn.execute("SELECT profile_id FROM players WHERE profile_name='alice'").fetchone()
+    conn.close()
+    databases = [str(tmp_path / db_name) for db_name in ("db-ra-all.sqlite3", "db-ra-2m.sqlite3")]
+    for database in databases:
+        _make_legacy_database(database)
+    client = ladderweb_app.test_client()
+    urls = [
+        f"/player/{alice}?period=2m",
+        f"/player-ratings-js/{alice}?period=2m",
+        f"/player-games-js/{alice}?period=2m&draw=1&start=0&length=10",
+        "/globalstats?period=2m",
+        "/globalstats-js?period=2m",
+    ]
+    assert [client.get(url).status_code for url in urls] == [500] * len(urls)
+
+    # The summary databases match the same file names, the tool leaves them untouched
+    summary = tmp_path / "db-ra-summary.sqlite3"
+    conn = sqlite3.connect(summary)
+    with open(os.path.join(os.path.dirname(ladder.__file__), "summary.sql")) as f:
+        conn.executescript(f.read())
+    conn.close()
+    summary_tables = sqlite3.connect(summary).execute("SELECT name FROM sqlite_master").fetchall()
+
+    monkeypatch.setattr(sys, "argv", ["ora-upgradedb", *databases, str(summary)])
+    ladder.upgrade_databases()
+    assert sqlite3.connect(summary).execute("SELECT name FROM sqlite_master").fetchall() == summary_tables
+    upgraded = [client.get(url).data for url in urls]
+    _run_ladder(tmp_path, monkeypatch)
+    assert upgraded == [client.get(url).data for url in urls]
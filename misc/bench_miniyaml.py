@@ -0,0 +1,78 @@
+#
+# Copyright (C) 2022
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Benchmark of the MiniYAML decoder against the reference one, over the metadata of real replays
+
+Usage: python misc/bench_miniyaml.py [-n REPEAT] REPLAY_FILE_OR_DIR...
+"""
+
+import argparse
+import time
+
+from laddertools import miniyaml, replay
+
+
+def _read_footers(paths):
+    footers = []
+    for filename in replay.iter_files(paths):
+        if not filename.endswith(".orarep"):
+            continue
+        try:
+            footers.append(bytes(replay._read_game_yaml(filename)))
+        except Exception as e:
+            print(f"{filename}: {e}")
+    return footers
+
+
+def _time(load, footers, repeat):
+    """Returns the best time of the decoding of all the footers"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for footer in footers:
+            load(footer)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--repeat", type=int, default=5)
+    parser.add_argument("replays", nargs="+")
+    args = parser.parse_args()
+
+    footers = _read_footers(args.replays)
+    if not footers:
+        parser.error("no replay found")
+    for footer in footers:
+        assert miniyaml.load(footer) == miniyaml._load_regex(footer)
+
+    size = sum(len(footer) for footer in footers)
+    print(f"{len(footers)} footers, {size / len(footers):.0f} bytes on average")
+    reference = _time(miniyaml._load_regex, footers, args.repeat)
+    current = _time(miniyaml.load, footers, args.repeat)
+    selective = _time(lambda footer: miniyaml.load(footer, keys=replay._GAME_INFO_KEYS), footers, args.repeat)
+    for name, elapsed in (("reference", reference), ("load", current), ("load keys", selective)):
+        print(
+            f"{name:>9}: {elapsed * 1e6 / len(footers):8.2f} us/footer, {size / elapsed / 1e6:7.2f} MB/s, "
+            f"speedup: {reference / elapsed:.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    run()
@@ -1,12 +1,29 @@
 #!/bin/sh
 
-set -xeu
+set -xu
 
-~/venv/bin/ora-ladder --bans-file /home/ora/bans.list -d db-ra-all.sqlite3      /home/ora/srv-ladder/instance-*/support_dir/Replays/
-~/venv/bin/ora-ladder --bans-file /home/ora/bans.list -d db-ra-2m.sqlite3 -p 2m /home/ora/srv-ladder/instance-*/support_dir/Replays/
-~/venv/bin/ora-ladder --bans-file /home/ora/bans.list -d db-td-all.sqlite3      /home/ora/srv-ladder-td/instance-*/support_dir/Replays/
-~/venv/bin/ora-ladder --bans-file /home/ora/bans.list -d db-td-2m.sqlite3 -p 2m /home/ora/srv-ladder-td/instance-*/support_dir/Replays/
-~/venv/bin/ora-ragl   -d db-ragl.sqlite3   /home/ora/srv-ragl/instance-*/support_dir/Replays/
+# The databases are written in place: ora-ladder atomically replaces them once fully written, while copying them over
+# the published ones would rewrite the files under the feet of the web applications. The arguments of this script are
+# passed to ora-ladder (e.g. --refresh-accounts).
+LADDER_INSTANCE=/home/web/venv/var/ladderweb-instance
+RAGL_INSTANCE=/home/web/venv/var/raglweb-instance
+CATALOG=~/replays-catalog.sqlite3
 
-cp -v db-ragl.sqlite3 /home/web/venv/var/raglweb-instance/
-cp -v db-*-*.sqlite3  /home/web/venv/var/ladderweb-instance/
+# Each database is updated even if a previous one failed (e.g. left unpublished by a reader), the script then exits
+# with a non-zero status
+status=0
+
+~/venv/bin/ora-ladder -i --catalog $CATALOG --bans-file /home/ora/bans.list -d $LADDER_INSTANCE/db-ra-all.sqlite3      --summary $LADDER_INSTANCE/db-ra-summary.sqlite3 "$@" /home/ora/srv-ladder/instance-*/support_dir/Replays/ || status=1
+~/venv/bin/ora-ladder -i --catalog $CATALOG --bans-file /home/ora/bans.list -d $LADDER_INSTANCE/db-ra-2m.sqlite3 -p 2m --summary $LADDER_INSTANCE/db-ra-summary.sqlite3 "$@" /home/ora/srv-ladder/instance-*/support_dir/Replays/ || status=1
+~/venv/bin/ora-ladder -i --catalog $CATALOG --bans-file /home/ora/bans.list -d $LADDER_INSTANCE/db-td-all.sqlite3      --summary $LADDER_INSTANCE/db-td-summary.sqlite3 "$@" /home/ora/srv-ladder-td/instance-*/support_dir/Replays/ || status=1
+~/venv/bin/ora-ladder -i --catalog $CATALOG --bans-file /home/ora/bans.list -d $LADDER_INSTANCE/db-td-2m.sqlite3 -p 2m --summary $LADDER_INSTANCE/db-td-summary.sqlite3 "$@" /home/ora/srv-ladder-td/instance-*/support_dir/Replays/ || status=1
+
+# ora-ragl rebuilds its database in place, it is published by a rename within the same filesystem
+if ~/venv/bin/ora-ragl   -d db-ragl.sqlite3   /home/ora/srv-ragl/instance-*/support_dir/Replays/; then
+    cp -v db-ragl.sqlite3 $RAGL_INSTANCE/db-ragl.sqlite3.tmp &&
+        mv -v $RAGL_INSTANCE/db-ragl.sqlite3.tmp $RAGL_INSTANCE/db-ragl.sqlite3 || status=1
+else
+    status=1
+fi
+
+exit $status
@@ -28,6 +28,7 @@ from flask import (
     send_file,
     jsonify,
 )
+from laddertools.webmetrics import InstrumentedConnection, init_app as init_metrics
 
 from .forfeit_games import (
     get_player_forfeit_games,
@@ -38,7 +39,8 @@ from .playoffs import get_playoff2, get_playoff4, PlayoffOutcome
 
 def _db_get():
     if "db" not in g:
-        g.db = sqlite3.connect(current_app.config["DATABASE"], detect_types=sqlite3.PARSE_DECLTYPES)
+        factory = InstrumentedConnection if current_app.config.get("METRICS", False) else sqlite3.Connection
+        g.db = sqlite3.connect(current_app.config["DATABASE"], detect_types=sqlite3.PARSE_DECLTYPES, factory=factory)
         g.db.row_factory = sqlite3.Row
     return g.db
 
@@ -65,6 +67,8 @@ def create_app():
     cfg_file = os.environ.get("RAGL_CONFIG", op.join(app.instance_path, "ragl_config.py"))
     app.config.from_pyfile(cfg_file)
     app.teardown_appcontext(_db_close)
+    if app.config.get("METRICS", False):
+        init_metrics(app, slow_query_time=app.config.get("SLOW_QUERY_TIME"))
     return app
 
 
@@ -289,7 +293,7 @@ def _get_player_records(db, profile_id):
         FROM outcomes o
         LEFT JOIN players p0 ON p0.profile_id = o.profile_id0
         LEFT JOIN players p1 ON p1.profile_id = o.profile_id1
-        WHERE :pid in (o.profile_id0, o.profile_id1)
+        WHERE o.profile_id0 = :pid OR o.profile_id1 = :pid
         ORDER BY o.end_time ASC""",
         dict(pid=profile_id),
     )
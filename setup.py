@@ -14,6 +14,9 @@ setup(
         "trueskill",
         "pytest",
     ],
+    extras_require=dict(
+        brotli=["brotli"],
+    ),
     entry_points=dict(
         console_scripts=[
             "ora-ladder = laddertools.ladder:run",
@@ -22,6 +25,7 @@ setup(
             "ora-ragl   = laddertools.ragl:run",
             "ora-replay = laddertools.replay:run",
             "ora-srvwrap  = laddertools.srvwrap:run",
+            "ora-upgradedb = laddertools.ladder:upgrade_databases",
         ],
     ),
 )